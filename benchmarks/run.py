@@ -0,0 +1,236 @@
+"""
+Times each stage of syncabook on a synthetic book (see synthetic.py) without network access
+and saves the results as JSON to compare them across releases:
+
+    $ python benchmarks/run.py --chapters 50 --output results.json
+    $ python benchmarks/run.py --chapters 50 --compare results.json
+
+Each stage is run `repeat` times and the best and median wall times are reported.
+Its peak memory is measured by tracemalloc in one more run,
+so the tracing doesn't slow down the timed ones.
+Alignment requires afaligner and real audio, so it's not included:
+the SMIL files are generated with the book.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from syncabook.create import create_ebook
+from syncabook.preflight import check_book
+from syncabook.smil import get_media_durations
+from syncabook.split_text import split_text
+from syncabook.to_xhtml import textfiles_to_xhtml_files
+from syncabook.toc import get_toc
+
+from synthetic import CHAPTER_PATTERN, add_book_arguments, generate_book, get_book_params
+
+
+def get_stages(book_dir, jobs):
+    """
+    Returns a list of (name, setup, run) of the stages in the order of the pipeline.
+    `setup` removes the output of the previous run, so each run starts from the same state.
+    """
+    plaintext_dir = os.path.join(book_dir, 'plaintext')
+    sync_text_dir = os.path.join(book_dir, 'sync_text')
+    smil_dir = os.path.join(book_dir, 'smil')
+    out_dir = os.path.join(book_dir, 'out')
+
+    def remove(*paths):
+        def setup():
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+        return setup
+
+    def no_setup():
+        pass
+
+    def get_smil_paths():
+        return [os.path.join(smil_dir, x) for x in sorted(os.listdir(smil_dir)) if x.endswith('.smil')]
+
+    return [
+        (
+            'split_text',
+            remove(plaintext_dir),
+            lambda: split_text(
+                os.path.join(book_dir, 'text.txt'), plaintext_dir, 'opening', CHAPTER_PATTERN, None
+            ),
+        ),
+        (
+            'to_xhtml',
+            remove(sync_text_dir),
+            lambda: textfiles_to_xhtml_files(plaintext_dir, sync_text_dir, 'sentence', jobs=jobs),
+        ),
+        (
+            'to_xhtml_rules',
+            remove(sync_text_dir),
+            lambda: textfiles_to_xhtml_files(
+                plaintext_dir, sync_text_dir, 'sentence', jobs=jobs, segmenter='rules'
+            ),
+        ),
+        (
+            'check',
+            no_setup,
+            lambda: check_book(book_dir),
+        ),
+        (
+            'media_durations',
+            no_setup,
+            lambda: get_media_durations(get_smil_paths(), jobs=jobs),
+        ),
+        (
+            'toc',
+            no_setup,
+            lambda: get_toc(sync_text_dir, sorted(os.listdir(sync_text_dir))),
+        ),
+        (
+            'create',
+            remove(
+                out_dir,
+                os.path.join(smil_dir, 'durations.json'),
+                os.path.join(book_dir, 'no_sync_text'),
+            ),
+            lambda: create_ebook(book_dir, jobs=jobs, interactive=False),
+        ),
+        (
+            'create_incremental',
+            no_setup,
+            lambda: create_ebook(book_dir, jobs=jobs, interactive=False),
+        ),
+    ]
+
+
+def measure(setup, run, repeat):
+    """
+    Returns wall times of `repeat` runs, their CPU times and the peak memory allocated by a run.
+    Output of the stage is suppressed.
+    """
+    wall_times = []
+    cpu_times = []
+    for i in range(repeat + 1):
+        setup()
+        if i == repeat:
+            tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            run()
+            cpu_time = time.process_time() - cpu_start
+            wall_time = time.perf_counter() - wall_start
+        if i == repeat:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            wall_times.append(wall_time)
+            cpu_times.append(cpu_time)
+    return wall_times, cpu_times, peak_memory
+
+
+def run_benchmarks(book_dir, repeat, jobs, stages=None):
+    results = {}
+    for name, setup, run in get_stages(book_dir, jobs):
+        if stages and name not in stages:
+            # stages depend on the output of the previous ones
+            _run_quietly(setup, run)
+            continue
+        wall_times, cpu_times, peak_memory = measure(setup, run, repeat)
+        results[name] = {
+            'best': round(min(wall_times), 6),
+            'median': round(statistics.median(wall_times), 6),
+            'cpu': round(statistics.median(cpu_times), 6),
+            'peak_memory': peak_memory,
+            'times': [round(t, 6) for t in wall_times],
+        }
+        print(
+            f'{name:>20}: best {results[name]["best"] * 1000:9.1f} ms,'
+            f' median {results[name]["median"] * 1000:9.1f} ms,'
+            f' peak memory {peak_memory / 2**20:7.1f} MB'
+        )
+    return results
+
+
+def _run_quietly(setup, run):
+    setup()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+
+
+def compare(results, previous):
+    print(f'\nCompared with {previous.get("version")} ({previous.get("date")}):')
+    for name, result in results['stages'].items():
+        previous_result = previous['stages'].get(name)
+        if previous_result is None:
+            continue
+        ratio = result['best'] / previous_result['best'] if previous_result['best'] else float('inf')
+        memory_ratio = (
+            result['peak_memory'] / previous_result['peak_memory']
+            if previous_result['peak_memory'] else float('inf')
+        )
+        print(f'{name:>20}: time x{ratio:.2f}, peak memory x{memory_ratio:.2f}')
+
+
+def get_version():
+    try:
+        from importlib.metadata import version
+        return version('syncabook')
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark syncabook stages on a synthetic book.')
+    add_book_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--j', '--jobs', dest='jobs', type=int, default=1)
+    parser.add_argument(
+        '--stages', nargs='+',
+        help='Stages to measure. All stages are run, but only these are measured.'
+    )
+    parser.add_argument('--output', help='File to save JSON results to.')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with.')
+    parser.add_argument(
+        '--book-dir', dest='book_dir',
+        help='Directory to generate the book in. Defaults to a temporary directory that is removed.'
+    )
+    args = parser.parse_args()
+
+    params = get_book_params(args)
+    with tempfile.TemporaryDirectory(prefix='syncabook-benchmark-') as tmp_dir:
+        book_dir = args.book_dir or os.path.join(tmp_dir, 'book')
+        words_num = generate_book(book_dir, **params)
+        print(f'Synthetic book: {args.chapters} chapters, {words_num} words.')
+        stages = run_benchmarks(book_dir, args.repeat, args.jobs, args.stages)
+
+    results = {
+        'version': get_version(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'book': {**params, 'words_num': words_num},
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'stages': stages,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
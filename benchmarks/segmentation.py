@@ -0,0 +1,64 @@
+"""
+Compares the speed of sentence segmenters on a plain text file, e.g. a Gutenberg novel:
+
+    $ python benchmarks/segmentation.py pg1342.txt
+
+The character loop that `to_xhtml` used before is included as a baseline.
+"""
+import argparse
+import time
+
+from syncabook.segmentation import SEGMENTERS, get_segmenter
+from syncabook.to_xhtml import _get_paragraphs_contents
+
+
+def legacy_get_sentences(text):
+    sentence_endings = {'.', '!', '?'}
+    fragments = []
+    sentence_start_idx = 0
+    sentence_ended = False
+    for i, c in enumerate(text):
+        if i == len(text) - 1:
+            fragments.append(text[sentence_start_idx:i+1])
+        if c in sentence_endings:
+            sentence_ended = True
+            continue
+        if sentence_ended and c == ' ':
+            fragments.append(text[sentence_start_idx:i+1])
+            sentence_start_idx = i+1
+        sentence_ended = False
+    return fragments
+
+
+def measure(segment, paragraphs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sentences_num = sum(len(segment(p)) for p in paragraphs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sentences_num
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sentence segmenters.')
+    parser.add_argument('text_file')
+    parser.add_argument('--l', '--language', dest='language', default='eng')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.text_file, 'r') as f:
+        paragraphs = _get_paragraphs_contents(f.read())
+    print(f'{len(paragraphs)} paragraphs, {sum(len(p) for p in paragraphs)} characters')
+
+    segmenters = [('legacy', legacy_get_sentences)]
+    segmenters += [(name, get_segmenter(name, args.language)) for name in SEGMENTERS]
+    baseline = None
+    for name, segment in segmenters:
+        elapsed, sentences_num = measure(segment, paragraphs, args.repeat)
+        baseline = baseline or elapsed
+        print(f'{name:>8}: {elapsed * 1000:8.1f} ms, {sentences_num} sentences, x{baseline / elapsed:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how long the CLI takes to start for each command using `python -X importtime`:
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py split_text --budget 50
+
+Each command is run with --help in a new interpreter `repeat` times
+and the best total import time and wall time are reported along with the slowest imports.
+Exits with an error if the import time of a command exceeds `budget` milliseconds.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+
+COMMANDS = (
+    'download_files', 'split_text', 'to_xhtml', 'check', 'prepare_audio', 'sync', 'create', 'watch', 'batch',
+)
+
+
+def parse_importtime(output):
+    """
+    Returns a list of (self_us, cumulative_us, depth, module) of the imports
+    reported by `python -X importtime` in `output`.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        imports.append((int(self_us), int(cumulative_us), depth, module))
+    return imports
+
+
+def measure_startup(command, repeat=5):
+    """
+    Returns the best total import time in microseconds, the best wall time in seconds
+    and the imports of the run with the best import time.
+    """
+    best = None
+    best_wall_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', 'syncabook', command, '--help'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+        )
+        wall_time = time.perf_counter() - start
+        imports = parse_importtime(completed.stderr.decode())
+        total = sum(cumulative_us for _, cumulative_us, depth, _ in imports if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, imports)
+        best_wall_time = wall_time if best_wall_time is None else min(best_wall_time, wall_time)
+    return best[0], best_wall_time, best[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure startup time of the syncabook CLI.')
+    parser.add_argument('commands', nargs='*', default=COMMANDS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, help='Maximum import time in milliseconds.')
+    parser.add_argument('--top', type=int, default=5, help='Number of the slowest imports to show.')
+    args = parser.parse_args()
+
+    over_budget = []
+    for command in args.commands:
+        total_us, wall_time, imports = measure_startup(command, args.repeat)
+        print(f'{command:>16}: imports {total_us / 1000:7.1f} ms, wall {wall_time * 1000:7.1f} ms')
+        slowest = sorted((x for x in imports if x[2] == 0), reverse=True, key=lambda x: x[1])
+        for _, cumulative_us, _, module in slowest[:args.top]:
+            print(f'{"":>18}{module} {cumulative_us / 1000:.1f} ms')
+        if args.budget is not None and total_us / 1000 > args.budget:
+            over_budget.append(command)
+
+    if over_budget:
+        print(f'❌ Startup of {", ".join(over_budget)} exceeds the budget of {args.budget} ms.')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
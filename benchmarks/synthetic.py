@@ -0,0 +1,173 @@
+"""
+Generates a synthetic book that can be processed by syncabook without network access:
+
+    book_dir/
+        text.txt        chapters starting with "CHAPTER <number>"
+        audio/          MP3 files of valid consecutive frames with zero payload
+        smil/           SMIL files with `clips` clips per chapter
+        metadata.json
+
+    $ python benchmarks/synthetic.py book_dir --chapters 50 --paragraphs 100
+
+The same arguments and `seed` always give the same book.
+"""
+import argparse
+import json
+import os
+import random
+
+
+CHAPTER_PATTERN = r'\n\nCHAPTER \d+\n\n'
+
+WORDS = (
+    'the of and to in that it was his he with as for had you not be her on at by which have or'
+    ' from this him but all she they were my are me one their so an said them we who would been'
+    ' will no when there if more out up into do any your what has man could other than our some'
+    ' very time upon about may its only now like little then can should made did us such a great'
+    ' before must two these see know over much down after first mr good men own never most old'
+    ' shall day where those came come himself way work life without go make well through being'
+    ' long say might how am too even under new same last while state government'
+).split()
+
+# MPEG-1 Layer III, 128 kbps, 44100 Hz frames of 1152 samples, so 16000 bytes last one second.
+# A frame is 144 * 128000 / 44100 = 417.96 bytes long, so most frames are padded to 418 bytes.
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_PADDED_FRAME_HEADER = b'\xff\xfb\x92\x00'
+MP3_BITRATE = 128000
+MP3_SAMPLE_RATE = 44100
+MP3_SAMPLES_PER_FRAME = 1152
+
+SMIL_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<smil xmlns="http://www.w3.org/ns/SMIL" xmlns:epub="http://www.idpf.org/2007/ops"'
+    ' version="3.0">\n'
+    '<body>\n'
+    '<seq id="seq1" epub:textref="../text/{name}.xhtml" epub:type="bodymatter chapter">\n'
+)
+SMIL_PAR = (
+    '<par id="par{i}">'
+    '<text src="../text/{name}.xhtml#f{i}"/>'
+    '<audio src="../audio/{name}.mp3" clipBegin="{begin}" clipEnd="{end}"/>'
+    '</par>\n'
+)
+SMIL_FOOTER = '</seq>\n</body>\n</smil>\n'
+
+
+def generate_book(
+    book_dir, chapters=10, paragraphs=50, sentences=5, words=12,
+    clips=500, audio_seconds=60, seed=0,
+):
+    """
+    Generates a book of `chapters` chapters of `paragraphs` paragraphs
+    of `sentences` sentences of about `words` words in `book_dir`.
+    Each chapter has an audio file that lasts `audio_seconds`
+    and a SMIL file of `clips` clips that cover it.
+    Returns the number of words in the book.
+    """
+    rng = random.Random(seed)
+    width = len(str(chapters))
+    os.makedirs(os.path.join(book_dir, 'audio'), exist_ok=True)
+    os.makedirs(os.path.join(book_dir, 'smil'), exist_ok=True)
+
+    words_num = 0
+    with open(os.path.join(book_dir, 'text.txt'), 'w') as f:
+        f.write('SYNTHETIC BOOK')
+        for chapter in range(1, chapters + 1):
+            f.write(f'\n\nCHAPTER {chapter}\n\n')
+            for paragraph in range(paragraphs):
+                if paragraph > 0:
+                    f.write('\n\n')
+                paragraph_sentences = []
+                for _ in range(sentences):
+                    sentence_words = rng.choices(WORDS, k=max(1, words + rng.randint(-3, 3)))
+                    words_num += len(sentence_words)
+                    sentence = ' '.join(sentence_words).capitalize()
+                    paragraph_sentences.append(sentence + rng.choice('..........!?'))
+                f.write(' '.join(paragraph_sentences))
+        f.write('\n')
+
+    audio_blob = get_mp3_blob(audio_seconds)
+    for chapter in range(1, chapters + 1):
+        name = f'{chapter:0>{width}}'
+        with open(os.path.join(book_dir, 'audio', f'{name}.mp3'), 'wb') as f:
+            f.write(audio_blob)
+        with open(os.path.join(book_dir, 'smil', f'{name}.smil'), 'w') as f:
+            f.write(SMIL_HEADER.format(name=name))
+            for i in range(1, clips + 1):
+                f.write(SMIL_PAR.format(
+                    name=name, i=i,
+                    begin=_to_clockvalue(audio_seconds * (i - 1) / clips),
+                    end=_to_clockvalue(audio_seconds * i / clips),
+                ))
+            f.write(SMIL_FOOTER)
+
+    with open(os.path.join(book_dir, 'metadata.json'), 'w') as f:
+        json.dump({
+            'title': 'Synthetic Book',
+            'author': 'Benchmark',
+            'description': f'{chapters} chapters generated with seed {seed}.',
+            'narrator': 'Nobody',
+        }, f, indent=2)
+
+    return words_num
+
+
+def get_mp3_blob(seconds):
+    """
+    Returns MP3 audio that lasts about `seconds` made of consecutive silent frames.
+    Frames are padded the way encoders do it, so that the size matches the bitrate.
+    """
+    frames_num = round(seconds * MP3_SAMPLE_RATE / MP3_SAMPLES_PER_FRAME)
+    frame_size = 144 * MP3_BITRATE // MP3_SAMPLE_RATE
+    frames = []
+    size = 0
+    for i in range(1, frames_num + 1):
+        next_size = 144 * MP3_BITRATE * i // MP3_SAMPLE_RATE
+        header = MP3_FRAME_HEADER if next_size - size == frame_size else MP3_PADDED_FRAME_HEADER
+        frames.append(header + bytes(next_size - size - len(header)))
+        size = next_size
+    return b''.join(frames)
+
+
+def _to_clockvalue(seconds):
+    ms = round(seconds * 1000)
+    return f'{ms // 3600000}:{ms // 60000 % 60:0>2}:{ms // 1000 % 60:0>2}.{ms % 1000:0>3}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic book.')
+    parser.add_argument('book_dir')
+    add_book_arguments(parser)
+    args = parser.parse_args()
+
+    words_num = generate_book(args.book_dir, **get_book_params(args))
+    print(f'✔ The book of {args.chapters} chapters and {words_num} words is generated.')
+
+
+def add_book_arguments(parser):
+    parser.add_argument('--chapters', type=int, default=10)
+    parser.add_argument('--paragraphs', type=int, default=50, help='Paragraphs per chapter.')
+    parser.add_argument('--sentences', type=int, default=5, help='Sentences per paragraph.')
+    parser.add_argument('--words', type=int, default=12, help='Average words per sentence.')
+    parser.add_argument('--clips', type=int, default=500, help='SMIL clips per chapter.')
+    parser.add_argument(
+        '--audio-seconds', dest='audio_seconds', type=int, default=60,
+        help='Duration of each audio file. Its size is 16 KB per second.'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def get_book_params(args):
+    return {
+        'chapters': args.chapters,
+        'paragraphs': args.paragraphs,
+        'sentences': args.sentences,
+        'words': args.words,
+        'clips': args.clips,
+        'audio_seconds': args.audio_seconds,
+        'seed': args.seed,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
 import argparse
+import json
 
-from .create import create_ebook
-from .download_files import download_files
-from .split_text import split_text
-from .sync import sync
-from .to_xhtml import textfiles_to_xhtml_files
+from . import profiling
+from .defaults import DOWNLOAD_JOBS, MAX_DEVIATION, SAMPLE_RATE, WATCH_INTERVAL
 
 
 def main():
@@ -36,6 +34,32 @@ def main():
         default=False,
         help='Do not download audio files.'
     )
+    parser_download.add_argument(
+        '--j', '--jobs',
+        dest='jobs', type=int, default=DOWNLOAD_JOBS,
+        help=f'Number of files to download in parallel. Defaults to {DOWNLOAD_JOBS}.'
+    )
+    parser_download.add_argument(
+        '--audio-source',
+        choices=['zip', 'tracks'],
+        dest='audio_source',
+        default='zip',
+        help=(
+            'zip downloads the audiobook ZIP archive extracting audio files as they arrive.'
+            ' tracks downloads MP3 files of the chapters listed on the LibriVox page in parallel.'
+            ' Defaults to zip.'
+        )
+    )
+    parser_download.add_argument(
+        '--offline',
+        action='store_true',
+        dest='offline',
+        default=False,
+        help=(
+            'Do not access the network: take web pages and listings from the cache'
+            ' and use only files that have already been downloaded.'
+        )
+    )
 
     parser_split = subparsers.add_parser(
         'split_text',
@@ -53,6 +77,14 @@ def main():
         )
     )
     parser_split.add_argument('--n', dest='n', type=int)
+    parser_split.add_argument(
+        '--b', '--balance', dest='balance', choices=['words', 'chars'], default='words',
+        help=(
+            'Determines how parts are balanced in equal mode:'
+            ' by the number of words, which is proportional to the duration of audio,'
+            ' or by the number of characters. Defaults to words.'
+        )
+    )
     parser_split.add_argument('--p', '--pattern', dest='pattern')
 
     parser_to_xhtml = subparsers.add_parser(
@@ -75,6 +107,82 @@ def main():
         default=False,
         help='Convert first paragraph to a heading.'
     )
+    parser_to_xhtml.add_argument(
+        '--j', '--jobs',
+        dest='jobs', type=int, default=1,
+        help=(
+            'Number of text files to convert in parallel.'
+            ' If not specified, files are converted one by one.'
+        )
+    )
+    parser_to_xhtml.add_argument(
+        '--s', '--segmenter',
+        choices=['simple', 'rules'],
+        dest='segmenter',
+        default='simple',
+        help=(
+            'Determines how text is splitted into sentences.'
+            ' simple splits after ".", "!" or "?" followed by a space.'
+            ' rules also takes into account closing quotes, abbreviations and initials'
+            ' of the text\'s language. Defaults to simple.'
+        )
+    )
+    parser_to_xhtml.add_argument(
+        '--l', '--language',
+        dest='language', type=str, default='eng',
+        help=(
+            'Language of the text for the rules segmenter. It needs to be a 3-letter code'
+            ' as for the sync command. Defaults to "eng" for English.'
+        )
+    )
+
+    parser_check = subparsers.add_parser(
+        'check',
+        description=(
+            'Check that text and audio files can be synced before running the alignment.'
+            ' Text files are paired with audio files in sorted order,'
+            ' the duration of each audio file is compared with the reading time'
+            ' of its text estimated by the number of words.'
+            ' Exits with an error if the numbers of files differ or some pairs don\'t match.'
+        )
+    )
+    parser_check.add_argument('book_dir')
+    parser_check.add_argument(
+        '--wpm', '--words-per-minute',
+        dest='words_per_minute', type=float,
+        help=(
+            'Narration rate to estimate reading time with.'
+            ' If not specified, it\'s measured as the median rate of the book\'s chapters.'
+        )
+    )
+    parser_check.add_argument(
+        '--max-deviation',
+        dest='max_deviation', type=float, default=MAX_DEVIATION,
+        help=(
+            'How many times the audio may be longer or shorter than the expected reading time.'
+            f' Defaults to {MAX_DEVIATION}.'
+        )
+    )
+
+    parser_prepare_audio = subparsers.add_parser(
+        'prepare_audio',
+        description=(
+            'Decode audio files to mono WAV files with a low sample rate for alignment.'
+            ' sync and create use the prepared files instead of decoding the original ones'
+            ' on every run, but the original files are packaged into the ebook. Requires ffmpeg.'
+        )
+    )
+    parser_prepare_audio.add_argument('book_dir')
+    parser_prepare_audio.add_argument(
+        '--j', '--jobs',
+        dest='jobs', type=int,
+        help='Number of audio files to convert in parallel. Defaults to the number of CPUs.'
+    )
+    parser_prepare_audio.add_argument(
+        '--sample-rate',
+        dest='sample_rate', type=int, default=SAMPLE_RATE,
+        help=f'Sample rate of the prepared files. Defaults to {SAMPLE_RATE}.'
+    )
 
     parser_sync = subparsers.add_parser(
         'sync',
@@ -84,6 +192,17 @@ def main():
         )
     )
     parser_sync.add_argument('book_dir')
+    parser_sync.add_argument(
+        '--resume',
+        action='store_true',
+        dest='resume',
+        default=False,
+        help=(
+            'Sync only chapters whose SMIL files are missing or stale'
+            ' according to the journal of the previous synchronization.'
+            ' Text files are paired with audio files, so their numbers must match.'
+        )
+    )
 
     parser_create = subparsers.add_parser(
         'create',
@@ -106,8 +225,77 @@ def main():
         )
     )
 
-    # arguments common to both parsers
-    for p in (parser_sync, parser_create):
+    parser_watch = subparsers.add_parser(
+        'watch',
+        description=(
+            'Create the ebook like create does and recreate it every time files of book_dir change'
+            ' until interrupted. Only changed files of the ebook are rewritten.'
+            ' nav.xhtml is regenerated when headings change unless it has been edited by hand.'
+        )
+    )
+    parser_watch.add_argument('book_dir')
+    parser_watch.add_argument(
+        '--interval',
+        dest='interval', type=float, default=WATCH_INTERVAL,
+        help=f'Seconds between checks for changes. Defaults to {WATCH_INTERVAL}.'
+    )
+    parser_watch.add_argument(
+        '--poll',
+        action='store_false',
+        dest='use_inotify',
+        default=True,
+        help='Poll for changes even if inotify_simple is installed.'
+    )
+
+    for p in (parser_create, parser_watch):
+        p.add_argument(
+            '--compression-level',
+            dest='compresslevel', type=int, choices=range(0, 10), metavar='[0-9]',
+            help=(
+                'Deflate level for XHTML, SMIL and other text files of the ebook.'
+                ' Audio and images are always stored uncompressed.'
+                ' Defaults to zlib\'s default level.'
+            )
+        )
+    parser_create.add_argument(
+        '--prepare-audio',
+        action='store_true',
+        dest='prepare_audio',
+        default=False,
+        help='Run prepare_audio before synchronization.'
+    )
+
+    parser_batch = subparsers.add_parser(
+        'batch',
+        description=(
+            'Create ebooks for all books listed in a batch manifest without any prompts.'
+            ' For each book download, split_text, to_xhtml, sync and create are performed'
+            ' unless their output already exists.'
+            ' See syncabook.batch.batch for the manifest format.'
+        )
+    )
+    parser_batch.add_argument('manifest')
+    parser_batch.add_argument(
+        '--summary',
+        dest='summary_path',
+        help='File to save JSON summary of the results to. If not specified, it is printed.'
+    )
+    parser_batch.add_argument(
+        '--sync-workers',
+        dest='sync_workers', type=int, default=1,
+        help='Number of books to sync in parallel. Defaults to 1.'
+    )
+    parser_batch.add_argument(
+        '--io-workers',
+        dest='io_workers', type=int, default=4,
+        help=(
+            'Number of books to download, convert and package in parallel'
+            ' while others are being synced. Defaults to 4.'
+        )
+    )
+
+    # arguments common to the parsers that may sync
+    for p in (parser_sync, parser_create, parser_watch):
         p.add_argument(
             '--l', '--language',
             dest='language', type=str, default='eng',
@@ -136,37 +324,208 @@ def main():
                 ' If not specified, afaligner\'s default value is used.'
             )
         )
+        p.add_argument(
+            '--j', '--jobs',
+            dest='jobs', type=int, default=1,
+            help=(
+                'Number of chapters to sync in parallel.'
+                ' If greater than 1, each text file is paired with the audio file'
+                ' at the same position in sorted order, so their numbers must match.'
+                ' Defaults to 1, i.e. the whole book is synced by a single afaligner call.'
+            )
+        )
+        p.add_argument(
+            '--by-chapter',
+            action='store_true',
+            dest='by_chapter',
+            default=False,
+            help=(
+                'Pair each text file with the audio file at the same position in sorted order'
+                ' and sync chapters one by one, so that an interrupted synchronization'
+                ' can be resumed. Implied by --jobs greater than 1.'
+            )
+        )
+        p.add_argument(
+            '--cache-dir',
+            dest='cache_dir',
+            help=(
+                'Directory to cache alignment results in.'
+                ' Defaults to ~/.cache/syncabook/alignment shared by all books.'
+            )
+        )
+        p.add_argument(
+            '--no-cache',
+            action='store_false',
+            dest='use_cache',
+            default=True,
+            help='Align all chapters even if the results are cached.'
+        )
+
+    # arguments common to all parsers
+    for p in subparsers.choices.values():
+        p.add_argument(
+            '--profile',
+            action='store_true',
+            dest='profile',
+            default=False,
+            help=(
+                'Print wall time, CPU time, bytes read and written and peak RSS'
+                ' of each stage to stderr when the command ends.'
+            )
+        )
+        p.add_argument(
+            '--trace-file',
+            dest='trace_file',
+            help=(
+                'File to save the stages and chapters processed by the command to'
+                ' as Chrome trace events. It can be opened in chrome://tracing or ui.perfetto.dev.'
+            )
+        )
 
     args = parser.parse_args()
 
+    if args.profile or args.trace_file:
+        profiling.enable()
+    try:
+        with profiling.stage(args.command):
+            run_command(args)
+    finally:
+        if args.trace_file:
+            profiling.write_trace(args.trace_file)
+        if args.profile:
+            profiling.print_summary()
+
+
+def run_command(args):
+    # Modules that implement the commands are imported only when the command is run,
+    # so that the CLI starts fast.
     if args.command == 'download_files':
-        download_files(
-            args.librivox_url, args.output_dir,
-            skip_text=args.skip_text,
-            skip_audio=args.skip_audio
-        )
+        from .download_files import download_files
+        from .downloader import DownloadError, OfflineError
+
+        try:
+            download_files(
+                args.librivox_url, args.output_dir,
+                skip_text=args.skip_text,
+                skip_audio=args.skip_audio,
+                jobs=args.jobs,
+                audio_source=args.audio_source,
+                offline=args.offline,
+            )
+        except (DownloadError, OfflineError) as e:
+            print(e)
+            exit(1)
     elif args.command == 'split_text':
-        split_text(args.textfile, args.output_dir, args.mode, args.pattern, args.n)
+        from .split_text import split_text
+
+        split_text(args.textfile, args.output_dir, args.mode, args.pattern, args.n, args.balance)
     elif args.command == 'to_xhtml':
+        from .to_xhtml import textfiles_to_xhtml_files
+
         textfiles_to_xhtml_files(
             args.input_dir, args.output_dir,
             fragment_type=args.fragment_type,
             include_heading=args.include_heading,
-            )
-    elif args.command == 'sync':
-        sync(
-            args.book_dir,
-            alignment_radius=args.alignment_radius,
-            alignment_skip_penalty=args.alignment_skip_penalty,
+            jobs=args.jobs,
+            segmenter=args.segmenter,
             language=args.language,
         )
-    elif args.command == 'create':
-        create_ebook(
+    elif args.command == 'check':
+        from .preflight import check_book, print_report
+
+        report = check_book(
             args.book_dir,
-            alignment_radius=args.alignment_radius,
-            alignment_skip_penalty=args.alignment_skip_penalty,
-            language=args.language,
+            words_per_minute=args.words_per_minute,
+            max_deviation=args.max_deviation,
+        )
+        print_report(report)
+        if report['problems']:
+            exit(1)
+    elif args.command == 'prepare_audio':
+        from .audio import PrepareAudioError, prepare_audio
+        from .utils import MissingDependencyError
+
+        try:
+            prepare_audio(args.book_dir, jobs=args.jobs, sample_rate=args.sample_rate)
+        except (PrepareAudioError, MissingDependencyError) as e:
+            print(e)
+            exit(1)
+    elif args.command == 'sync':
+        from .book import Book
+        from .sync import SyncError
+        from .utils import MissingDependencyError
+
+        try:
+            Book(args.book_dir, language=args.language, jobs=args.jobs).sync(
+                alignment_radius=args.alignment_radius,
+                alignment_skip_penalty=args.alignment_skip_penalty,
+                cache_dir=args.cache_dir,
+                use_cache=args.use_cache,
+                resume=args.resume,
+                by_chapter=args.by_chapter,
+            )
+        except (SyncError, MissingDependencyError) as e:
+            print(e)
+            exit(1)
+    elif args.command == 'create':
+        from .audio import PrepareAudioError
+        from .book import Book
+        from .sync import SyncError
+        from .utils import MissingDependencyError
+
+        try:
+            Book(args.book_dir, language=args.language, jobs=args.jobs).create(
+                alignment_radius=args.alignment_radius,
+                alignment_skip_penalty=args.alignment_skip_penalty,
+                compresslevel=args.compresslevel,
+                cache_dir=args.cache_dir,
+                use_cache=args.use_cache,
+                prepare_audio=args.prepare_audio,
+                by_chapter=args.by_chapter,
+            )
+        except (SyncError, PrepareAudioError, MissingDependencyError) as e:
+            print(e)
+            exit(1)
+    elif args.command == 'watch':
+        from .sync import SyncError
+        from .utils import MissingDependencyError
+        from .watch import watch
+
+        try:
+            watch(
+                args.book_dir,
+                interval=args.interval,
+                use_inotify=args.use_inotify,
+                alignment_radius=args.alignment_radius,
+                alignment_skip_penalty=args.alignment_skip_penalty,
+                language=args.language,
+                compresslevel=args.compresslevel,
+                jobs=args.jobs,
+                cache_dir=args.cache_dir,
+                use_cache=args.use_cache,
+                by_chapter=args.by_chapter,
+            )
+        except (SyncError, MissingDependencyError) as e:
+            print(e)
+            exit(1)
+    elif args.command == 'batch':
+        from .batch import batch
+
+        summary = batch(
+            args.manifest,
+            summary_path=args.summary_path,
+            sync_workers=args.sync_workers,
+            io_workers=args.io_workers,
         )
+        if args.summary_path is None:
+            print(json.dumps(summary, indent=2))
+        for result in summary['books']:
+            if result['status'] == 'ok':
+                print(f'✔ {result["book_dir"]}: {result["ebook"]}')
+            else:
+                print(f'❌ {result["book_dir"]}: {result["error"]}')
+        if summary['failed'] > 0:
+            exit(1)
 
 
 if __name__ == '__main__':
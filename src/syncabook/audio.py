@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+from .defaults import SAMPLE_RATE
+from .epub import listdir
+from .utils import MissingDependencyError, drop_extension
+
+
+PREPARED_AUDIO_DIRNAME = 'prepared_audio'
+
+# sidecar file in prepared_audio/ that records the source of each WAV file
+SOURCES_FILENAME = 'sources.json'
+
+# Tables to read MPEG audio frame headers indexed by
+# the version bits (0: MPEG 2.5, 2: MPEG 2, 3: MPEG 1) and the layer bits (1: III, 2: II, 3: I).
+MPEG_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+# An MP3 file is scanned for the first frame only within this many bytes after the ID3 tag.
+MP3_SCAN_SIZE = 64 * 1024
+
+
+class PrepareAudioError(Exception):
+    """
+    Raised when some audio files fail to convert.
+    `failures` maps names of the audio files to error messages.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('\n'.join(
+            f'❌ Failed to prepare {audio_file}: {error}' for audio_file, error in sorted(failures.items())
+        ))
+
+
+def prepare_audio(book_dir, jobs=None, sample_rate=SAMPLE_RATE):
+    """
+    Decodes each audio file in audio/ once to a mono 16-bit PCM WAV file with `sample_rate`
+    and saves it to prepared_audio/, so that alignment doesn't decode full-rate audio on every run.
+    Files are converted by `jobs` parallel ffmpeg processes.
+    Files that have been prepared from the same source with the same sample rate are skipped.
+    The original files are still the ones packaged into the ebook.
+    """
+    if shutil.which('ffmpeg') is None:
+        raise MissingDependencyError('ffmpeg', 'Preparing audio')
+
+    audio_dir = os.path.join(book_dir, 'audio')
+    prepared_dir = os.path.join(book_dir, PREPARED_AUDIO_DIRNAME)
+    os.makedirs(prepared_dir, exist_ok=True)
+
+    audio_filenames = listdir(audio_dir)
+    wav_filenames = [f'{drop_extension(x)}.wav' for x in audio_filenames]
+    if len(set(wav_filenames)) != len(wav_filenames):
+        raise ValueError('\n❌ Names of audio files must differ not only by extension.\n')
+
+    sources = _read_sources(prepared_dir)
+    prepared = get_prepared_audio(book_dir, sources)
+    pending = [
+        (audio_filename, wav_filename)
+        for audio_filename, wav_filename in zip(audio_filenames, wav_filenames)
+        if prepared.get(audio_filename, (None, None))[1] != sample_rate
+    ]
+
+    if pending:
+        print(f'Preparing {len(pending)} audio files for alignment...')
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            (audio_filename, wav_filename, executor.submit(
+                _convert,
+                os.path.join(audio_dir, audio_filename),
+                os.path.join(prepared_dir, wav_filename),
+                sample_rate,
+            ))
+            for audio_filename, wav_filename in pending
+        ]
+        for audio_filename, wav_filename, future in futures:
+            try:
+                future.result()
+            except subprocess.CalledProcessError as e:
+                failures[audio_filename] = e.stderr.decode(errors='replace').strip() or str(e)
+                sources.pop(audio_filename, None)
+                continue
+            except OSError as e:
+                failures[audio_filename] = str(e)
+                sources.pop(audio_filename, None)
+                continue
+            st = os.stat(os.path.join(audio_dir, audio_filename))
+            sources[audio_filename] = {
+                'wav': wav_filename,
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'sample_rate': sample_rate,
+            }
+
+    # forget WAV files of audio files that have been removed
+    for audio_filename in set(sources) - set(audio_filenames):
+        wav_path = os.path.join(prepared_dir, sources.pop(audio_filename)['wav'])
+        if os.path.exists(wav_path):
+            os.remove(wav_path)
+
+    _write_sources(prepared_dir, sources)
+
+    if failures:
+        raise PrepareAudioError(failures)
+
+    print(f'✔ {len(audio_filenames)} audio files are prepared for alignment.')
+
+
+def get_prepared_audio(book_dir, sources=None):
+    """
+    Returns a dict that maps names of audio files in audio/ to paths of their prepared WAV files
+    and their sample rates. Files that have changed since they were prepared are omitted.
+    """
+    audio_dir = os.path.join(book_dir, 'audio')
+    prepared_dir = os.path.join(book_dir, PREPARED_AUDIO_DIRNAME)
+    if sources is None:
+        sources = _read_sources(prepared_dir)
+
+    prepared = {}
+    for audio_filename, record in sources.items():
+        wav_path = os.path.join(prepared_dir, record['wav'])
+        try:
+            st = os.stat(os.path.join(audio_dir, audio_filename))
+        except FileNotFoundError:
+            continue
+        if (
+            record.get('size') == st.st_size
+            and record.get('mtime') == st.st_mtime_ns
+            and os.path.exists(wav_path)
+        ):
+            prepared[audio_filename] = (wav_path, record['sample_rate'])
+    return prepared
+
+
+def _convert(audio_path, wav_path, sample_rate):
+    # ffmpeg chooses the format by extension, so it's given explicitly for the temporary file
+    tmp_path = os.path.join(os.path.dirname(wav_path), f'.{os.path.basename(wav_path)}.tmp')
+    try:
+        subprocess.run(
+            [
+                'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                '-i', audio_path,
+                '-vn', '-ac', '1', '-ar', str(sample_rate), '-c:a', 'pcm_s16le',
+                '-f', 'wav', tmp_path,
+            ],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        os.replace(tmp_path, wav_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_sources(prepared_dir):
+    try:
+        with open(os.path.join(prepared_dir, SOURCES_FILENAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_sources(prepared_dir, sources):
+    path = os.path.join(prepared_dir, SOURCES_FILENAME)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(dict(sorted(sources.items())), f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def get_audio_duration(path):
+    """
+    Returns the duration of the MP3 or WAV file at `path` in seconds
+    or None if the format is not supported.
+    The duration is computed from the headers, so the audio is not decoded.
+    """
+    with open(path, 'rb') as f:
+        start = f.read(12)
+        f.seek(0)
+        if start[:4] == b'RIFF' and start[8:12] == b'WAVE':
+            return _get_wav_duration(f)
+        return _get_mp3_duration(f, os.fstat(f.fileno()).st_size)
+
+
+def _get_wav_duration(f):
+    file_size = os.fstat(f.fileno()).st_size
+    f.seek(12)
+    byte_rate = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack('<8xI', f.read(12))[0]
+            chunk_size -= 12
+        elif chunk_id == b'data':
+            if byte_rate is None or byte_rate == 0:
+                return None
+            # the size of a streamed file is often left unknown
+            data_size = min(chunk_size, file_size - f.tell())
+            return data_size / byte_rate
+        # chunks are padded to an even size
+        f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _get_mp3_duration(f, file_size):
+    """
+    Finds the first MPEG audio frame after the ID3v2 tag that is followed by another frame,
+    so that bytes of other formats that happen to look like a frame header are skipped.
+    The number of frames is taken from its Xing/Info or VBRI header if there is one,
+    otherwise the file is assumed to have a constant bitrate.
+    """
+    audio_start = 0
+    header = f.read(10)
+    if header[:3] == b'ID3' and len(header) == 10:
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7f)
+        audio_start = 10 + size + (10 if header[5] & 0x10 else 0)
+
+    f.seek(audio_start)
+    data = f.read(MP3_SCAN_SIZE)
+    frame = None
+    for i in range(len(data) - 3):
+        if data[i] != 0xff:
+            continue
+        frame = _parse_mpeg_frame_header(data[i:i+4])
+        if frame is None:
+            continue
+        next_i = i + _get_mpeg_frame_size(data[i:i+4], frame)
+        if audio_start + next_i == file_size:
+            # the only frame
+            break
+        next_frame = _parse_mpeg_frame_header(data[next_i:next_i+4])
+        if next_frame is not None and next_frame[:2] == frame[:2] and next_frame[3] == frame[3]:
+            break
+        frame = None
+    if frame is None:
+        return None
+    version, layer, bitrate, sample_rate, mono = frame
+    samples_per_frame = 384 if layer == 3 else 576 if layer == 1 and version != 3 else 1152
+
+    # Xing header follows side information, VBRI header always starts at offset 36
+    side_info_size = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+    xing_offset = i + 4 + side_info_size
+    if data[xing_offset:xing_offset+4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing_offset+4:xing_offset+8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', data[xing_offset+8:xing_offset+12])[0]
+            return frames * samples_per_frame / sample_rate
+    if data[i+36:i+40] == b'VBRI':
+        frames = struct.unpack('>I', data[i+50:i+54])[0]
+        return frames * samples_per_frame / sample_rate
+
+    audio_size = file_size - audio_start - i
+    if file_size >= 128:
+        f.seek(file_size - 128)
+        if f.read(3) == b'TAG':
+            # ID3v1 tag
+            audio_size -= 128
+    return audio_size * 8 / (bitrate * 1000)
+
+
+def _get_mpeg_frame_size(header, frame):
+    """
+    Returns the size in bytes of the MPEG audio frame including its header.
+    """
+    version, layer, bitrate, sample_rate, _ = frame
+    padding = (header[2] >> 1) & 1
+    if layer == 3:
+        # Layer I
+        return (12 * bitrate * 1000 // sample_rate + padding) * 4
+    if layer == 1 and version != 3:
+        # Layer III of MPEG-2 and MPEG-2.5
+        return 72 * bitrate * 1000 // sample_rate + padding
+    return 144 * bitrate * 1000 // sample_rate + padding
+
+
+def _parse_mpeg_frame_header(header):
+    """
+    Returns (version, layer, bitrate in kbps, sample_rate, mono) of the MPEG audio frame header
+    or None if `header` is not a valid one.
+    """
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = MPEG_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    mono = header[3] >> 6 == 3
+    return version, layer, bitrate, sample_rate, mono
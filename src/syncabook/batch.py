@@ -0,0 +1,232 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import inspect
+import json
+import os.path
+import time
+
+from . import profiling
+from .create import create_ebook
+from .download_files import download_files
+from .epub import listdir
+from .split_text import split_text
+from .sync import is_sync_complete, sync
+from .to_xhtml import textfiles_to_xhtml_files
+
+
+def batch(manifest_path, summary_path=None, sync_workers=1, io_workers=4):
+    """
+    Builds ebooks for all books listed in the batch manifest at `manifest_path` without any prompts.
+    For each book the stages download → split → to_xhtml → sync → create are run
+    skipping the ones whose output already exists.
+
+    Syncing is CPU-heavy, so it's done by a pool of `sync_workers` processes,
+    while other stages are run by a pool of `io_workers` threads.
+    Thus, one book may be packaged while another is being synced.
+
+    Returns a summary of the results and timings of each stage
+    and writes it as JSON to `summary_path` if given.
+    A failed stage stops its book but not the others.
+
+    The manifest is a JSON object:
+    {
+        "defaults": {...},
+        "books": [
+            {
+                "book_dir": "civil_disobedience",
+                "librivox_url": "https://librivox.org/...",
+                "language": "eng",
+                "metadata": {"title": "...", "author": "...", ...},
+                "split": {"mode": "opening", "pattern": "...", "n": null, "balance": "words"},
+                "to_xhtml": {"fragment_type": "sentence", "include_heading": false, ...},
+                "sync": {"alignment_radius": null, "alignment_skip_penalty": null, "jobs": 1, ...},
+                "create": {"compresslevel": null}
+            },
+            ...
+        ]
+    }
+    Only "book_dir" is required, it's relative to the manifest's directory.
+    "defaults" are applied to every book, options of the stages are keyword arguments
+    of the corresponding functions.
+    """
+    books = load_batch_manifest(manifest_path)
+
+    start = time.perf_counter()
+    results = [{'book_dir': book['book_dir'], 'status': 'ok', 'stages': {}} for book in books]
+
+    with ProcessPoolExecutor(max_workers=sync_workers) as sync_pool, \
+            ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+        pending = {io_pool.submit(_prepare, book): (i, 'prepare') for i, book in enumerate(books)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, step = pending.pop(future)
+                result = results[i]
+                try:
+                    records, value = profiling.collect(future.result())
+                except Exception as e:
+                    # e.g. a worker process has crashed
+                    records, value = {step: {'status': 'failed', 'error': str(e) or repr(e)}}, None
+                result['stages'].update(records)
+
+                failed = [stage for stage, record in records.items() if record['status'] == 'failed']
+                if failed:
+                    result['status'] = 'failed'
+                    result['error'] = records[failed[0]]['error']
+                elif step == 'prepare':
+                    pending[sync_pool.submit(profiling.traced(_sync), books[i])] = (i, 'sync')
+                elif step == 'sync':
+                    pending[io_pool.submit(_create, books[i])] = (i, 'create')
+                else:
+                    result['ebook'] = value
+
+    for result in results:
+        result['seconds'] = round(sum(r.get('seconds', 0) for r in result['stages'].values()), 3)
+
+    summary = {
+        'books': results,
+        'succeeded': sum(1 for r in results if r['status'] == 'ok'),
+        'failed': sum(1 for r in results if r['status'] == 'failed'),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+    if summary_path is not None:
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return summary
+
+
+def load_batch_manifest(manifest_path):
+    """
+    Returns a list of books of the batch manifest with defaults applied
+    and book directories resolved relative to the manifest.
+    """
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    defaults = manifest.get('defaults', {})
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    books = []
+    for book_options in manifest['books']:
+        book = dict(defaults)
+        for key, value in book_options.items():
+            if isinstance(value, dict) and isinstance(book.get(key), dict):
+                value = {**book[key], **value}
+            book[key] = value
+        if 'book_dir' not in book:
+            raise ValueError(f'\n❌ book_dir is missing in {book_options}\n')
+        book['book_dir'] = os.path.join(base_dir, book['book_dir'])
+        books.append(book)
+    return books
+
+
+def _prepare(book):
+    """
+    Runs the stages that produce the synchronized text: download, split and to_xhtml.
+    """
+    book_dir = book['book_dir']
+    text_file = os.path.join(book_dir, 'text.txt')
+    plaintext_dir = os.path.join(book_dir, 'plaintext')
+    sync_text_dir = os.path.join(book_dir, 'sync_text')
+    records = {}
+
+    has_text = (
+        os.path.exists(text_file)
+        or len(listdir(plaintext_dir, '.txt')) > 0
+        or len(listdir(sync_text_dir, '.xhtml')) > 0
+    )
+    has_audio = len(listdir(os.path.join(book_dir, 'audio'))) > 0
+    if book.get('librivox_url') and not (has_text and has_audio):
+        ok, _ = _run_stage(
+            records, 'download', download_files,
+            book['librivox_url'], book_dir, skip_text=has_text, skip_audio=has_audio
+        )
+        if not ok:
+            return records, None
+
+    if 'metadata' in book:
+        metadata_path = os.path.join(book_dir, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            with open(metadata_path, 'w') as f:
+                json.dump(book['metadata'], f, indent=2)
+
+    if 'split' in book and os.path.exists(text_file) and len(listdir(plaintext_dir, '.txt')) == 0:
+        ok, _ = _run_stage(records, 'split', _split_text, text_file, plaintext_dir, book['split'])
+        if not ok:
+            return records, None
+
+    if len(listdir(plaintext_dir, '.txt')) > 0 and len(listdir(sync_text_dir, '.xhtml')) == 0:
+        options = {'language': book.get('language', 'eng'), **book.get('to_xhtml', {})}
+        if 'fragment_type' not in options:
+            options['fragment_type'] = 'sentence'
+        _run_stage(records, 'to_xhtml', textfiles_to_xhtml_files, plaintext_dir, sync_text_dir, **options)
+
+    return records, None
+
+
+def _sync(book):
+    book_dir = book['book_dir']
+    records = {}
+    smil_found = len(listdir(os.path.join(book_dir, 'smil'), '.smil')) > 0
+    if not smil_found or not is_sync_complete(book_dir):
+        options = {
+            'alignment_radius': None,
+            'alignment_skip_penalty': None,
+            'language': book.get('language', 'eng'),
+            'resume': smil_found,
+            **book.get('sync', {}),
+        }
+        _run_stage(records, 'sync', _sync_book, book_dir, **options)
+    return records, None
+
+
+def _create(book):
+    records = {}
+    # create may sync too, so it takes the sync options, but its own options take precedence
+    options = {
+        'language': book.get('language', 'eng'),
+        **book.get('sync', {}),
+        **book.get('create', {}),
+    }
+    parameters = inspect.signature(create_ebook).parameters
+    options = {name: value for name, value in options.items() if name in parameters}
+    options['interactive'] = False
+    _, ebook_path = _run_stage(records, 'create', create_ebook, book['book_dir'], **options)
+    return records, ebook_path
+
+
+def _sync_book(book_dir, **kwargs):
+    if sync(book_dir, **kwargs) is None:
+        raise ValueError('afaligner has produced no sync map')
+
+
+def _split_text(text_file, output_dir, options):
+    split_text(
+        text_file, output_dir,
+        options.get('mode', 'opening'), options.get('pattern'), options.get('n'),
+        options.get('balance', 'words'),
+    )
+    if len(listdir(output_dir, '.txt')) == 0:
+        raise ValueError(f'{text_file} has not been split')
+
+
+def _run_stage(records, stage, func, *args, **kwargs):
+    """
+    Calls `func` and records the outcome and duration of `stage` in `records`.
+    Returns whether `func` has succeeded and its result.
+    An exception isn't raised but recorded as the stage's error.
+    """
+    start = time.perf_counter()
+    try:
+        with profiling.stage(stage):
+            result = func(*args, **kwargs)
+    except Exception as e:
+        records[stage] = {
+            'status': 'failed',
+            'seconds': round(time.perf_counter() - start, 3),
+            'error': str(e).strip() or repr(e),
+        }
+        return False, None
+    records[stage] = {'status': 'ok', 'seconds': round(time.perf_counter() - start, 3)}
+    return True, result
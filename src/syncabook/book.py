@@ -0,0 +1,184 @@
+import json
+import os.path
+
+from .create import create_ebook
+from .epub import listdir
+from .split_text import get_part_names, split_text_into_parts
+from .sync import sync
+from .to_xhtml import texts_to_xhtml_contexts, write_xhtml_file
+from .toc import build_toc, get_first_heading
+from .utils import drop_extension
+
+
+class Chapter():
+    """
+    A chapter of a book: its plain text, its XHTML as a context of text.xhtml template
+    and the timings of its fragments after syncing.
+    Any of them is None until the stage that produces it is run.
+    """
+    def __init__(self, name, text=None):
+        # name of the chapter's files without extension
+        self.name = name
+        self.text = text
+        self.xhtml = None
+        self.heading = None
+        self.timings = None
+        # whether the XHTML has changed since it was saved to sync_text/
+        self.xhtml_changed = False
+
+    @property
+    def xhtml_filename(self):
+        return f'{self.name}.xhtml'
+
+    @property
+    def smil_filename(self):
+        return f'{self.name}.smil'
+
+    def __repr__(self):
+        return f'Chapter({self.name!r})'
+
+
+class Book():
+    """
+    A book in `book_dir` that is processed in memory stage by stage:
+
+        book = Book('civil_disobedience')
+        book.split(pattern=r'\\n\\n[IVX]+\\.\\n\\n').to_xhtml().sync().create()
+
+    Stages pass chapters, headings and timings to each other, so XHTML and SMIL files
+    are not parsed again, and files are written only when they are needed:
+    XHTML files are saved to sync_text/ for afaligner and the ebook,
+    plain text files to plaintext/ only by `save_plaintext`.
+    A book prepared with the CLI is loaded by `load_plaintext` or `load_xhtml`.
+    """
+    def __init__(self, book_dir, language='eng', jobs=1):
+        self.book_dir = book_dir
+        self.language = language
+        self.jobs = jobs
+        self.chapters = []
+        self.metadata = None
+
+    @property
+    def plaintext_dir(self):
+        return os.path.join(self.book_dir, 'plaintext')
+
+    @property
+    def sync_text_dir(self):
+        return os.path.join(self.book_dir, 'sync_text')
+
+    def split(self, mode='opening', pattern=None, n=None, balance='words', text_file=None):
+        """
+        Splits `text_file` (text.txt by default) into chapters, see `split_text`.
+        """
+        if text_file is None:
+            text_file = os.path.join(self.book_dir, 'text.txt')
+        texts = split_text_into_parts(text_file, mode, pattern, n, balance)
+        if not texts:
+            raise ValueError(f'\n❌ {text_file} has not been split.\n')
+        self.chapters = [Chapter(name, text) for name, text in zip(get_part_names(len(texts)), texts)]
+        return self
+
+    def load_plaintext(self):
+        """
+        Reads chapters from plaintext/.
+        """
+        self.chapters = []
+        for filename in listdir(self.plaintext_dir, '.txt'):
+            with open(os.path.join(self.plaintext_dir, filename), 'r') as f:
+                self.chapters.append(Chapter(drop_extension(filename), f.read()))
+        return self
+
+    def save_plaintext(self):
+        os.makedirs(self.plaintext_dir, exist_ok=True)
+        for chapter in self.chapters:
+            with open(os.path.join(self.plaintext_dir, f'{chapter.name}.txt'), 'w') as f:
+                f.write(chapter.text)
+        return self
+
+    def to_xhtml(self, fragment_type='sentence', include_heading=False, segmenter='simple'):
+        """
+        Converts the chapters' text to XHTML, see `textfiles_to_xhtml_files`.
+        """
+        contexts = texts_to_xhtml_contexts(
+            [chapter.text for chapter in self.chapters],
+            fragment_type, include_heading, segmenter, self.language,
+        )
+        for chapter, context in zip(self.chapters, contexts):
+            chapter.xhtml = context
+            chapter.xhtml_changed = True
+            heading = context['heading']
+            # the heading is rendered as h2 with its whitespace collapsed like `get_first_heading` does
+            chapter.heading = (2, ' '.join(heading['text'].split())) if heading else None
+        return self
+
+    def load_xhtml(self):
+        """
+        Finds chapters in sync_text/ reading only their headings.
+        """
+        self.chapters = []
+        for filename in listdir(self.sync_text_dir, '.xhtml'):
+            chapter = Chapter(drop_extension(filename))
+            chapter.heading = get_first_heading(os.path.join(self.sync_text_dir, filename))
+            self.chapters.append(chapter)
+        return self
+
+    def save_xhtml(self):
+        """
+        Saves XHTML of the chapters that has changed to sync_text/.
+        Then files of other chapters are removed, so that they're not synced or packaged.
+        """
+        changed_chapters = [chapter for chapter in self.chapters if chapter.xhtml_changed]
+        if not changed_chapters:
+            return self
+
+        os.makedirs(self.sync_text_dir, exist_ok=True)
+        filenames = {chapter.xhtml_filename for chapter in self.chapters}
+        for filename in listdir(self.sync_text_dir, '.xhtml'):
+            if filename not in filenames:
+                os.remove(os.path.join(self.sync_text_dir, filename))
+        for chapter in changed_chapters:
+            write_xhtml_file(os.path.join(self.sync_text_dir, chapter.xhtml_filename), chapter.xhtml)
+            chapter.xhtml_changed = False
+        return self
+
+    def sync(self, alignment_radius=None, alignment_skip_penalty=None, **kwargs):
+        """
+        Aligns the chapters with the audio, see `sync.sync`.
+        afaligner reads XHTML files, so changed ones are saved first.
+        If afaligner produces no sync map, timings of the chapters stay None.
+        """
+        self.save_xhtml()
+        chapters_timings = sync(
+            self.book_dir, alignment_radius, alignment_skip_penalty, self.language,
+            jobs=self.jobs, **kwargs
+        ) or {}
+        for chapter in self.chapters:
+            chapter.timings = chapters_timings.get(chapter.smil_filename)
+        return self
+
+    def get_toc(self):
+        return build_toc((chapter.xhtml_filename, chapter.heading) for chapter in self.chapters)
+
+    def create(self, **kwargs):
+        """
+        Creates the ebook, see `create_ebook`, and returns its path.
+        The table of contents and the durations known from the previous stages are passed to it.
+        If `metadata` is set, it's saved to metadata.json.
+        """
+        self.save_xhtml()
+        if self.metadata is not None:
+            with open(os.path.join(self.book_dir, 'metadata.json'), 'w') as f:
+                json.dump(self.metadata, f, indent=2)
+
+        chapters_timings = {
+            chapter.smil_filename: chapter.timings
+            for chapter in self.chapters if chapter.timings is not None
+        }
+        return create_ebook(
+            self.book_dir,
+            language=self.language,
+            jobs=self.jobs,
+            toc=self.get_toc() if self.chapters else None,
+            chapters_timings=chapters_timings or None,
+            **kwargs
+        )
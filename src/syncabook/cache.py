@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_cache_dir(name):
+    """
+    Returns the path to the `name` subdirectory of syncabook's cache directory shared by all books.
+    It is $SYNCABOOK_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/syncabook or ~/.cache/syncabook.
+    """
+    cache_dir = os.environ.get('SYNCABOOK_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+            'syncabook'
+        )
+    return os.path.join(cache_dir, name)
+
+
+class DirCache():
+    """
+    On-disk cache that maps string keys to directories of files.
+    Its total size is bounded by `max_size` bytes:
+    `evict()` removes least recently used entries until the cache fits.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def get(self, key):
+        """
+        Returns the path to the entry's directory or None if `key` is not cached.
+        """
+        entry_dir = os.path.join(self.path, key)
+        if not os.path.isdir(entry_dir):
+            return None
+        # mtime of the entry's directory tracks the last use
+        os.utime(entry_dir)
+        return entry_dir
+
+    def put(self, key, files):
+        """
+        Caches `files` – a dict that maps names to paths of the files to copy – under `key`.
+        The entry appears atomically, so concurrent readers never see a partial one.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f'.{key}-', dir=self.path)
+        try:
+            for name, path in files.items():
+                shutil.copy(path, os.path.join(tmp_dir, name))
+            os.rename(tmp_dir, os.path.join(self.path, key))
+        except OSError:
+            # the same entry has been put by another process
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def evict(self):
+        """
+        Removes least recently used entries until the total size is at most `max_size`.
+        """
+        if not os.path.isdir(self.path):
+            return
+
+        entries = []
+        total_size = 0
+        for key in os.listdir(self.path):
+            entry_dir = os.path.join(self.path, key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, x)) for x in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            total_size += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+
+
+class HTTPCache():
+    """
+    On-disk cache of HTTP responses.
+    Each entry is the body of the response to GET a URL and its metadata:
+    validators (ETag and Last-Modified) to revalidate it and the time it was last validated.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, url):
+        """
+        Returns a dict with 'etag', 'last_modified', 'validated_at' and 'body'
+        of the entry for `url` or None if it isn't cached.
+        """
+        meta_path, body_path = self._get_paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                entry = json.load(f)
+            with open(body_path, 'rb') as f:
+                entry['body'] = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def put(self, url, body, etag=None, last_modified=None):
+        os.makedirs(self.path, exist_ok=True)
+        meta_path, body_path = self._get_paths(url)
+        self._write(body_path, body)
+        self._write_meta(meta_path, {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'validated_at': time.time(),
+        })
+
+    def touch(self, url):
+        """
+        Records that the entry for `url` has been revalidated.
+        """
+        meta_path, _ = self._get_paths(url)
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        meta['validated_at'] = time.time()
+        self._write_meta(meta_path, meta)
+
+    def _get_paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.path, f'{key}.json'), os.path.join(self.path, f'{key}.body')
+
+    def _write_meta(self, meta_path, meta):
+        self._write(meta_path, json.dumps(meta).encode())
+
+    def _write(self, path, data):
+        # entries may be written by several threads or processes at once
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
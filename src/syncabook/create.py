@@ -1,20 +1,34 @@
 from datetime import date, datetime, timedelta
 import json
 import os.path
-import re
-import shutil
 import uuid
-from zipfile import ZipFile
-
-from bs4 import BeautifulSoup
-import jinja2
-
-from . import TEMPLATES_DIR
-from .sync import sync
+from zipfile import ZIP_STORED
+
+from . import TEMPLATES_DIR, audio, profiling
+from .epub import Entry, collect_entries, get_compress_type, listdir, write_epub
+from .manifest import MANIFEST_FILENAME, Manifest
+from .preflight import check_book, print_report
+from .smil import get_media_durations, read_durations, write_durations
+from .sync import is_sync_complete, sync
+from .templates import get_template, render_to_file
+from .toc import get_toc, render_nav
 from .utils import drop_extension, format_duration
 
 
-def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, language='eng'):
+def create_ebook(
+    book_dir, alignment_radius=None, alignment_skip_penalty=None, language='eng',
+    compresslevel=None, jobs=1, cache_dir=None, use_cache=True, interactive=True,
+    prepare_audio=False, toc=None, chapters_timings=None, by_chapter=False,
+):
+    """
+    Creates EPUB3 ebook from `book_dir` and returns its path.
+    Missing SMIL files, metadata.json, nav.xhtml and colophon.xhtml are created in the process.
+    If `interactive` is False, missing metadata is filled with defaults
+    instead of being asked for and there are no pauses to review the generated files.
+    If `prepare_audio` is True, audio files are decoded for alignment before syncing.
+    `toc` and `chapters_timings` returned by `sync` may be passed if they are known,
+    so that they're not read from XHTML and SMIL files again.
+    """
     audio_dir = os.path.join(book_dir, 'audio')
     sync_text_dir = os.path.join(book_dir, 'sync_text')
     no_sync_text_dir = os.path.join(book_dir, 'no_sync_text')
@@ -23,19 +37,42 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
     metadatafile = os.path.join(book_dir, 'metadata.json')
     output_dir = os.path.join(book_dir, 'out')
 
-    tmp_dir = os.path.join(output_dir, 'tmp')
-
     os.makedirs(no_sync_text_dir, exist_ok=True)
 
     # create SMIL files using afaligner
-    if not os.path.isdir(smil_dir) or len(list(os.listdir(smil_dir))) == 0:
-        print('❗ SMIL files are not found. Synchronizing...')
-        sync(
-            book_dir,
-            alignment_radius=alignment_radius,
-            alignment_skip_penalty=alignment_skip_penalty,
-            language=language,
-        )
+    smil_found = len(listdir(smil_dir, '.smil')) > 0
+    resume = smil_found and not is_sync_complete(book_dir)
+    if not smil_found or resume:
+        if resume:
+            print('❗ The last synchronization is incomplete. Resuming...')
+        else:
+            print('❗ SMIL files are not found. Synchronizing...')
+            try:
+                with profiling.stage('check'):
+                    report = check_book(book_dir)
+            except Exception as e:
+                # the check is advisory and must not stop the build
+                print(f'❗ Text and audio files could not be checked: {e}')
+                report = {'problems': []}
+            if report['problems']:
+                print_report(report)
+                if interactive:
+                    input('Press any key to proceed:')
+        if prepare_audio:
+            with profiling.stage('prepare_audio'):
+                audio.prepare_audio(book_dir, jobs=jobs)
+        with profiling.stage('sync'):
+            chapters_timings = sync(
+                book_dir,
+                alignment_radius=alignment_radius,
+                alignment_skip_penalty=alignment_skip_penalty,
+                language=language,
+                jobs=jobs,
+                cache_dir=cache_dir,
+                use_cache=use_cache,
+                resume=resume,
+                by_chapter=by_chapter,
+            )
     else:
         print(f'✔ Using existing SMIL files from {smil_dir}.')
 
@@ -43,98 +80,70 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
         with open(metadatafile, 'r') as f:
             metadata = json.load(f)
     except FileNotFoundError:
-        print('❗ File metadata.json is not found. Please provide metadata')
-        metadata = {}
-        metadata['title'] = input('Title: ')
-        metadata['author'] = input('Author: ')
-        metadata['description'] = input('Description: ')
-        metadata['narrator'] = input('Narrator: ')
-        metadata['contributor'] = input('Contributor: ')
-        metadata['transcriber'] = input('Transcriber: ')
+        if interactive:
+            print('❗ File metadata.json is not found. Please provide metadata')
+            metadata = {}
+            metadata['title'] = input('Title: ')
+            metadata['author'] = input('Author: ')
+            metadata['description'] = input('Description: ')
+            metadata['narrator'] = input('Narrator: ')
+            metadata['contributor'] = input('Contributor: ')
+            metadata['transcriber'] = input('Transcriber: ')
+        else:
+            print('❗ File metadata.json is not found. Using default metadata')
+            metadata = get_default_metadata(book_dir)
         with open(metadatafile, 'w') as f:
             json.dump(metadata, f, indent=2)
         print('✔ File metadata.json is created.')
 
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES_DIR), autoescape=True)
-
     # create ToC file if doesn't exist
     nav_path = os.path.join(no_sync_text_dir, 'nav.xhtml')
     if not os.path.exists(nav_path):
         print(f'❗ File {nav_path} is not found. Creating...')
-        content_files = []
-        for i, filename in enumerate(sorted(os.listdir(sync_text_dir)), start=1):
-            with open(os.path.join(sync_text_dir, filename)) as f:
-                soup = BeautifulSoup(f.read(), 'xml')
-            heading = soup.find('h2')
-            content_files.append({
-                'name': filename,
-                'toc_name': heading.string if heading is not None else i
-            })
-        nav_template = env.get_template('nav.xhtml')
-        nav_content = nav_template.render(content_files=content_files)
+        if toc is None:
+            with profiling.stage('toc'):
+                toc = get_toc(sync_text_dir, listdir(sync_text_dir))
         with open(nav_path, 'x') as f:
-            f.write(nav_content)
+            f.write(render_nav(toc))
 
         print(f'✔ File {nav_path} has been created. You may want to make some changes.')
-        input('Press any key to proceed:')
+        if interactive:
+            input('Press any key to proceed:')
 
     # create colophon file if doesn't exist
     colophon_path = os.path.join(no_sync_text_dir, 'colophon.xhtml')
     if not os.path.exists(colophon_path):
         print(f'File {colophon_path} is not found. Creating...')
-        colophon_template = env.get_template('colophon.xhtml')
-        colophon_content = colophon_template.render(
+        render_to_file(
+            'colophon.xhtml', colophon_path, mode='x',
             title=metadata['title'],
             author=metadata['author'],
             contributor=metadata.get('contributor', 'me'),
             transcriber=metadata.get('transcriber', 'someone')
         )
-        with open(colophon_path, 'x') as f:
-            f.write(colophon_content)
 
         print(f'✔ File {colophon_path} has been created. You may want to make some changes.')
-        input('Press any key to proceed:')
-
-    # initialize epub files
-    container_dir = os.path.join(tmp_dir, 'container')
-    epub_dir = os.path.join(container_dir, 'epub')
-    epub_audio_dir = os.path.join(epub_dir, 'audio')
-    epub_text_dir = os.path.join(epub_dir, 'text')
-    epub_smil_dir = os.path.join(epub_dir, 'smil')
-    epub_styles_dir = os.path.join(epub_dir, 'styles')
-    epub_images_dir = os.path.join(epub_dir, 'images')
-
-    os.makedirs(container_dir)
-    os.makedirs(epub_dir)
-    os.makedirs(os.path.join(container_dir, 'META-INF'))
-    os.makedirs(epub_audio_dir)
-    os.makedirs(epub_text_dir)
-    os.makedirs(epub_smil_dir)
-    os.makedirs(epub_styles_dir)
-    os.makedirs(epub_images_dir)
-
-    shutil.copy(
-        os.path.join(TEMPLATES_DIR, 'mimetype'),
-        os.path.join(container_dir, 'mimetype')
-    )
-    shutil.copy(
-        os.path.join(TEMPLATES_DIR, 'container.xml'),
-        os.path.join(container_dir, 'META-INF', 'container.xml')
-    )
-    shutil.copy(
-        os.path.join(TEMPLATES_DIR, 'style.css'),
-        os.path.join(epub_styles_dir, 'style.css')
-    )
-
-    # copy resources to epub
-    for from_, to in (
-        (audio_dir, epub_audio_dir), (sync_text_dir, epub_text_dir),
-        (no_sync_text_dir, epub_text_dir), (smil_dir, epub_smil_dir),
-        (images_dir, epub_images_dir)
-    ):
-        if os.path.exists(from_):
-            for filename in os.listdir(from_):
-                shutil.copy(os.path.join(from_, filename), os.path.join(to, filename))
+        if interactive:
+            input('Press any key to proceed:')
+
+    # collect files of the ebook, the ones that change rarely go first
+    # so that the next build can keep them in place
+    entries = [
+        Entry('META-INF/container.xml', path=os.path.join(TEMPLATES_DIR, 'container.xml')),
+        *collect_entries(audio_dir, 'epub/audio'),
+        *collect_entries(images_dir, 'epub/images'),
+        Entry('epub/styles/style.css', path=os.path.join(TEMPLATES_DIR, 'style.css')),
+        *collect_entries(sync_text_dir, 'epub/text'),
+        *collect_entries(no_sync_text_dir, 'epub/text'),
+        *collect_entries(smil_dir, 'epub/smil', '.smil'),
+    ]
+
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    previous_manifest = Manifest.load(manifest_path)
+    manifest = Manifest(compresslevel=compresslevel)
+    with profiling.stage('fingerprint', entries=len(entries)):
+        for entry in entries:
+            manifest.fingerprint(entry, previous_manifest)
 
     # create package document
     audios = [
@@ -142,7 +151,7 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
             'name': filename,
             'id': f'audio{drop_extension(filename)}',
         }
-        for filename in sorted(os.listdir(epub_audio_dir))
+        for filename in listdir(audio_dir)
     ]
 
     sync_texts = [
@@ -164,19 +173,41 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
 
     texts = sorted(sync_texts + no_sync_texts, key=lambda x: x['name'])
 
+    smil_filenames = listdir(smil_dir, '.smil')
+
     smils = [
         {
             'name': filename,
             'id': f'smil{drop_extension(filename)}',
         }
-        for filename in sorted(os.listdir(epub_smil_dir))
+        for filename in smil_filenames
     ]
 
-    # calculate durations of Media Overlays
-    media_durations = [
-        _get_media_duration(os.path.join(epub_smil_dir, filename))
-        for filename in sorted(os.listdir(epub_smil_dir))
-    ]
+    # calculate durations of Media Overlays: take them from the sync results or the cache
+    # and parse only SMIL files that have changed
+    if chapters_timings is not None:
+        durations_ms = {name: chapter['duration'] for name, chapter in chapters_timings.items()}
+    else:
+        durations_ms = read_durations(smil_dir)
+    for filename in smil_filenames:
+        if filename not in durations_ms:
+            duration_ms = manifest.get_unchanged(previous_manifest, f'epub/smil/{filename}', 'duration')
+            if duration_ms is not None:
+                durations_ms[filename] = duration_ms
+
+    changed_smil_filenames = [x for x in smil_filenames if x not in durations_ms]
+    with profiling.stage('smil_durations', smil_files=len(changed_smil_filenames)):
+        durations_ms.update(zip(
+            changed_smil_filenames,
+            get_media_durations(os.path.join(smil_dir, x) for x in changed_smil_filenames)
+        ))
+    if changed_smil_filenames:
+        write_durations(smil_dir, {x: durations_ms[x] for x in smil_filenames})
+
+    for filename in smil_filenames:
+        manifest.entries[f'epub/smil/{filename}']['duration'] = durations_ms[filename]
+
+    media_durations = [timedelta(milliseconds=durations_ms[x]) for x in smil_filenames]
     total_duration = format_duration(sum(media_durations, timedelta()))
 
     medias = [
@@ -184,14 +215,13 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
             'duration': format_duration(duration),
             'smil_id': f'smil{drop_extension(filename)}',
         }
-        for filename, duration in zip(sorted(os.listdir(epub_smil_dir)), media_durations)
+        for filename, duration in zip(smil_filenames, media_durations)
     ]
 
     cover_path = os.path.join(images_dir, 'cover.jpg')
     include_cover = os.path.exists(cover_path)
 
-    opf_template = env.get_template('content.opf')
-    opf_content = opf_template.render({
+    opf_content = get_template('content.opf').render({
         'uuid': metadata.get('uuid', uuid.uuid4()),
         'title': metadata['title'],
         'author': metadata['author'],
@@ -207,44 +237,51 @@ def create_ebook(book_dir, alignment_radius=None, alignment_skip_penalty=None, l
         'medias': medias,
         'total_duration': total_duration,
     })
-    with open(os.path.join(epub_dir, 'content.opf'), 'x') as f:
-        f.write(opf_content)
 
-    # create epub archive
-    ebook_path = os.path.join(output_dir, f'{_get_book_name(metadata["title"])}.epub')
+    entries.append(Entry('epub/content.opf', data=opf_content))
 
-    with ZipFile(ebook_path, 'w') as z:
-        # mimetype must be first file in archive
-        z.writestr('mimetype', 'application/epub+zip')
-        z.write(os.path.join(container_dir, 'META-INF', 'container.xml'), 'META-INF/container.xml')
-        for dirpath, _, filenames in os.walk(epub_dir):
-            for filename in filenames:
-                arcname = os.path.join(os.path.relpath(dirpath, container_dir), filename)
-                z.write(os.path.join(dirpath, filename), arcname)
+    # create epub archive streaming source files directly from book_dir
+    os.makedirs(output_dir, exist_ok=True)
+    ebook_path = os.path.join(output_dir, f'{_get_book_name(metadata["title"])}.epub')
+    manifest.ebook = os.path.basename(ebook_path)
+
+    # entries of the previous build with the same hash can be reused
+    # unless they were deflated with a different compression level
+    previous_hashes = {}
+    if previous_manifest.ebook == manifest.ebook:
+        previous_hashes = {
+            arcname: record.get('hash')
+            for arcname, record in previous_manifest.entries.items()
+            if get_compress_type(arcname) == ZIP_STORED
+            or previous_manifest.compresslevel == compresslevel
+        }
 
-    shutil.rmtree(tmp_dir)
+    # the manifest is invalid while the ebook is being rewritten
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
 
-    print(f'✔ The ebook has been successfully created and saved as {ebook_path}')
+    with profiling.stage('write_epub', entries=len(entries)):
+        hashes = write_epub(ebook_path, entries, compresslevel=compresslevel, previous=previous_hashes)
 
+    for arcname, record in manifest.entries.items():
+        record['hash'] = hashes[arcname]
+    manifest.save(manifest_path)
 
-def _get_media_duration(smil_file_path):
-    with open(smil_file_path, 'r') as f:
-        soup = BeautifulSoup(f.read(), 'xml')
+    print(f'✔ The ebook has been successfully created and saved as {ebook_path}')
 
-    clips = soup.find_all('audio')
-    return sum(
-        [_parse_clockvalue(clip['clipEnd']) - _parse_clockvalue(clip['clipBegin']) for clip in clips],
-        timedelta(0)
-    )
+    return ebook_path
 
 
-def _parse_clockvalue(clockvalue):
-    pattern = r'(?P<h>\d+):(?P<m>\d\d):(?P<s>\d\d).(?P<ms>\d\d\d)'
-    m = re.match(pattern, clockvalue)
-    return timedelta(
-        hours=int(m.group('h')), minutes=int(m.group('m')),
-        seconds=int(m.group('s')), milliseconds=int(m.group('ms'))
-    )
+def get_default_metadata(book_dir):
+    """
+    Returns metadata used when it's not provided: the title is the name of `book_dir`.
+    """
+    return {
+        'title': os.path.basename(os.path.normpath(book_dir)),
+        'author': '',
+        'description': '',
+        'narrator': '',
+    }
 
 
 def _get_book_name(title):
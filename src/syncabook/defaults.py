@@ -0,0 +1,15 @@
+# Defaults shared by the modules and the CLI.
+# The CLI imports this module to show the defaults in --help without importing the heavy modules,
+# so it must not import anything.
+
+# number of files to download in parallel
+DOWNLOAD_JOBS = 4
+
+# sample rate of the audio files decoded for alignment
+SAMPLE_RATE = 16000
+
+# A chapter is an outlier if its audio is this many times longer or shorter than expected.
+MAX_DEVIATION = 1.5
+
+# seconds between checks for changes in watch mode
+WATCH_INTERVAL = 0.5
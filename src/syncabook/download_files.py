@@ -2,139 +2,184 @@ import json
 import os.path
 import re
 import urllib.parse
-import urllib.request
-from zipfile import ZipFile
 
 from bs4 import BeautifulSoup
-import progressbar
 
+from .cache import HTTPCache, get_cache_dir
+from .defaults import DOWNLOAD_JOBS
+from .downloader import Download, Downloader
+
+
+AUDIO_SOURCES = ('zip', 'tracks')
 
 # synclibrivox repo parameters
 GITHUB_CONTENTS_URL = f'https://api.github.com/repos/r4victor/synclibrivox/contents/'
 MAPPING_FILE = 'map.json'
 BOOKS_DIR = 'books'
 
+# how long cached responses are used without revalidation, in seconds
+MAPPING_TTL = 24 * 60 * 60
+GITHUB_DIRECTORY_TTL = 24 * 60 * 60
+PAGE_TTL = 7 * 24 * 60 * 60
 
-def download_files(librivox_url, output_dir, skip_text=False, skip_audio=False):
+
+def download_files(
+    librivox_url, output_dir, skip_text=False, skip_audio=False, jobs=DOWNLOAD_JOBS, audio_source='zip',
+    offline=False,
+):
     """
     Downloads files needed to create an ebook.
 
     The downloading process looks as follows:
     Download files from the synclibrivox repository.
     If a book is not found there, download plaintext transcript from gutenberg.org.
-    Download audio files from librivox.org.
+    Download audio files from librivox.org: either the audiobook ZIP that is extracted
+    while it's being downloaded or, if `audio_source` is 'tracks', separate MP3 files in parallel.
+
+    Files are downloaded by `jobs` concurrent workers.
+    Interrupted downloads are resumed when the command is run again
+    and files that have already been downloaded are skipped.
+    Raises DownloadError if some files fail to download.
+
+    Web pages, the synclibrivox mapping and directory listings are cached
+    in the http/ subdirectory of syncabook's cache directory and revalidated only after their TTL expires.
+    If `offline` is True, they are taken from the cache only
+    and OfflineError is raised for anything that needs the network.
     """
+    if audio_source not in AUDIO_SOURCES:
+        raise ValueError(f'\n❌ Unknown audio source: {audio_source}\n')
+
     os.makedirs(output_dir, exist_ok=True)
 
-    with urllib.request.urlopen(librivox_url) as f:
-        librivox_soup = BeautifulSoup(f.read(), 'lxml')
-
-    if not skip_text:
-        found = _download_synclibrivox_files(librivox_url, output_dir)
-        if not found:
-            print(
-                f'❗ The synclibrivox repository doesn\'t contain this book.\n'
-                'Downloading text from gutenberg.org...'
-            )
-            gutenberg_link = librivox_soup.find(
-                'a', {'href': re.compile(r'http://www.gutenberg.org/.*')}
-            )
-            if gutenberg_link is None:
-                print('❗ Link to the gutenberg.org is not found. Text won\'t be downloaded.')
-            else:
-                gutenberg_url = gutenberg_link['href']
-                _download_gutenberg_text(gutenberg_url, output_dir)
+    http_cache = HTTPCache(get_cache_dir('http'))
+    with Downloader(jobs=jobs, progress=True, http_cache=http_cache, offline=offline) as downloader:
+        librivox_soup = BeautifulSoup(downloader.get(librivox_url, ttl=PAGE_TTL), 'lxml')
+
+        if not skip_text:
+            _download_text(downloader, librivox_url, librivox_soup, output_dir)
 
-    if not skip_audio:
-        print('Downloading audio files...')
-        audiobook_url = librivox_soup.find('a', class_='book-download-btn')['href']
-        _download_audio_files(audiobook_url, output_dir)
+        if not skip_audio:
+            print('Downloading audio files...')
+            if audio_source == 'tracks':
+                _download_audio_tracks(downloader, librivox_soup, output_dir)
+            else:
+                audiobook_url = librivox_soup.find('a', class_='book-download-btn')['href']
+                _download_audio_files(downloader, audiobook_url, output_dir)
+
+
+def _download_text(downloader, librivox_url, librivox_soup, output_dir):
+    found = _download_synclibrivox_files(downloader, librivox_url, output_dir)
+    if not found:
+        print(
+            f'❗ The synclibrivox repository doesn\'t contain this book.\n'
+            'Downloading text from gutenberg.org...'
+        )
+        gutenberg_link = librivox_soup.find(
+            'a', {'href': re.compile(r'http://www.gutenberg.org/.*')}
+        )
+        if gutenberg_link is None:
+            print('❗ Link to the gutenberg.org is not found. Text won\'t be downloaded.')
+        else:
+            gutenberg_url = gutenberg_link['href']
+            _download_gutenberg_text(downloader, gutenberg_url, output_dir)
 
 
-def _download_synclibrivox_files(librivox_url, output_dir):
+def _download_synclibrivox_files(downloader, librivox_url, output_dir):
     """
     Downloads files from synclibrivox repository for a book with corresponding `librivox_url`.
     If a book is not found in the repository, returns False.
     Otherwise, returns True.
     """
-    book_dir = _get_book_dir(librivox_url)
+    book_dir = _get_book_dir(downloader, librivox_url)
     if book_dir is None:
         return False
     
     print('The books has been found in the synclibrivox repository. Downloading files...')
     book_path = os.path.join(BOOKS_DIR, book_dir)
-    _download_github_directory(book_path, relative_to=book_path, output_dir=output_dir)
+    downloader.download(_list_github_directory(downloader, book_path, book_path, output_dir))
     print(f'✔ All files have been downloaded and saved to {output_dir}')
     return True
 
 
-def _get_book_dir(librivox_url):
-    return json.loads(_get_github_file_contents(MAPPING_FILE)).get(librivox_url)
+def _get_book_dir(downloader, librivox_url):
+    return json.loads(_get_github_file_contents(downloader, MAPPING_FILE, MAPPING_TTL)).get(librivox_url)
 
 
-def _get_github_file_contents(file_path):
+def _get_github_file_contents(downloader, file_path, ttl=None):
     file_url = urllib.parse.urljoin(GITHUB_CONTENTS_URL, file_path)
-    with urllib.request.urlopen(file_url) as f:
-        download_url = json.loads(f.read())['download_url']
-
-    with urllib.request.urlopen(download_url) as f:
-        return f.read()
+    download_url = json.loads(downloader.get(file_url, ttl=ttl))['download_url']
+    return downloader.get(download_url, ttl=ttl)
 
 
-def _download_github_directory(path, relative_to='', output_dir=''):
+def _list_github_directory(downloader, path, relative_to, output_dir):
+    """
+    Returns downloads of all files in the directory of the synclibrivox repository at `path`
+    and creates its subdirectories in `output_dir`.
+    GitHub reports the size and the git blob SHA-1 of each file, so the downloads are verified.
+    """
     url = urllib.parse.urljoin(GITHUB_CONTENTS_URL, path)
-    with urllib.request.urlopen(url) as f:
-        contents = json.loads(f.read())
+    contents = json.loads(downloader.get(url, ttl=GITHUB_DIRECTORY_TTL))
 
     os.makedirs(os.path.join(output_dir, os.path.relpath(path, relative_to)), exist_ok=True)
 
+    downloads = []
     for content in contents:
         if content['type'] == 'file':
             rel_path = os.path.relpath(content['path'], relative_to)
-            print(f'Downloading {rel_path}...')
-            urllib.request.urlretrieve(
+            downloads.append(Download(
                 content['download_url'],
                 os.path.join(output_dir, rel_path),
-                reporthook=ProgressBar()
-            )
+                size=content['size'],
+                checksum=('git', content['sha']),
+            ))
         elif content['type'] == 'dir':
-            _download_github_directory(content['path'], relative_to=relative_to, output_dir=output_dir)
-
-    
-class ProgressBar():
-    def __init__(self):
-        self.pbar = None
-
-    def __call__(self, block_num, block_size, total_size):
-        if self.pbar is None:
-            self.pbar = progressbar.ProgressBar(max_value=total_size)
-            self.pbar.start()
+            downloads.extend(_list_github_directory(downloader, content['path'], relative_to, output_dir))
+    return downloads
 
-        downloaded = block_num * block_size
-
-        if downloaded < total_size:
-            self.pbar.update(downloaded)
-        else:
-            self.pbar.finish()
 
-
-def _download_gutenberg_text(gutenberg_url, output_dir):
-    with urllib.request.urlopen(gutenberg_url) as f:
-        gutenberg_soup = BeautifulSoup(f.read(), 'lxml')
+def _download_gutenberg_text(downloader, gutenberg_url, output_dir):
+    gutenberg_soup = BeautifulSoup(downloader.get(gutenberg_url, ttl=PAGE_TTL), 'lxml')
 
     text_relative_url = gutenberg_soup.find('a', {'type': re.compile(r'text/plain.*')})['href']
     text_absolute_url = urllib.parse.urljoin('http://www.gutenberg.org/', text_relative_url)
     text_path = os.path.join(output_dir, 'text.txt')
 
-    urllib.request.urlretrieve(text_absolute_url, text_path, reporthook=ProgressBar())
+    downloader.download([Download(text_absolute_url, text_path)])
     print(f'✔ Text has been downloaded and saved as {text_path}')
 
 
-def _download_audio_files(audiobook_url, output_dir):
-    local_filename, _ = urllib.request.urlretrieve(audiobook_url, reporthook=ProgressBar())
-
+def _download_audio_files(downloader, audiobook_url, output_dir):
     audio_dir = os.path.join(output_dir, 'audio')
+    downloader.extract_zip(audiobook_url, audio_dir)
+    print(f'✔ Audio files have been downloaded to {audio_dir}')
+
+
+def _download_audio_tracks(downloader, librivox_soup, output_dir):
+    track_urls = _get_track_urls(librivox_soup)
+    if not track_urls:
+        print('❗ Links to the audio tracks are not found. Audio won\'t be downloaded.')
+        return
 
-    with ZipFile(local_filename) as z:
-        z.extractall(path=audio_dir)
+    audio_dir = os.path.join(output_dir, 'audio')
+    os.makedirs(audio_dir, exist_ok=True)
+    downloader.download(
+        Download(url, os.path.join(audio_dir, _get_filename(url))) for url in track_urls
+    )
     print(f'✔ Audio files have been downloaded to {audio_dir}')
+
+
+def _get_track_urls(librivox_soup):
+    """
+    Returns URLs of MP3 files of the chapters listed on the LibriVox page in their order.
+    """
+    links = librivox_soup.find_all('a', class_='chapter-name') or librivox_soup.find_all('a')
+    urls = []
+    for link in links:
+        url = link.get('href', '')
+        if urllib.parse.urlsplit(url).path.endswith('.mp3') and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _get_filename(url):
+    return urllib.parse.unquote(os.path.basename(urllib.parse.urlsplit(url).path))
@@ -0,0 +1,622 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import hashlib
+import http.client
+import io
+import json
+import os
+import re
+import struct
+import threading
+import time
+import urllib.parse
+import zlib
+
+import progressbar
+
+from . import profiling
+from .defaults import DOWNLOAD_JOBS
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 10
+USER_AGENT = 'syncabook'
+
+# suffix of a partially downloaded file, the download is resumed from its end
+PART_SUFFIX = '.part'
+
+# record of an extracted archive saved next to its output directory
+# that lists the extracted members, so the archive isn't downloaded again
+EXTRACTED_SUFFIX = '.zip.json'
+
+CONTENT_RANGE_RE = re.compile(r'bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+|\*)')
+
+LOCAL_FILE_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+
+
+class DownloadError(Exception):
+    """
+    Raised when some files fail to download.
+    `failures` maps URLs to error messages.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('\n'.join(
+            f'❌ Failed to download {url}: {error}' for url, error in sorted(failures.items())
+        ))
+
+
+class OfflineError(Exception):
+    def __init__(self, url):
+        self.url = url
+        super().__init__(f'{url} is not available offline')
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, url, status, reason):
+        self.url = url
+        self.status = status
+        super().__init__(f'HTTP {status} {reason}')
+
+
+class Download():
+    """
+    A file at `url` to be saved to `path`.
+    If `size` or `checksum` is known, the downloaded file is verified against it.
+    `checksum` is a (name, hexdigest) pair where name is a hashlib algorithm
+    or 'git' for the SHA-1 of a git blob reported by GitHub API, which requires `size`.
+    """
+    def __init__(self, url, path, size=None, checksum=None):
+        if checksum is not None and checksum[0] == 'git' and size is None:
+            raise ValueError('Size is required to verify git blob SHA-1.')
+        self.url = url
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+
+    def new_hash(self):
+        if self.checksum is None:
+            return None
+        name = self.checksum[0]
+        if name == 'git':
+            h = hashlib.sha1()
+            h.update(f'blob {self.size}\0'.encode())
+            return h
+        return hashlib.new(name)
+
+    def is_downloaded(self):
+        """
+        Checks whether the file at `path` exists and matches the expected size and checksum.
+        """
+        if not os.path.isfile(self.path):
+            return False
+        if self.size is not None and os.path.getsize(self.path) != self.size:
+            return False
+        h = self.new_hash()
+        if h is not None:
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    h.update(chunk)
+            return h.hexdigest() == self.checksum[1]
+        return True
+
+
+class Downloader():
+    """
+    Downloads files over HTTP(S) by a pool of `jobs` threads.
+    Connections are kept alive and reused for requests to the same host.
+    Each file is downloaded to a partial file first, so an interrupted download
+    is resumed with a Range request on the next attempt or run.
+    Failed requests are retried up to `retries` times.
+
+    Responses of `get` are cached in `http_cache` (see cache.HTTPCache) and revalidated
+    with If-None-Match/If-Modified-Since when they are older than the given TTL.
+    If `offline` is True, no requests are made: `get` returns cached responses only
+    and files must be already downloaded. Otherwise, OfflineError is raised.
+    """
+    def __init__(
+        self, jobs=DOWNLOAD_JOBS, retries=3, timeout=60, progress=False, http_cache=None, offline=False
+    ):
+        self.jobs = jobs
+        self.retries = retries
+        self.timeout = timeout
+        self.progress = progress
+        self.http_cache = http_cache
+        self.offline = offline
+        self._executor = None
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._pbar = None
+        self._downloaded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            for connections in self._connections.values():
+                for conn in connections:
+                    conn.close()
+            self._connections = {}
+
+    def get(self, url, ttl=None):
+        """
+        Returns the body of the response to GET `url`.
+        A cached response is returned without a request
+        if it has been validated less than `ttl` seconds ago.
+        """
+        with profiling.stage('get', url=url):
+            entry = self.http_cache.get(url) if self.http_cache is not None else None
+            if entry is not None and (
+                self.offline or (ttl is not None and time.time() - entry['validated_at'] < ttl)
+            ):
+                return entry['body']
+            return self._with_retries(self._get, url, entry)
+
+    def download(self, downloads):
+        """
+        Downloads files concurrently skipping the ones that are already downloaded.
+        Raises DownloadError if some files fail to download after all retries.
+        """
+        downloads = list(downloads)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+
+        self._start_progress(downloads)
+        futures = [(d, self._executor.submit(self._download_with_retries, d)) for d in downloads]
+        failures = {}
+        for d, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures[d.url] = f'{type(e).__name__}: {e}'
+        self._finish_progress()
+
+        if failures:
+            raise DownloadError(failures)
+
+    def extract_zip(self, url, output_dir):
+        """
+        Downloads ZIP archive from `url` extracting its members to `output_dir` as they arrive,
+        so the archive itself is never saved and extraction ends with the download.
+        If the transfer fails, it's resumed from the beginning of the member being extracted.
+        Returns names of the extracted files.
+
+        If the archive has been extracted to `output_dir` before and its members are there,
+        it isn't downloaded again. In offline mode, files that are in `output_dir` are used.
+        """
+        names = self._get_extracted_names(url, output_dir)
+        if names is not None:
+            return names
+
+        os.makedirs(output_dir, exist_ok=True)
+        # position in the archive after the last extracted member and the extracted names
+        state = {'offset': 0, 'names': []}
+        self._start_progress([])
+        try:
+            with profiling.stage('extract_zip', url=url):
+                self._with_retries(self._extract_zip, url, output_dir, state)
+        finally:
+            self._finish_progress()
+        with open(_get_extracted_record_path(output_dir), 'w') as f:
+            json.dump({'url': url, 'names': state['names']}, f)
+        return state['names']
+
+    def _get_extracted_names(self, url, output_dir):
+        """
+        Returns names of the members of the archive at `url` that is already extracted
+        to `output_dir` or None if it needs to be downloaded.
+        """
+        try:
+            with open(_get_extracted_record_path(output_dir), 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            record = None
+        if record is not None and record['url'] == url and all(
+            os.path.exists(os.path.join(output_dir, name)) for name in record['names']
+        ):
+            return record['names']
+
+        if self.offline and os.path.isdir(output_dir):
+            names = [
+                os.path.relpath(os.path.join(dirpath, filename), output_dir)
+                for dirpath, _, filenames in os.walk(output_dir)
+                for filename in filenames if not filename.endswith(PART_SUFFIX)
+            ]
+            if names:
+                return sorted(names)
+        return None
+
+    def _download_with_retries(self, d):
+        with profiling.stage('download', url=d.url):
+            self._with_retries(self._download, d)
+
+    def _with_retries(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except HTTPStatusError as e:
+                # client errors won't go away
+                if e.status < 500 or attempt == self.retries:
+                    raise
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def _get(self, url, entry=None):
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        with self._request(url, headers) as response:
+            if response.status == 304 and headers:
+                response.read()
+                self.http_cache.touch(url)
+                return entry['body']
+            if response.status != 200:
+                raise HTTPStatusError(url, response.status, response.reason)
+            body = response.read()
+
+        if self.http_cache is not None:
+            self.http_cache.put(
+                url, body,
+                etag=response.getheader('ETag'),
+                last_modified=response.getheader('Last-Modified'),
+            )
+        return body
+
+    def _download(self, d):
+        if d.is_downloaded():
+            self._advance(os.path.getsize(d.path))
+            return
+
+        part_path = d.path + PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if d.size is not None and offset > d.size:
+            offset = 0
+        headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+
+        with self._request(d.url, headers) as response:
+            expected_size = d.size
+            if response.status == 206:
+                m = CONTENT_RANGE_RE.fullmatch(response.getheader('Content-Range', ''))
+                if m is None or int(m.group('start')) != offset:
+                    raise http.client.HTTPException(f'Unexpected Content-Range for {d.url}')
+                if expected_size is None and m.group('total') != '*':
+                    expected_size = int(m.group('total'))
+            elif response.status == 200:
+                # the whole file is sent even if Range is requested
+                offset = 0
+                content_length = response.getheader('Content-Length')
+                if expected_size is None and content_length is not None:
+                    expected_size = int(content_length)
+            elif response.status == 416 and offset > 0 and offset == d.size:
+                # the partial file is complete
+                response.read()
+            elif response.status == 416:
+                # the partial file doesn't match the file on the server, start over
+                os.remove(part_path)
+                raise http.client.HTTPException(f'Partial download of {d.url} is invalid')
+            else:
+                raise HTTPStatusError(d.url, response.status, response.reason)
+
+            h = d.new_hash()
+            with open(part_path, 'r+b' if offset > 0 else 'wb') as f:
+                if h is not None and offset > 0:
+                    for chunk in iter(lambda: f.read(min(CHUNK_SIZE, offset - f.tell())), b''):
+                        h.update(chunk)
+                f.seek(offset)
+                f.truncate()
+                self._advance(offset)
+                if response.status != 416:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+                        if h is not None:
+                            h.update(chunk)
+                        self._advance(len(chunk))
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            raise http.client.HTTPException(
+                f'Downloaded {size} bytes of {expected_size} of {d.url}'
+            )
+        if h is not None and h.hexdigest() != d.checksum[1]:
+            os.remove(part_path)
+            raise ValueError(f'Checksum mismatch of {d.url}')
+        os.replace(part_path, d.path)
+
+    def _extract_zip(self, url, output_dir, state):
+        offset = state['offset']
+        headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+        with self._request(url, headers) as response:
+            if response.status == 200:
+                # the whole archive is sent, skip the members that have been extracted
+                reader = _StreamReader(response, self._advance)
+                reader.skip(offset)
+            elif response.status == 206:
+                m = CONTENT_RANGE_RE.fullmatch(response.getheader('Content-Range', ''))
+                if m is None or int(m.group('start')) != offset:
+                    raise http.client.HTTPException(f'Unexpected Content-Range for {url}')
+                reader = _StreamReader(response, self._advance, offset)
+            else:
+                raise HTTPStatusError(url, response.status, response.reason)
+
+            while True:
+                name = _extract_zip_member(reader, output_dir)
+                if name is None:
+                    break
+                state['offset'] = reader.tell()
+                state['names'].append(name)
+
+    @contextlib.contextmanager
+    def _request(self, url, headers=None):
+        """
+        Sends GET request to `url` following redirects and yields the response.
+        The connection is returned to the pool if the response is read without errors.
+        """
+        if self.offline:
+            raise OfflineError(url)
+        key, conn, response = self._open(url, headers)
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+        self._release(key, conn, response)
+
+    def _open(self, url, headers=None):
+        """
+        Sends GET request to `url` following redirects.
+        Returns the key of the connection, the connection and the response.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            conn, reused = self._acquire(key)
+            try:
+                response = self._send(conn, target, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # the server has closed the idle connection
+                conn, _ = self._acquire(key, reuse=False)
+                response = self._send(conn, target, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('Location')
+                response.read()
+                self._release(key, conn, response)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return key, conn, response
+        raise http.client.HTTPException(f'Too many redirects for {url}')
+
+    def _send(self, conn, target, headers):
+        try:
+            conn.request('GET', target, headers={'User-Agent': USER_AGENT, **(headers or {})})
+            return conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def _acquire(self, key, reuse=True):
+        """
+        Returns a connection for `key` and whether it has been used before.
+        """
+        if reuse:
+            with self._lock:
+                connections = self._connections.get(key)
+                if connections:
+                    return connections.pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        if scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+        raise ValueError(f'Unsupported URL scheme: {scheme}')
+
+    def _release(self, key, conn, response):
+        """
+        Returns the connection to the pool if the response has been read and the server keeps it alive.
+        """
+        if response.will_close or not response.isclosed():
+            conn.close()
+            return
+        with self._lock:
+            self._connections.setdefault(key, []).append(conn)
+
+    def _start_progress(self, downloads):
+        if not self.progress:
+            return
+        self._downloaded = 0
+        sizes = [d.size for d in downloads]
+        max_value = sum(sizes) if None not in sizes else progressbar.UnknownLength
+        self._pbar = progressbar.ProgressBar(max_value=max_value)
+        self._pbar.start()
+
+    def _advance(self, n):
+        if self._pbar is None:
+            return
+        with self._lock:
+            self._downloaded += n
+            if self._pbar.max_value is progressbar.UnknownLength or self._downloaded <= self._pbar.max_value:
+                self._pbar.update(self._downloaded)
+
+    def _finish_progress(self):
+        if self._pbar is not None:
+            self._pbar.finish()
+            self._pbar = None
+
+
+class _StreamReader():
+    """
+    Reads exact numbers of bytes from a stream counting the position
+    and allows to push back bytes that have been read too far.
+    """
+    def __init__(self, f, on_read=None, position=0):
+        self.f = f
+        self.on_read = on_read
+        self.position = position
+        self.buffer = b''
+
+    def tell(self):
+        return self.position - len(self.buffer)
+
+    def read(self, n):
+        data = self.read_some(n)
+        while len(data) < n:
+            chunk = self.read_some(n - len(data))
+            if not chunk:
+                raise http.client.IncompleteRead(data, n - len(data))
+            data += chunk
+        return data
+
+    def read_some(self, n):
+        if self.buffer:
+            data, self.buffer = self.buffer[:n], self.buffer[n:]
+            return data
+        data = self.f.read(n)
+        self.position += len(data)
+        if self.on_read is not None:
+            self.on_read(len(data))
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+    def skip(self, n):
+        while n > 0:
+            n -= len(self.read(min(n, CHUNK_SIZE)))
+
+
+def _extract_zip_member(reader, output_dir):
+    """
+    Reads the next member of ZIP archive from `reader` and extracts it to `output_dir`.
+    Returns the name of the member or None if there are no more members.
+    """
+    signature = reader.read_some(4)
+    if signature and len(signature) < 4:
+        signature += reader.read(4 - len(signature))
+    if signature != LOCAL_FILE_HEADER_SIGNATURE:
+        # central directory follows the members
+        return None
+    (
+        _, _, flags, method, _, _, crc, compress_size, file_size, name_length, extra_length
+    ) = LOCAL_FILE_HEADER.unpack(signature + reader.read(LOCAL_FILE_HEADER.size - 4))
+    name = reader.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+    extra = reader.read(extra_length)
+
+    zip64 = False
+    for header_id, data in _iter_extra_fields(extra):
+        if header_id == ZIP64_EXTRA_ID:
+            zip64 = True
+            values = list(struct.unpack(f'<{len(data) // 8}Q', data[:len(data) // 8 * 8]))
+            if file_size == 0xFFFFFFFF and values:
+                file_size = values.pop(0)
+            if compress_size == 0xFFFFFFFF and values:
+                compress_size = values.pop(0)
+
+    has_descriptor = bool(flags & 0x8)
+    if flags & 0x1:
+        raise ValueError(f'Encrypted member {name} is not supported')
+    if method not in (0, 8):
+        raise ValueError(f'Compression method {method} of {name} is not supported')
+    if has_descriptor:
+        if method == 0 and not name.endswith('/'):
+            raise ValueError(f'Size of stored member {name} is unknown until it is read')
+        # directories are empty
+        compress_size = 0 if method == 0 else None
+
+    path = _get_member_path(output_dir, name)
+    if path is None:
+        raise ValueError(f'Member {name} points outside of {output_dir}')
+
+    if name.endswith('/'):
+        os.makedirs(path, exist_ok=True)
+        actual_crc = _read_member_data(reader, io.BytesIO(), method, compress_size)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + PART_SUFFIX, 'wb') as f:
+            actual_crc = _read_member_data(reader, f, method, compress_size)
+
+    if has_descriptor:
+        descriptor = reader.read(4)
+        if descriptor == DATA_DESCRIPTOR_SIGNATURE:
+            descriptor = reader.read(4)
+        crc = struct.unpack('<I', descriptor)[0]
+        reader.read(16 if zip64 else 8)
+
+    if not name.endswith('/'):
+        if actual_crc != crc:
+            os.remove(path + PART_SUFFIX)
+            raise zlib.error(f'Bad CRC-32 of {name}')
+        os.replace(path + PART_SUFFIX, path)
+    return name
+
+
+def _read_member_data(reader, f, method, compress_size):
+    """
+    Reads data of a member compressed with `method` from `reader`, writes it to `f`
+    and returns its CRC-32. If `compress_size` is None, deflated data is read until its end.
+    """
+    crc = 0
+    if method == 0:
+        remaining = compress_size
+        while remaining > 0:
+            chunk = reader.read(min(remaining, CHUNK_SIZE))
+            remaining -= len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            f.write(chunk)
+        return crc
+
+    decompressor = zlib.decompressobj(-15)
+    remaining = compress_size
+    while not decompressor.eof:
+        size = CHUNK_SIZE if remaining is None else min(remaining, CHUNK_SIZE)
+        chunk = reader.read_some(size) if size > 0 else b''
+        if not chunk:
+            raise http.client.IncompleteRead(b'')
+        if remaining is not None:
+            remaining -= len(chunk)
+        data = decompressor.decompress(chunk)
+        crc = zlib.crc32(data, crc)
+        f.write(data)
+    reader.unread(decompressor.unused_data)
+    return crc
+
+
+def _iter_extra_fields(extra):
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[i:i + 4])
+        yield header_id, extra[i + 4:i + 4 + size]
+        i += 4 + size
+
+
+def _get_extracted_record_path(output_dir):
+    return os.path.normpath(output_dir) + EXTRACTED_SUFFIX
+
+
+def _get_member_path(output_dir, name):
+    """
+    Returns the path to extract member `name` to
+    or None if the name points outside of `output_dir`.
+    """
+    parts = [x for x in name.replace('\\', '/').split('/') if x not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    return os.path.join(output_dir, *parts)
@@ -0,0 +1,258 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import struct
+import time
+import zlib
+from zipfile import BadZipFile, ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
+
+
+MIMETYPE = 'application/epub+zip'
+
+# Audio and images are already compressed, deflating them only wastes CPU.
+STORED_EXTENSIONS = {
+    '.mp3', '.m4a', '.m4b', '.mp4', '.aac', '.ogg', '.opus',
+    '.jpg', '.jpeg', '.png', '.gif',
+}
+
+COPY_BUFSIZE = 1024 * 1024
+
+
+class Entry():
+    """
+    A single file of an EPUB archive.
+    Either `path` to a source file or rendered `data` must be provided.
+    `hash` is a SHA-256 of the contents if it's known in advance.
+    """
+    def __init__(self, arcname, path=None, data=None):
+        if (path is None) == (data is None):
+            raise ValueError('Either path or data must be provided.')
+        self.arcname = arcname
+        self.path = path
+        self.data = data
+        self.hash = None
+
+    @property
+    def compress_type(self):
+        return get_compress_type(self.arcname)
+
+    def read(self):
+        if self.path is None:
+            return self.data.encode('utf-8') if isinstance(self.data, str) else self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def zipinfo(self):
+        if self.path is not None:
+            # files extracted from archives may be dated before 1980, ZIP clamps them to 1980
+            zinfo = ZipInfo.from_file(self.path, self.arcname, strict_timestamps=False)
+        else:
+            zinfo = ZipInfo(self.arcname, date_time=time.localtime(time.time())[:6])
+            zinfo.external_attr = 0o644 << 16
+        zinfo.compress_type = self.compress_type
+        return zinfo
+
+
+def get_compress_type(arcname):
+    """
+    Returns compression method for an archive member:
+    ZIP_STORED for the mimetype, audio and images, ZIP_DEFLATED for everything else.
+    """
+    if arcname == 'mimetype':
+        return ZIP_STORED
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def collect_entries(src_dir, arc_dir, extension=None):
+    """
+    Returns entries for files in `src_dir` placed under `arc_dir` in the archive.
+    If `src_dir` doesn't exist, returns an empty list.
+    """
+    return [
+        Entry(f'{arc_dir}/{filename}', path=os.path.join(src_dir, filename))
+        for filename in listdir(src_dir, extension)
+    ]
+
+
+def listdir(path, extension=None):
+    """
+    Returns sorted names of regular files in `path` or an empty list if `path` doesn't exist.
+    If `extension` is given, only files with this extension are returned.
+    """
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        x for x in os.listdir(path)
+        if os.path.isfile(os.path.join(path, x))
+        and (extension is None or x.endswith(extension))
+    )
+
+
+def write_epub(ebook_path, entries, compresslevel=None, jobs=None, previous=None):
+    """
+    Writes EPUB archive to `ebook_path` in a single pass and
+    returns a dict that maps arcnames to SHA-256 hashes of the entries.
+    Source files are streamed into the archive directly, so no temporary copy is made.
+    If several entries have the same arcname, the last one wins.
+
+    Deflated entries are compressed with `compresslevel` on a pool of `jobs` threads
+    while stored entries (audio, images) are being written.
+
+    `previous` maps arcnames of the archive that is already at `ebook_path` to hashes of their contents.
+    Entries with the same hash are reused: the longest unchanged run of entries
+    at the beginning of the archive is kept in place and the other unchanged
+    deflated entries are copied without recompression.
+    Thus, entries that change rarely should go first.
+    """
+    unique_entries = {}
+    for entry in entries:
+        unique_entries.pop(entry.arcname, None)
+        unique_entries[entry.arcname] = entry
+
+    if compresslevel is None:
+        compresslevel = zlib.Z_DEFAULT_COMPRESSION
+
+    reusable = {
+        arcname for arcname, entry in unique_entries.items()
+        if entry.hash is not None and (previous or {}).get(arcname) == entry.hash
+    }
+
+    z, kept, raw_copies = None, [], {}
+    if reusable and os.path.exists(ebook_path):
+        try:
+            z, kept, raw_copies = _open_for_update(ebook_path, list(unique_entries), reusable)
+        except (BadZipFile, OSError):
+            z = None
+
+    hashes = {arcname: unique_entries[arcname].hash for arcname in kept}
+    pending = [arcname for arcname in unique_entries if arcname not in hashes]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        compressed = {
+            arcname: executor.submit(_deflate, unique_entries[arcname].read, compresslevel)
+            for arcname in pending
+            if unique_entries[arcname].compress_type == ZIP_DEFLATED and arcname not in raw_copies
+        }
+
+        if z is None:
+            z = ZipFile(ebook_path, 'w')
+            # mimetype must be first file in archive
+            z.writestr('mimetype', MIMETYPE, compress_type=ZIP_STORED)
+
+        with z:
+            for arcname in pending:
+                entry = unique_entries[arcname]
+                if arcname in raw_copies:
+                    zinfo, data = raw_copies[arcname]
+                    write_raw_entry(z, zinfo, data)
+                    hashes[arcname] = entry.hash
+                elif arcname in compressed:
+                    zinfo = entry.zipinfo()
+                    data, zinfo.CRC, zinfo.file_size, hashes[arcname] = compressed.pop(arcname).result()
+                    write_raw_entry(z, zinfo, data)
+                else:
+                    hashes[arcname] = _write_stored(z, entry)
+
+    return hashes
+
+
+def write_raw_entry(z, zinfo, data):
+    """
+    Appends an already compressed member to the ZipFile `z` opened for writing.
+    `zinfo` must have compress_type, CRC and file_size set.
+
+    zipfile has no public API for that, so this mirrors what ZipFile.open(mode='w') does.
+    """
+    zinfo.compress_size = len(data)
+    zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+    with z._lock:
+        z._writecheck(zinfo)
+        z._didModify = True
+        zinfo.header_offset = z.fp.tell()
+        z.fp.write(zinfo.FileHeader(zip64))
+        z.fp.write(data)
+        z.filelist.append(zinfo)
+        z.NameToInfo[zinfo.filename] = zinfo
+        z.start_dir = z.fp.tell()
+
+
+def read_raw_entry(z, zinfo):
+    """
+    Returns compressed bytes of the member `zinfo` of the ZipFile `z` without decompressing them.
+    """
+    z.fp.seek(zinfo.header_offset)
+    header = z.fp.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise BadZipFile(f'Bad local file header of {zinfo.filename}')
+    filename_length, extra_length = struct.unpack('<HH', header[26:30])
+    z.fp.seek(zinfo.header_offset + 30 + filename_length + extra_length)
+    return z.fp.read(zinfo.compress_size)
+
+
+def _open_for_update(ebook_path, arcnames, reusable):
+    """
+    Opens the archive at `ebook_path` for appending and truncates it
+    after the longest run of `reusable` entries that are in the same order as in `arcnames`.
+    Returns the ZipFile, arcnames of the kept entries and
+    raw copies of the other reusable deflated entries that have to be written again.
+    """
+    z = ZipFile(ebook_path, 'a')
+    try:
+        infos = z.infolist()
+        if not infos or infos[0].filename != 'mimetype':
+            raise BadZipFile('mimetype is not the first entry')
+
+        kept = []
+        for zinfo, arcname in zip(infos[1:], arcnames):
+            if zinfo.filename != arcname or arcname not in reusable:
+                break
+            kept.append(arcname)
+
+        raw_copies = {}
+        for zinfo in infos[len(kept) + 1:]:
+            arcname = zinfo.filename
+            if arcname in reusable and zinfo.compress_type == ZIP_DEFLATED:
+                new_zinfo = ZipInfo(arcname, date_time=zinfo.date_time)
+                new_zinfo.compress_type = zinfo.compress_type
+                new_zinfo.external_attr = zinfo.external_attr
+                new_zinfo.CRC = zinfo.CRC
+                new_zinfo.file_size = zinfo.file_size
+                raw_copies[arcname] = (new_zinfo, read_raw_entry(z, zinfo))
+
+        truncate_at = infos[len(kept) + 1].header_offset if len(infos) > len(kept) + 1 else z.start_dir
+        z.filelist = infos[:len(kept) + 1]
+        z.NameToInfo = {zinfo.filename: zinfo for zinfo in z.filelist}
+        z.fp.seek(truncate_at)
+        z.fp.truncate()
+        z.start_dir = truncate_at
+        z._didModify = True
+    except BaseException:
+        z.close()
+        raise
+
+    return z, kept, raw_copies
+
+
+def _write_stored(z, entry):
+    zinfo = entry.zipinfo()
+    h = hashlib.sha256()
+    if entry.path is None:
+        data = entry.read()
+        h.update(data)
+        z.writestr(zinfo, data, compress_type=ZIP_STORED)
+        return h.hexdigest()
+
+    with open(entry.path, 'rb') as src, z.open(zinfo, 'w') as dest:
+        for chunk in iter(lambda: src.read(COPY_BUFSIZE), b''):
+            h.update(chunk)
+            dest.write(chunk)
+    return h.hexdigest()
+
+
+def _deflate(read, compresslevel):
+    data = read()
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return compressed, zlib.crc32(data), len(data), hashlib.sha256(data).hexdigest()
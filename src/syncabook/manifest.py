@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+COPY_BUFSIZE = 1024 * 1024
+
+
+class Manifest():
+    """
+    Describes the files an ebook was built from:
+    for each archive entry it records the source path, size, mtime, content hash
+    and derived data such as the duration of a SMIL file.
+    `create_ebook` keeps it next to the ebook and uses it on rerun
+    to reuse unchanged entries of the previous build.
+    """
+    def __init__(self, ebook=None, compresslevel=None, entries=None):
+        self.ebook = ebook
+        self.compresslevel = compresslevel
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads manifest from `path`. If it doesn't exist or is corrupted, returns an empty manifest.
+        """
+        try:
+            with open(path, 'r') as f:
+                d = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return cls()
+        return cls(
+            ebook=d.get('ebook'),
+            compresslevel=d.get('compresslevel'),
+            entries=d.get('entries', {}),
+        )
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'ebook': self.ebook,
+                'compresslevel': self.compresslevel,
+                'entries': self.entries,
+            }, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def fingerprint(self, entry, previous):
+        """
+        Records source file of `entry` and sets `entry.hash` if it's known without a full read.
+        The hash is taken from the `previous` manifest if size and mtime haven't changed
+        and computed only if the size is the same but mtime is not.
+        Otherwise, the file has changed for sure and the hash is left to be computed
+        while the entry is written.
+        """
+        path = os.path.abspath(entry.path)
+        st = os.stat(path)
+        record = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime_ns}
+        prev_record = previous.entries.get(entry.arcname)
+        if (
+            prev_record is not None
+            and prev_record.get('path') == path
+            and prev_record.get('size') == st.st_size
+        ):
+            if prev_record.get('mtime') == st.st_mtime_ns:
+                entry.hash = prev_record.get('hash')
+            else:
+                entry.hash = hash_file(entry.path)
+        record['hash'] = entry.hash
+        self.entries[entry.arcname] = record
+
+    def get_unchanged(self, previous, arcname, key):
+        """
+        Returns `key` of the `previous` record for `arcname`
+        if the entry's content hasn't changed since. Otherwise, returns None.
+        """
+        prev_record = previous.entries.get(arcname)
+        record = self.entries.get(arcname)
+        if prev_record is None or record is None or record.get('hash') is None:
+            return None
+        if prev_record.get('hash') != record['hash']:
+            return None
+        return prev_record.get(key)
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFSIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,185 @@
+from datetime import timedelta
+import os.path
+import statistics
+from xml.parsers import expat
+
+from .audio import get_audio_duration
+from .defaults import MAX_DEVIATION
+from .epub import listdir
+from .utils import format_duration
+
+
+# typical narration rate used when the book's own rate can't be measured
+WORDS_PER_MINUTE = 150
+
+
+def check_book(book_dir, words_per_minute=None, max_deviation=MAX_DEVIATION):
+    """
+    Checks that text files in sync_text/ (or plaintext/ if there are none yet)
+    and audio files in audio/ can be synced without running the alignment.
+    Text files are paired with audio files in sorted order as `sync` does.
+    The duration of each audio file is read from its headers and compared with
+    the reading time of the paired text estimated by its number of words.
+    If `words_per_minute` is not given, the narration rate of the book is measured as
+    the median rate of the pairs, so that a single misplaced file stands out.
+
+    Returns a report:
+    {
+        'pairs': [{'text', 'audio', 'words', 'duration', 'expected_duration', 'outlier'}, ...],
+        'words_per_minute': ...,
+        'problems': [...],
+        'split_command': a split_text command that would match the audio or None,
+    }
+    Durations are in seconds, missing files and unknown durations are None.
+    """
+    text_dir = os.path.join(book_dir, 'sync_text')
+    text_filenames = listdir(text_dir, '.xhtml')
+    if not text_filenames:
+        text_dir = os.path.join(book_dir, 'plaintext')
+        text_filenames = listdir(text_dir, '.txt')
+    audio_dir = os.path.join(book_dir, 'audio')
+    audio_filenames = listdir(audio_dir)
+
+    problems = []
+    pairs = []
+    for i in range(max(len(text_filenames), len(audio_filenames))):
+        text_filename = text_filenames[i] if i < len(text_filenames) else None
+        audio_filename = audio_filenames[i] if i < len(audio_filenames) else None
+        words = None
+        if text_filename is not None:
+            try:
+                words = count_words(os.path.join(text_dir, text_filename))
+            except Exception as e:
+                # the check is advisory, so a file it can't read is reported, not raised
+                problems.append(f'Words of {text_filename} can\'t be counted: {e}')
+        pairs.append({
+            'text': text_filename,
+            'audio': audio_filename,
+            'words': words,
+            'duration': (
+                get_audio_duration(os.path.join(audio_dir, audio_filename))
+                if audio_filename is not None else None
+            ),
+            'expected_duration': None,
+            'outlier': False,
+        })
+
+    complete_pairs = [p for p in pairs if p['words'] and p['duration']]
+    if words_per_minute is None:
+        if complete_pairs:
+            words_per_minute = statistics.median(
+                p['words'] / p['duration'] * 60 for p in complete_pairs
+            )
+        else:
+            words_per_minute = WORDS_PER_MINUTE
+
+    if len(text_filenames) != len(audio_filenames):
+        problems.append(
+            f'There are {len(text_filenames)} text files and {len(audio_filenames)} audio files.'
+        )
+    for p in pairs:
+        if p['words'] is not None:
+            p['expected_duration'] = p['words'] / words_per_minute * 60
+        if p['text'] is None or p['audio'] is None or p['words'] is None:
+            continue
+        if p['duration'] is None:
+            problems.append(f'Duration of {p["audio"]} is unknown.')
+            continue
+        if p['words'] == 0:
+            p['outlier'] = True
+        else:
+            ratio = p['duration'] / p['expected_duration']
+            p['outlier'] = ratio > max_deviation or ratio < 1 / max_deviation
+        if p['outlier']:
+            problems.append(
+                f'{p["text"]} is expected to take {_format_seconds(p["expected_duration"])}'
+                f' but {p["audio"]} takes {_format_seconds(p["duration"])}.'
+            )
+
+    split_command = None
+    text_file = os.path.join(book_dir, 'text.txt')
+    if problems and audio_filenames and os.path.exists(text_file):
+        split_command = (
+            f'syncabook split_text {text_file} {os.path.join(book_dir, "plaintext")}'
+            f' --mode equal --n {len(audio_filenames)}'
+        )
+
+    return {
+        'pairs': pairs,
+        'words_per_minute': round(words_per_minute, 1),
+        'problems': problems,
+        'split_command': split_command,
+    }
+
+
+def print_report(report):
+    for p in report['pairs']:
+        mark = '❗' if p['outlier'] or p['text'] is None or p['audio'] is None else '✔'
+        words = '-' if p['words'] is None else p['words']
+        print(
+            f'{mark} {p["text"] or "-"} ({words} words, {_format_seconds(p["expected_duration"])})'
+            f' ↔ {p["audio"] or "-"} ({_format_seconds(p["duration"])})'
+        )
+    print(f'Narration rate: {report["words_per_minute"]} words per minute.')
+
+    if not report['problems']:
+        print('✔ Text and audio files match.')
+        return
+
+    for problem in report['problems']:
+        print(f'❗ {problem}')
+    if report['split_command'] is not None:
+        print(f'To split the text to match the audio files, run:\n{report["split_command"]}')
+
+
+def count_words(path):
+    """
+    Returns the number of words in the body of the XHTML file or in the plain text file at `path`.
+    XHTML that isn't well-formed XML, e.g. uses HTML entities like &nbsp;, is parsed as HTML.
+    """
+    if not path.endswith('.xhtml'):
+        words = 0
+        with open(path, 'r') as f:
+            for line in f:
+                words += len(line.split())
+        return words
+
+    words = 0
+    in_body = False
+
+    def start_element(name, attrs):
+        nonlocal in_body
+        if name.rpartition(' ')[2] == 'body':
+            in_body = True
+
+    def character_data(data):
+        nonlocal words
+        if in_body:
+            words += len(data.split())
+
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.CharacterDataHandler = character_data
+    try:
+        with open(path, 'rb') as f:
+            parser.ParseFile(f)
+    except expat.ExpatError:
+        return _count_html_words(path)
+
+    return words
+
+
+def _count_html_words(path):
+    from lxml import etree
+
+    body = etree.parse(path, etree.HTMLParser()).find('.//body')
+    if body is None:
+        return 0
+    return sum(len(text.split()) for text in body.itertext())
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    return format_duration(timedelta(seconds=seconds)).rpartition('.')[0]
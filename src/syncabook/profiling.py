@@ -0,0 +1,240 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+# Profiling is off unless `enable` is called.
+# Then `stage` returns a shared no-op context manager, so instrumented code costs almost nothing.
+_profiler = None
+
+
+class Profiler():
+    """
+    Collects a record of every stage: its wall time, CPU time of the process and its children,
+    bytes read and written and peak RSS of the process at the end of the stage.
+    """
+    def __init__(self):
+        self.records = []
+
+    def stage(self, name, args):
+        return _Stage(self, name, args)
+
+
+class _Stage():
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_children_cpu = _get_children_cpu_time()
+        self.start_io = _get_io_counters()
+        return self
+
+    def __exit__(self, *exc_info):
+        end_io = _get_io_counters()
+        self.profiler.records.append({
+            'name': self.name,
+            'args': self.args,
+            'start': self.start_time,
+            'wall': time.perf_counter() - self.start_wall,
+            'cpu': time.process_time() - self.start_cpu,
+            'children_cpu': _get_children_cpu_time() - self.start_children_cpu,
+            'read_bytes': end_io[0] - self.start_io[0] if end_io else None,
+            'written_bytes': end_io[1] - self.start_io[1] if end_io else None,
+            'max_rss': _get_max_rss(),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'failed': exc_info[0] is not None,
+        })
+        return False
+
+
+class _NoopStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _TracedResult():
+    """
+    The result of a function called in a worker process along with the records of its stages.
+    """
+    def __init__(self, value, records):
+        self.value = value
+        self.records = records
+
+
+def enable():
+    global _profiler
+    _profiler = Profiler()
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def stage(name, **args):
+    """
+    Returns a context manager that records the stage `name`.
+    `args` describe the stage, e.g. the chapter it processes.
+    """
+    if _profiler is None:
+        return _NOOP_STAGE
+    return _profiler.stage(name, args)
+
+
+def traced(func):
+    """
+    Wraps `func` that is submitted to a process pool, so that stages recorded in the worker
+    are returned along with the result. The result is unwrapped by `collect`.
+    If profiling is off, returns `func` itself.
+    """
+    if _profiler is None:
+        return func
+    return functools.partial(_call_traced, func)
+
+
+def collect(result):
+    """
+    Returns the value of the result of a `traced` function and adds its records to the profiler.
+    """
+    if not isinstance(result, _TracedResult):
+        return result
+    if _profiler is not None:
+        _profiler.records.extend(result.records)
+    return result.value
+
+
+def _call_traced(func, *args, **kwargs):
+    global _profiler
+    # a forked worker inherits the parent's records, they're not returned again
+    previous_profiler = _profiler
+    _profiler = Profiler()
+    try:
+        value = func(*args, **kwargs)
+        return _TracedResult(value, _profiler.records)
+    finally:
+        _profiler = previous_profiler
+
+
+def write_trace(path):
+    """
+    Writes the recorded stages to `path` as Chrome trace events
+    that can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+    if _profiler is None:
+        return
+    events = []
+    for record in _profiler.records:
+        events.append({
+            'name': record['name'],
+            'cat': 'syncabook',
+            'ph': 'X',
+            'ts': round(record['start'] * 1e6),
+            'dur': round(record['wall'] * 1e6),
+            'pid': record['pid'],
+            'tid': record['tid'],
+            'args': {
+                **record['args'],
+                'cpu_ms': round(record['cpu'] * 1000, 3),
+                'children_cpu_ms': round(record['children_cpu'] * 1000, 3),
+                'read_bytes': record['read_bytes'],
+                'written_bytes': record['written_bytes'],
+                'max_rss': record['max_rss'],
+                'failed': record['failed'],
+            },
+        })
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def get_summary():
+    """
+    Returns a list of totals of the recorded stages grouped by name in the order they started.
+    Nested stages are included in the totals of the outer ones.
+    """
+    if _profiler is None:
+        return []
+    summary = {}
+    for record in sorted(_profiler.records, key=lambda r: r['start']):
+        total = summary.setdefault(record['name'], {
+            'name': record['name'],
+            'calls': 0,
+            'wall': 0,
+            'cpu': 0,
+            'read_bytes': 0,
+            'written_bytes': 0,
+            'max_rss': 0,
+        })
+        total['calls'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu'] + record['children_cpu']
+        total['read_bytes'] += record['read_bytes'] or 0
+        total['written_bytes'] += record['written_bytes'] or 0
+        total['max_rss'] = max(total['max_rss'], record['max_rss'] or 0)
+    return list(summary.values())
+
+
+def print_summary(file=None):
+    file = file or sys.stderr
+    print(
+        f'\n{"stage":<24} {"calls":>6} {"wall, s":>9} {"cpu, s":>9}'
+        f' {"read, MB":>9} {"written, MB":>11} {"max RSS, MB":>11}',
+        file=file
+    )
+    for total in get_summary():
+        print(
+            f'{total["name"]:<24} {total["calls"]:>6} {total["wall"]:>9.3f} {total["cpu"]:>9.3f}'
+            f' {total["read_bytes"] / 2**20:>9.1f} {total["written_bytes"] / 2**20:>11.1f}'
+            f' {total["max_rss"] / 2**20:>11.1f}',
+            file=file
+        )
+
+
+def _get_children_cpu_time():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _get_io_counters():
+    """
+    Returns (bytes read, bytes written) by the process so far including cached I/O or None
+    if the platform doesn't provide them.
+    """
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            counters = dict(line.split(b':') for line in f.read().splitlines())
+        return int(counters[b'rchar']), int(counters[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _get_max_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
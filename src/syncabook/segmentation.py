@@ -0,0 +1,140 @@
+import functools
+import re
+
+
+SEGMENTERS = ('simple', 'rules')
+
+SIMPLE_BOUNDARY_RE = re.compile(r'(?<=[.!?] )')
+
+# Abbreviations that are followed by a period but don't end a sentence,
+# in lower case and without the final period.
+# Keys are the 3-letter language codes used by `sync`.
+ABBREVIATIONS = {
+    'eng': {
+        'mr', 'mrs', 'ms', 'messrs', 'dr', 'prof', 'rev', 'hon', 'st', 'jr', 'sr',
+        'gen', 'col', 'capt', 'lt', 'sgt', 'gov', 'mt', 'ft', 'vol', 'ch',
+        'p', 'pp', 'vs', 'etc', 'e.g', 'i.e', 'cf', 'viz', 'approx', 'jan', 'feb',
+        'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+    },
+    'deu': {
+        'hr', 'hrn', 'fr', 'frl', 'dr', 'prof', 'st', 'nr', 'bd', 'kap', 's',
+        'ca', 'vgl', 'bzw', 'usw', 'z.b', 'd.h', 'u.a', 'u.s.w', 'etc',
+    },
+    'fra': {
+        'm', 'mm', 'mme', 'mmes', 'mlle', 'mlles', 'dr', 'pr', 'st', 'ste',
+        'p', 'ch', 'vol', 'cf', 'etc', 'env', 'ex', 'p.ex',
+    },
+    'spa': {
+        'sr', 'sra', 'srta', 'sres', 'dr', 'dra', 'd', 'da', 'ud', 'uds', 'vd', 'vds',
+        'prof', 'pág', 'cap', 'vol', 'etc', 'p.ej',
+    },
+    'ita': {
+        'sig', 'sigg', 'dott', 'prof', 'avv', 'ing', 'sen', 'on', 'mons', 's',
+        'pag', 'cap', 'vol', 'ecc', 'ca', 'cfr',
+    },
+    'rus': {
+        'г', 'гг', 'т.е', 'т.д', 'т.п', 'и.т.д', 'др', 'пр', 'см', 'стр', 'гл',
+        'тов', 'проф', 'ул', 'им',
+    },
+}
+
+# Abbreviations that are also common words, so they're abbreviations only before a number,
+# e.g. "No. 5" but "No. He stayed home."
+NUMBER_ABBREVIATIONS = {
+    'eng': {'no'},
+}
+
+# Single-letter words that end sentences, so they're not initials.
+SINGLE_LETTER_WORDS = {
+    'eng': {'I'},
+}
+
+# Characters that may follow sentence-ending punctuation and still belong to the sentence.
+CLOSING_QUOTES = {
+    'eng': '"\'”’',
+    'deu': '"\'“‘»«',
+    'fra': '"\'»”',
+    'spa': '"\'»”’',
+    'ita': '"\'»”’',
+    'rus': '"\'»“”',
+}
+DEFAULT_CLOSING_QUOTES = '"\'”’»'
+CLOSING_BRACKETS = ')]'
+
+# Characters that may precede a word, e.g. an opening quote.
+OPENING_CHARS = '"\'“‘„«»([¿¡'
+
+
+def get_segmenter(name='simple', language='eng'):
+    """
+    Returns a function that splits a paragraph into a list of sentences.
+    Sentences keep the whitespace that follows them, so joined together they give the paragraph.
+    'simple' splits after '.', '!' or '?' followed by a space.
+    'rules' also handles closing quotes and brackets, abbreviations and initials of `language`.
+    """
+    if name == 'simple':
+        return split_sentences_simple
+    if name == 'rules':
+        return _get_rules_segmenter(language)
+    raise ValueError(f'\n❌ Unknown segmenter: {name}\n')
+
+
+def split_sentences_simple(text):
+    return [s for s in SIMPLE_BOUNDARY_RE.split(text) if s]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rules_segmenter(language):
+    return RulesSegmenter(
+        ABBREVIATIONS.get(language, set()),
+        CLOSING_QUOTES.get(language, DEFAULT_CLOSING_QUOTES),
+        NUMBER_ABBREVIATIONS.get(language, set()),
+        SINGLE_LETTER_WORDS.get(language, set()),
+    )
+
+
+class RulesSegmenter():
+    """
+    Splits text after sentence-ending punctuation, closing quotes and brackets
+    that are followed by whitespace.
+    The split isn't made if the period ends one of `abbreviations` or a single-letter initial
+    or if the next sentence would start with a lowercase letter.
+    `number_abbreviations` are abbreviations only if a digit follows them,
+    and `single_letter_words` aren't initials.
+    """
+    def __init__(self, abbreviations, closing_quotes, number_abbreviations=(), single_letter_words=()):
+        self.abbreviations = abbreviations
+        self.number_abbreviations = number_abbreviations
+        self.single_letter_words = single_letter_words
+        closing = re.escape(closing_quotes + CLOSING_BRACKETS)
+        self.boundary_re = re.compile(rf'([.!?…]+)[{closing}]*\s+')
+
+    def __call__(self, text):
+        sentences = []
+        start = 0
+        for m in self.boundary_re.finditer(text):
+            if m.end() == len(text):
+                break
+            if text[m.end()].islower():
+                continue
+            if m.group(1) == '.' and self._is_abbreviation(text, start, m.start(), m.end()):
+                continue
+            sentences.append(text[start:m.end()])
+            start = m.end()
+        if start < len(text):
+            sentences.append(text[start:])
+        return sentences
+
+    def _is_abbreviation(self, text, start, end, next_start):
+        """
+        Checks whether the word that ends at `end` and is followed by a period is an abbreviation.
+        The next sentence would start at `next_start`.
+        """
+        word_start = max(start, text.rfind(' ', start, end) + 1)
+        word = text[word_start:end].lstrip(OPENING_CHARS)
+        if len(word) == 1 and word.isalpha() and word not in self.single_letter_words:
+            # initial
+            return True
+        if word.lower() in self.number_abbreviations:
+            return text[next_start].isdigit()
+        return word.lower() in self.abbreviations
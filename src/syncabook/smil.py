@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import json
+import os
+import re
+from xml.parsers import expat
+
+
+FULL_CLOCKVALUE_RE = re.compile(r'(?P<h>\d+):(?P<m>[0-5]\d):(?P<s>[0-5]\d)(?:\.(?P<fraction>\d+))?')
+PARTIAL_CLOCKVALUE_RE = re.compile(r'(?P<m>[0-5]\d):(?P<s>[0-5]\d)(?:\.(?P<fraction>\d+))?')
+TIMECOUNT_RE = re.compile(r'(?P<count>\d+)(?:\.(?P<fraction>\d+))?(?P<metric>h|min|s|ms)?')
+
+# sidecar file in smil/ that caches durations of SMIL files
+DURATIONS_FILENAME = 'durations.json'
+
+METRIC_MS = {
+    'h': 3600000,
+    'min': 60000,
+    's': 1000,
+    'ms': 1,
+}
+
+
+def get_media_duration(smil_file_path):
+    """
+    Returns the total duration of audio clips in the SMIL file in milliseconds.
+    The file is parsed as a stream, so no tree is built.
+    """
+    duration = 0
+
+    def start_element(name, attrs):
+        nonlocal duration
+        if name.rpartition(' ')[2] != 'audio' or 'clipEnd' not in attrs:
+            return
+        clip_begin = parse_clockvalue(attrs['clipBegin']) if 'clipBegin' in attrs else 0
+        duration += parse_clockvalue(attrs['clipEnd']) - clip_begin
+
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.StartElementHandler = start_element
+    with open(smil_file_path, 'rb') as f:
+        parser.ParseFile(f)
+
+    return duration
+
+
+def get_media_durations(smil_file_paths, jobs=None):
+    """
+    Returns durations of SMIL files in milliseconds computed on a pool of `jobs` processes.
+    """
+    smil_file_paths = list(smil_file_paths)
+    if jobs == 1 or len(smil_file_paths) < 2:
+        return [get_media_duration(path) for path in smil_file_paths]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(get_media_duration, smil_file_paths))
+
+
+def read_durations(smil_dir):
+    """
+    Returns cached durations of SMIL files in `smil_dir` in milliseconds.
+    Durations of files that have changed since they were cached are omitted.
+    """
+    try:
+        with open(os.path.join(smil_dir, DURATIONS_FILENAME), 'r') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+    durations = {}
+    for filename, record in cache.items():
+        try:
+            st = os.stat(os.path.join(smil_dir, filename))
+        except FileNotFoundError:
+            continue
+        if record.get('size') == st.st_size and record.get('mtime') == st.st_mtime_ns:
+            durations[filename] = record['duration']
+    return durations
+
+
+def write_durations(smil_dir, durations):
+    """
+    Caches `durations` of SMIL files in `smil_dir` along with their sizes and mtimes.
+    """
+    cache = {}
+    for filename, duration in sorted(durations.items()):
+        st = os.stat(os.path.join(smil_dir, filename))
+        cache[filename] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'duration': duration}
+
+    path = os.path.join(smil_dir, DURATIONS_FILENAME)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def to_ms(time):
+    """
+    Converts a time returned by afaligner to milliseconds.
+    It may be a clock value, a timedelta or a number of seconds.
+    """
+    if isinstance(time, str):
+        return parse_clockvalue(time)
+    if isinstance(time, timedelta):
+        return round(time / timedelta(milliseconds=1))
+    return round(time * 1000)
+
+
+def parse_clockvalue(clockvalue):
+    """
+    Converts SMIL clock value to milliseconds.
+    Full ('1:02:03.5'), partial ('02:03.5') and timecount ('12.5s', '3min', '250ms') values are supported.
+    Timecount without a metric is in seconds.
+    """
+    clockvalue = clockvalue.strip()
+
+    m = FULL_CLOCKVALUE_RE.fullmatch(clockvalue) or PARTIAL_CLOCKVALUE_RE.fullmatch(clockvalue)
+    if m is not None:
+        hours = int(m.groupdict().get('h') or 0)
+        seconds = (hours * 60 + int(m.group('m'))) * 60 + int(m.group('s'))
+        return seconds * 1000 + _fraction_to_ms(m.group('fraction'), 1000)
+
+    m = TIMECOUNT_RE.fullmatch(clockvalue)
+    if m is not None:
+        metric_ms = METRIC_MS[m.group('metric') or 's']
+        return int(m.group('count')) * metric_ms + _fraction_to_ms(m.group('fraction'), metric_ms)
+
+    raise ValueError(f'Invalid SMIL clock value: {clockvalue!r}')
+
+
+def _fraction_to_ms(fraction, metric_ms):
+    """
+    Converts decimal `fraction` digits of a unit that is `metric_ms` long to milliseconds rounding half up.
+    """
+    if not fraction:
+        return 0
+    denominator = 10 ** len(fraction)
+    return (2 * int(fraction) * metric_ms + denominator) // (2 * denominator)
@@ -1,36 +1,83 @@
+from array import array
+import bisect
+import io
 import os
 import re
 
 from .utils import get_number_of_digits_to_name
 
 
-def split_text(text_file, output_dir, mode, pattern, n):
+PARAGRAPH_BOUNDARY_RE = re.compile(r'\n\n')
+
+BALANCE_MODES = ('words', 'chars')
+
+# Text is read by chunks of CHUNK_SIZE characters.
+# A match is accepted only when at least LOOKAHEAD characters follow it
+# (or the text has ended), so a pattern may match up to LOOKAHEAD characters.
+# LOOKAHEAD characters before the next possible match are kept as well,
+# so that lookbehinds and anchors like \b see the same text as in the whole file.
+CHUNK_SIZE = 1024 * 1024
+LOOKAHEAD = 64 * 1024
+
+
+def split_text(text_file, output_dir, mode, pattern, n, balance='words'):
     """
     Splits contents of `text_file` into several texts and saves them to `output_dir`.
+    The text is read and the parts are written incrementally,
+    so files of any size are split without loading them into memory.
     """
-    with open(text_file, 'r') as f:
-            text = f.read()
-
     if mode in ['opening', 'delimeter'] and pattern is None:
         print(f'\n❌ --pattern is required in {mode} mode.\n')
         return
 
-    if mode == 'opening':
-        texts = _split_text_by_opening(pattern, text)
-    elif mode == 'delimeter':
-        texts = _split_text_by_delimeter(pattern, text)
-    elif mode == 'equal':
-        if n is None:
-            print(f'\n❌ --n is required in {mode} mode.\n')
-            return
+    if mode == 'equal' and n is None:
+        print(f'\n❌ --n is required in {mode} mode.\n')
+        return
 
-        texts = _split_text_into_n_parts(n, text, output_dir)
-    else:
+    if mode not in ['opening', 'delimeter', 'equal']:
         print(f'\n❌ Unknown mode {mode}.\n')
+        return
 
-    if len(texts) > 0:
-        _save_texts(texts, output_dir)
-        print(f'✔ Splitting into {len(texts)} files is performed.')
+    with open(text_file, 'r') as f:
+        parts_num = _save_pieces(_iter_pieces(f, mode, pattern, n, balance), output_dir)
+
+    if mode == 'opening' and parts_num == 0:
+        print(f'\n❗ No text matching pattern "{pattern}". Splitting is not performed.\n')
+
+    if parts_num > 0:
+        print(f'✔ Splitting into {parts_num} files is performed.')
+
+
+def split_text_into_parts(text_file, mode, pattern, n, balance='words'):
+    """
+    Splits contents of `text_file` as `split_text` does but returns the parts instead of saving them.
+    """
+    if mode in ['opening', 'delimeter'] and pattern is None:
+        raise ValueError(f'\n❌ pattern is required in {mode} mode.\n')
+    if mode == 'equal' and n is None:
+        raise ValueError(f'\n❌ n is required in {mode} mode.\n')
+    if mode not in ['opening', 'delimeter', 'equal']:
+        raise ValueError(f'\n❌ Unknown mode {mode}.\n')
+
+    with open(text_file, 'r') as f:
+        return _collect_pieces(_iter_pieces(f, mode, pattern, n, balance))
+
+
+def get_part_names(parts_num):
+    """
+    Returns names of `parts_num` parts without extension: their numbers padded to the same width.
+    """
+    n = get_number_of_digits_to_name(parts_num)
+    return [f'{i:0>{n}}' for i in range(1, parts_num + 1)]
+
+
+def _iter_pieces(f, mode, pattern, n, balance):
+    if mode == 'opening':
+        return _iter_opening_pieces(_iter_tokens(f, re.compile(pattern)))
+    elif mode == 'delimeter':
+        return _iter_delimeter_pieces(_iter_tokens(f, re.compile(pattern)))
+    else:
+        return _iter_equal_pieces(f, n, balance)
 
 
 def _split_text_by_opening(pattern, text):
@@ -39,14 +86,11 @@ def _split_text_by_opening(pattern, text):
     For example, --pattern='\n\nCHAPTER \\d+\n\n' may be used
     to split text into chapters.
     """
-    openings = re.findall(pattern, text)
+    texts = _collect_pieces(_iter_opening_pieces(_iter_tokens(io.StringIO(text), re.compile(pattern))))
 
-    if len(openings) == 0:
+    if len(texts) == 0:
         print(f'\n❗ No text matching pattern "{pattern}". Splitting is not performed.\n')
-        return []
 
-    texts = re.split(pattern, text)
-    texts = [d + t for d, t in zip(openings, texts[1:])]
     return texts
 
 
@@ -54,42 +98,193 @@ def _split_text_by_delimeter(pattern, text):
     """
     Splits text into parts separated by delimeter that matches `pattern`.
     Delimeter is not included in the returned texts.
-    For example, --pattern='\n\n---------\n\n' may be used if 
+    For example, --pattern='\n\n---------\n\n' may be used if
     chapter are separated by 8 dashes.
     """
-    texts = re.split(pattern, text)
-
-    if len(texts) == 0:
-        print(f'\n❗ No text matching pattern "{pattern}". Splitting is not performed.\n')
-
-    return texts
+    return _collect_pieces(_iter_delimeter_pieces(_iter_tokens(io.StringIO(text), re.compile(pattern))))
 
 
-def _split_text_into_n_parts(n, text, output_dir):
+def _split_text_into_n_parts(n, text, output_dir=None, balance='words'):
     """
     Splits text into `n` approximately equal parts.
     The splitting is permformed only at paragraphs' boundaries.
+    Parts are balanced by the number of words (which is proportional to the duration of audio)
+    or by the number of characters if `balance` is 'chars'.
     """
-    l = len(text) // n
+    return _collect_pieces(_iter_equal_pieces(io.StringIO(text), n, balance))
 
-    texts = []
 
-    cur_part_start = 0
-    for i in range(len(text)):
-        if i >= cur_part_start + l and text[i] == text[i+1] == '\n':
-            texts.append(text[cur_part_start:i+2])
-            cur_part_start = i + 2
+def _iter_tokens(f, regex, chunk_size=CHUNK_SIZE, lookahead=LOOKAHEAD):
+    """
+    Reads text from file object `f` by chunks and yields ('text', str) and ('match', str) tokens
+    so that matches of `regex` are found across chunks' boundaries.
+    """
+    buffer = ''
+    # position in the buffer where the next match may start
+    start = 0
+    eof = False
+    while not eof:
+        chunk = f.read(chunk_size)
+        eof = chunk == ''
+        buffer += chunk
 
-    texts.append(text[cur_part_start:])
+        pos = start
+        keep_from = len(buffer) if eof else max(start, len(buffer) - lookahead)
+        # ^ matches only at the real beginning of the buffer, which is dropped once start > 0
+        for m in regex.finditer(buffer, start):
+            if m.end() == m.start():
+                raise ValueError(f'\n❌ Pattern "{regex.pattern}" matches empty string.\n')
+            if not eof and m.end() > keep_from:
+                # the match may continue in the next chunk
+                keep_from = min(keep_from, m.start())
+                break
+            yield 'text', buffer[pos:m.start()]
+            yield 'match', m.group()
+            pos = m.end()
 
-    return texts
+        keep_from = max(pos, keep_from)
+        yield 'text', buffer[pos:keep_from]
+        drop = max(0, keep_from - lookahead)
+        buffer = buffer[drop:]
+        start = keep_from - drop
+
+
+def _iter_opening_pieces(tokens):
+    """
+    Yields (part_index, piece) where each part begins with a match.
+    Text before the first match is dropped.
+    """
+    part = -1
+    for kind, s in tokens:
+        if kind == 'match':
+            part += 1
+            yield part, s
+        elif part >= 0 and s:
+            yield part, s
+
+
+def _iter_delimeter_pieces(tokens):
+    """
+    Yields (part_index, piece) where parts are separated by matches.
+    """
+    part = 0
+    yield part, ''
+    for kind, s in tokens:
+        if kind == 'match':
+            part += 1
+            yield part, ''
+        elif s:
+            yield part, s
+
+
+def _iter_equal_pieces(f, n, balance):
+    """
+    Yields (part_index, piece) splitting text from file object `f` into `n` approximately equal parts.
+    The first pass over `f` finds paragraphs' boundaries and their cumulative weights,
+    the second pass yields the parts.
+    """
+    if balance not in BALANCE_MODES:
+        raise ValueError(f'\n❌ Unknown balance mode: {balance}\n')
 
+    # cumulative weight of the text preceding each paragraph boundary
+    # stored compactly as there may be millions of paragraphs
+    boundaries = array('q')
+    weights = array('q')
+    weight = 0
+    offset = 0
+    in_word = False
+    for kind, s in _iter_tokens(f, PARAGRAPH_BOUNDARY_RE):
+        offset += len(s)
+        if balance == 'chars':
+            weight += len(s)
+        else:
+            words, in_word = _count_words(s, in_word)
+            weight += words
+        if kind == 'match':
+            boundaries.append(offset)
+            weights.append(weight)
+    cuts = _choose_cuts(boundaries, weights, weight, n, offset)
 
-def _save_texts(texts, output_dir):
+    f.seek(0)
+    part = 0
+    offset = 0
+    yield part, ''
+    for _, s in _iter_tokens(f, PARAGRAPH_BOUNDARY_RE):
+        if s:
+            yield part, s
+        offset += len(s)
+        if part < len(cuts) and offset == cuts[part]:
+            part += 1
+            yield part, ''
+
+
+def _choose_cuts(boundaries, weights, total_weight, n, length):
+    """
+    Returns offsets at which text is split into `n` parts of approximately equal weight.
+    For each target weight, the nearest boundary is found by binary search.
+    """
+    cuts = []
+    for i in range(1, n):
+        target = total_weight * i / n
+        j = bisect.bisect_left(weights, target)
+        # choose the nearest boundary
+        if j == len(weights) or (j > 0 and target - weights[j-1] <= weights[j] - target):
+            j -= 1
+        if j >= 0 and (not cuts or boundaries[j] > cuts[-1]) and boundaries[j] < length:
+            cuts.append(boundaries[j])
+    return cuts
+
+
+def _count_words(s, in_word):
+    """
+    Counts words in `s` that follows text ending inside a word if `in_word` is True.
+    Returns the number of words and whether `s` ends inside a word.
+    """
+    if not s:
+        return 0, in_word
+    words = len(s.split())
+    if words > 0 and in_word and not s[0].isspace():
+        words -= 1
+    return words, not s[-1].isspace()
+
+
+def _collect_pieces(pieces):
+    texts = []
+    for part, piece in pieces:
+        if part == len(texts):
+            texts.append([])
+        texts[part].append(piece)
+    return [''.join(t) for t in texts]
+
+
+def _save_pieces(pieces, output_dir):
+    """
+    Writes each part to its file as soon as the pieces arrive and returns the number of parts.
+    Files are named by their numbers padded to the same width,
+    which is known only at the end, so they are renamed then.
+    """
     os.makedirs(output_dir, exist_ok=True)
 
-    for i, text in enumerate(texts, start=1):
-        n = get_number_of_digits_to_name(len(texts))
-        file_path = os.path.join(output_dir, f'{i:0>{n}}.txt')
-        with open(file_path, 'w') as f:
-            f.write(text)
\ No newline at end of file
+    tmp_paths = []
+    f = None
+    try:
+        for part, piece in pieces:
+            if part == len(tmp_paths):
+                if f is not None:
+                    f.close()
+                tmp_paths.append(os.path.join(output_dir, f'.{part + 1}.txt.tmp'))
+                f = open(tmp_paths[-1], 'w')
+            f.write(piece)
+    except BaseException:
+        for path in tmp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        if f is not None:
+            f.close()
+
+    for name, tmp_path in zip(get_part_names(len(tmp_paths)), tmp_paths):
+        os.replace(tmp_path, os.path.join(output_dir, f'{name}.txt'))
+
+    return len(tmp_paths)
@@ -1,25 +1,484 @@
-import os.path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from xml.parsers import expat
 
+from . import profiling
+from .audio import get_prepared_audio
+from .cache import DirCache, get_cache_dir
+from .epub import listdir
+from .smil import to_ms, write_durations
+from .utils import MissingDependencyError, drop_extension, format_duration
 
-def sync(book_dir, alignment_radius, alignment_skip_penalty, language):
+
+ALIGNMENT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# afaligner's sync map stored next to the cached SMIL files
+SYNC_MAP_FILENAME = 'sync_map.json'
+
+# progress journal in book_dir
+JOURNAL_FILENAME = 'sync_journal.jsonl'
+
+FRAGMENT_ID_RE = re.compile(r'f[0-9]+')
+
+
+class SyncError(Exception):
+    """
+    Raised when some chapters fail to synchronize.
+    `failures` maps names of the text files to error messages.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('\n'.join(
+            f'❌ Failed to sync {text_file}: {error}' for text_file, error in sorted(failures.items())
+        ))
+
+
+def sync(
+    book_dir, alignment_radius, alignment_skip_penalty, language, jobs=1,
+    cache_dir=None, use_cache=True, resume=False, by_chapter=False,
+):
+    """
+    Synchronizes text and audio producing a list of SMIL files in smil/.
+    Returns a dict that maps names of the SMIL files to chapters' timings:
+    the name of the text file, a list of fragments with ids, audio files,
+    begin and end times in milliseconds and the total duration of the Media Overlay.
+    If afaligner produces no sync map, returns None.
+
+    By default, the whole book is aligned by a single afaligner call.
+    If `by_chapter` is True or `jobs` > 1, each text file is paired with the audio file
+    at the same position and chapters are aligned one by one or concurrently by `jobs` processes.
+    Each SMIL file is written atomically as soon as its chapter is aligned
+    and the progress is recorded in the journal in `book_dir`,
+    so an interrupted synchronization can be resumed.
+    If some chapters fail, SyncError is raised after all the others are aligned.
+
+    If `resume` is True, chapters are paired as well, and only those
+    whose SMIL files are missing or stale according to the journal are aligned.
+
+    Results are cached in `cache_dir` (shared by all books by default)
+    keyed by the text fragments, the audio and the alignment parameters,
+    so unchanged chapters are not aligned again.
+
+    Audio files that have been decoded by `prepare_audio` are aligned using
+    the prepared WAV files under the original names, so SMIL files refer to the original files.
+    """
     try:
-        from afaligner import align
+        import afaligner
     except ImportError:
-        print('❌ Synchronization requires afaligner library. You should install it and try again.')
-        exit(1)
+        raise MissingDependencyError('afaligner library', 'Synchronization')
 
     sync_text_dir = os.path.join(book_dir, 'sync_text')
     audio_dir = os.path.join(book_dir, 'audio')
     output_dir = os.path.join(book_dir, 'smil')
-    print('Calling afaligner for syncing...')
-    sync_map = align(
-        sync_text_dir, audio_dir, output_dir,
+    align_kwargs = {
+        'radius': alignment_radius,
+        'skip_penalty': alignment_skip_penalty,
+        'language': language,
+    }
+    cache = None
+    if use_cache:
+        cache = DirCache(cache_dir or get_cache_dir('alignment'), ALIGNMENT_CACHE_MAX_SIZE)
+
+    text_paths = [os.path.join(sync_text_dir, x) for x in listdir(sync_text_dir)]
+    audio_paths = [os.path.join(audio_dir, x) for x in listdir(audio_dir)]
+    prepared = get_prepared_audio(book_dir)
+    if prepared:
+        print(f'✔ Using {len(prepared)} prepared audio files.')
+    audio_sources = {os.path.join(audio_dir, x): path for x, (path, _) in prepared.items()}
+    sample_rates = {x: sample_rate for x, (_, sample_rate) in prepared.items()}
+    by_chapter = by_chapter or resume or jobs is None or jobs > 1
+    if by_chapter and len(text_paths) != len(audio_paths):
+        print(
+            f'❗ Number of text files ({len(text_paths)}) doesn\'t match'
+            f' number of audio files ({len(audio_paths)}).'
+            ' The whole book will be synced by a single afaligner call.'
+        )
+        by_chapter = False
+        jobs = 1
+
+    if by_chapter:
+        units = [([t], [a]) for t, a in zip(text_paths, audio_paths)]
+    else:
+        units = [(text_paths, audio_paths)]
+    # keys are needed to look up the cache and to resume from the journal later
+    if cache is not None or by_chapter or resume:
+        with profiling.stage('hash_inputs'):
+            units = [(t, a, _get_unit_key(t, a, align_kwargs, sample_rates)) for t, a in units]
+    else:
+        units = [(t, a, None) for t, a in units]
+
+    os.makedirs(output_dir, exist_ok=True)
+    journal = SyncJournal(os.path.join(book_dir, JOURNAL_FILENAME))
+    records = journal.load() if resume else {}
+    sync_map = {}
+    synced_records = []
+    pending_units = []
+    for unit_text_paths, unit_audio_paths, key in units:
+        record = _get_synced_record(records, unit_text_paths, key, output_dir)
+        if record is None:
+            pending_units.append((unit_text_paths, unit_audio_paths, key))
+        else:
+            synced_records.append(record)
+            sync_map.update(record['sync_map'])
+    journal.start([os.path.basename(path) for path in text_paths], synced_records)
+
+    if not pending_units:
+        print('✔ All chapters are already synced.')
+    elif by_chapter:
+        print(f'Calling afaligner for syncing {len(pending_units)} chapters...')
+    else:
+        print('Calling afaligner for syncing...')
+
+    try:
+        sync_map.update(_align_units(
+            pending_units, output_dir, align_kwargs, cache, jobs, journal, audio_sources
+        ))
+    finally:
+        if cache is not None:
+            cache.evict()
+
+    if not sync_map:
+        return None
+
+    print('✔ Text and audio have been successfully synced.')
+    sync_map = {text_file: sync_map[text_file] for text_file in sorted(sync_map)}
+    chapters = _get_chapters_timings(sync_map)
+    write_durations(output_dir, {name: chapter['duration'] for name, chapter in chapters.items()})
+    return chapters
+
+
+def is_sync_complete(book_dir):
+    """
+    Returns False if the journal in `book_dir` shows that the last synchronization
+    has not synced all chapters. If there's no journal, returns True.
+    """
+    return SyncJournal(os.path.join(book_dir, JOURNAL_FILENAME)).is_complete()
+
+
+class SyncJournal():
+    """
+    Append-only journal of synchronization progress.
+    The first line lists text files to sync, each next line records a synced unit:
+    its text files, the key of its inputs and afaligner's sync map.
+    A line is appended and flushed to disk as soon as a unit is synced,
+    so after a crash the journal shows which SMIL files are up-to-date.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Returns a dict that maps names of text files to records of the units they were synced in.
+        A truncated last line is ignored.
+        """
+        records = {}
+        for line in self._read_lines()[1:]:
+            for text_file in line['text_files']:
+                records[text_file] = line
+        return records
+
+    def start(self, text_files, records):
+        """
+        Rewrites the journal for a new run that syncs `text_files`
+        keeping `records` of the units that are already synced.
+        """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'text_files': text_files}) + '\n')
+            for record in records:
+                f.write(json.dumps(record, default=_to_json) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def record(self, text_paths, key, sync_map):
+        line = {
+            'text_files': [os.path.basename(path) for path in text_paths],
+            'key': key,
+            'sync_map': sync_map,
+        }
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(line, default=_to_json) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_complete(self):
+        lines = self._read_lines()
+        if not lines:
+            return True
+        return set(lines[0]['text_files']) <= set(self.load())
+
+    def _read_lines(self):
+        try:
+            with open(self.path, 'r') as f:
+                raw_lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+        lines = []
+        for raw_line in raw_lines:
+            try:
+                lines.append(json.loads(raw_line))
+            except ValueError:
+                break
+        return lines
+
+
+def _get_synced_record(records, text_paths, key, output_dir):
+    """
+    Returns the journal record of the unit if it has been synced
+    with the same inputs and its SMIL files exist. Otherwise, returns None.
+    """
+    record = records.get(os.path.basename(text_paths[0]))
+    if record is None or key is None or record['key'] != key:
+        return None
+    if record['text_files'] != [os.path.basename(path) for path in text_paths]:
+        return None
+    for filename in _get_smil_filenames(record['sync_map']):
+        if not os.path.exists(os.path.join(output_dir, filename)):
+            return None
+    return record
+
+
+def _align_units(units, output_dir, align_kwargs, cache, jobs, journal, audio_sources=None):
+    """
+    Aligns each unit – text paths, audio paths and their key – and returns the merged sync map.
+    Several units are aligned on a pool of `jobs` processes.
+    Each synced unit is recorded in the `journal`.
+    """
+    if not units:
+        return {}
+
+    if len(units) == 1 and len(units[0][0]) > 1:
+        # the whole book is aligned by a single afaligner call
+        text_paths, audio_paths, key = units[0]
+        unit_sync_map = _align_unit(
+            text_paths, audio_paths, key, output_dir, align_kwargs, cache, audio_sources
+        )
+        if unit_sync_map:
+            journal.record(text_paths, key, unit_sync_map)
+        return unit_sync_map or {}
+
+    sync_map = {}
+    failures = {}
+
+    def collect(text_paths, key, get_result):
+        text_file = os.path.basename(text_paths[0])
+        try:
+            unit_sync_map = get_result()
+        except Exception as e:
+            failures[text_file] = f'{type(e).__name__}: {e}'
+            return
+        if not unit_sync_map:
+            failures[text_file] = 'afaligner produced no sync map'
+            return
+        journal.record(text_paths, key, unit_sync_map)
+        sync_map.update(unit_sync_map)
+        print(f'✔ {text_file} has been synced.')
+
+    if jobs == 1:
+        for text_paths, audio_paths, key in units:
+            collect(text_paths, key, lambda: _align_unit(
+                text_paths, audio_paths, key, output_dir, align_kwargs, cache, audio_sources
+            ))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(
+                    profiling.traced(_align_unit),
+                    text_paths, audio_paths, key, output_dir, align_kwargs, cache, audio_sources
+                ): (text_paths, key)
+                for text_paths, audio_paths, key in units
+            }
+            for future in as_completed(futures):
+                text_paths, key = futures[future]
+                collect(text_paths, key, lambda: profiling.collect(future.result()))
+
+    if failures:
+        raise SyncError(failures)
+
+    return sync_map
+
+
+def _align_unit(text_paths, audio_paths, key, output_dir, align_kwargs, cache=None, audio_sources=None):
+    """
+    Aligns text files with audio files by passing afaligner directories
+    that contain only these files. If `cache` has the result, copies SMIL files from it instead.
+    SMIL files are moved to `output_dir` only when they are complete.
+    `audio_sources` maps audio paths to the files that are aligned in their place.
+    """
+    text_files = [os.path.basename(path) for path in text_paths]
+    if cache is not None:
+        entry_dir = cache.get(key)
+        if entry_dir is not None:
+            with profiling.stage('copy_cached_smil', text_files=text_files):
+                with open(os.path.join(entry_dir, SYNC_MAP_FILENAME), 'r') as f:
+                    sync_map = json.load(f)
+                for filename in _get_smil_filenames(sync_map):
+                    tmp_path = os.path.join(output_dir, f'.{filename}.tmp')
+                    shutil.copy(os.path.join(entry_dir, filename), tmp_path)
+                    os.replace(tmp_path, os.path.join(output_dir, filename))
+            return sync_map
+
+    with tempfile.TemporaryDirectory(prefix='syncabook-') as tmp_dir, \
+            tempfile.TemporaryDirectory(prefix='.tmp-', dir=output_dir) as tmp_output_dir:
+        text_dir = os.path.join(tmp_dir, 'text')
+        audio_dir = os.path.join(tmp_dir, 'audio')
+        os.makedirs(text_dir)
+        os.makedirs(audio_dir)
+        for path in text_paths:
+            _link(path, os.path.join(text_dir, os.path.basename(path)))
+        for path in audio_paths:
+            source_path = (audio_sources or {}).get(path, path)
+            _link(source_path, os.path.join(audio_dir, os.path.basename(path)))
+        with profiling.stage('align', text_files=text_files):
+            sync_map = _align(text_dir, audio_dir, tmp_output_dir, align_kwargs)
+        if not sync_map:
+            return sync_map
+
+        for filename in _get_smil_filenames(sync_map):
+            os.replace(os.path.join(tmp_output_dir, filename), os.path.join(output_dir, filename))
+
+        if cache is not None:
+            sync_map_path = os.path.join(tmp_dir, SYNC_MAP_FILENAME)
+            with open(sync_map_path, 'w') as f:
+                json.dump(sync_map, f, default=_to_json)
+            files = {
+                filename: os.path.join(output_dir, filename)
+                for filename in _get_smil_filenames(sync_map)
+            }
+            files[SYNC_MAP_FILENAME] = sync_map_path
+            cache.put(key, files)
+
+    return sync_map
+
+
+def _align(text_dir, audio_dir, output_dir, align_kwargs):
+    from afaligner import align
+
+    return align(
+        text_dir, audio_dir, output_dir,
         output_format='smil',
         sync_map_text_path_prefix='../text/',
         sync_map_audio_path_prefix='../audio/',
-        radius=alignment_radius,
-        skip_penalty=alignment_skip_penalty,
-        language=language,
+        **align_kwargs,
     )
-    if sync_map is not None:
-        print('✔ Text and audio have been successfully synced.')
\ No newline at end of file
+
+
+def _get_unit_key(text_paths, audio_paths, align_kwargs, sample_rates=None):
+    """
+    Returns a hash of everything the result of alignment depends on:
+    names and fragments of the text files, names and contents of the audio files,
+    sample rates of the prepared audio files and the alignment parameters.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(align_kwargs, sort_keys=True).encode())
+    for path in text_paths:
+        h.update(f'\0text\0{os.path.basename(path)}\0'.encode())
+        for fragment_id, fragment_text in get_text_fragments(path):
+            h.update(f'{fragment_id}\0{fragment_text}\0'.encode())
+    for path in audio_paths:
+        h.update(f'\0audio\0{os.path.basename(path)}\0'.encode())
+        sample_rate = (sample_rates or {}).get(os.path.basename(path))
+        if sample_rate is not None:
+            h.update(f'prepared\0{sample_rate}\0'.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def get_text_fragments(text_path):
+    """
+    Returns a list of (id, text) of fragments – elements with id='f[0-9]+' – of the XHTML file.
+    XHTML that isn't well-formed XML, e.g. uses HTML entities like &nbsp;, is parsed as HTML.
+    """
+    try:
+        return _get_xml_fragments(text_path)
+    except expat.ExpatError:
+        return _get_html_fragments(text_path)
+
+
+def _get_xml_fragments(text_path):
+    fragments = []
+    stack = []
+
+    def start_element(name, attrs):
+        fragment_id = attrs.get('id')
+        if fragment_id is not None and FRAGMENT_ID_RE.fullmatch(fragment_id):
+            fragments.append([fragment_id, ''])
+            stack.append(True)
+        else:
+            stack.append(False)
+
+    def end_element(name):
+        stack.pop()
+
+    def character_data(data):
+        if any(stack):
+            fragments[-1][1] += data
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    with open(text_path, 'rb') as f:
+        parser.ParseFile(f)
+
+    return [tuple(x) for x in fragments]
+
+
+def _get_html_fragments(text_path):
+    from lxml import etree
+
+    tree = etree.parse(text_path, etree.HTMLParser())
+    return [
+        (element.get('id'), ''.join(element.itertext()))
+        for element in tree.iter()
+        if isinstance(element.tag, str) and FRAGMENT_ID_RE.fullmatch(element.get('id') or '')
+    ]
+
+
+def _get_smil_filenames(sync_map):
+    return [f'{drop_extension(os.path.basename(text_file))}.smil' for text_file in sync_map]
+
+
+def _to_json(o):
+    if isinstance(o, timedelta):
+        return format_duration(o)
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _link(src, dst):
+    try:
+        os.symlink(os.path.abspath(src), dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def _get_chapters_timings(sync_map):
+    """
+    Converts afaligner's sync map {text_file: {fragment_id: {audio_file, begin_time, end_time}}}
+    to chapters' timings keyed by the names of the SMIL files.
+    """
+    chapters = {}
+    for text_file, fragments_map in sync_map.items():
+        fragments = [
+            {
+                'id': fragment_id,
+                'audio_file': fragment['audio_file'],
+                'begin': to_ms(fragment['begin_time']),
+                'end': to_ms(fragment['end_time']),
+            }
+            for fragment_id, fragment in fragments_map.items()
+        ]
+        chapters[f'{drop_extension(os.path.basename(text_file))}.smil'] = {
+            'text_file': text_file,
+            'fragments': fragments,
+            'duration': sum(f['end'] - f['begin'] for f in fragments),
+        }
+    return chapters
@@ -0,0 +1,49 @@
+import functools
+import os
+
+import jinja2
+
+from . import TEMPLATES_DIR
+from .cache import get_cache_dir
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment():
+    """
+    Returns jinja2 environment shared by the package.
+    It is created on first use and compiled templates are cached on disk between runs.
+    Set SYNCABOOK_NO_BYTECODE_CACHE to disable the disk cache.
+    """
+    bytecode_cache = None
+    if not os.environ.get('SYNCABOOK_NO_BYTECODE_CACHE'):
+        bytecode_cache_dir = get_cache_dir('templates')
+        try:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+        except OSError:
+            pass
+
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        autoescape=True,
+        # templates are package data, so there's no need to check them for changes
+        auto_reload=False,
+        bytecode_cache=bytecode_cache,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(name):
+    """
+    Returns template `name` from the templates directory parsed and compiled once per process.
+    """
+    return get_environment().get_template(name)
+
+
+def render_to_file(name, path, mode='w', **context):
+    """
+    Renders template `name` with `context` streaming the output to the file at `path`
+    without materializing the whole string.
+    """
+    with open(path, mode) as f:
+        get_template(name).stream(**context).dump(f)
@@ -1,82 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import json
 import os.path
+import tempfile
 
-import jinja2
-
-from . import TEMPLATES_DIR
+from . import profiling
+from .segmentation import get_segmenter
+from .templates import render_to_file
 from .utils import drop_extension, get_number_of_digits_to_name
 
 
-def textfiles_to_xhtml_files(input_dir, output_dir, fragment_type, include_heading=False):
+def textfiles_to_xhtml_files(
+    input_dir, output_dir, fragment_type, include_heading=False, jobs=1,
+    segmenter='simple', language='eng'
+):
     """
     Converts plain text files in `input_dir` to a list of XHTML files
     and saves them to `output_dir`.
     Each XHTML file consists of fragments – <span> elements with id='f[0-9]+' grouped by <p></p>.
+
+    Files are processed one at a time in two passes: the first one splits each file into fragments,
+    saves them to a temporary file and counts them to give them ids of the same width numbered across the book,
+    the second one renders each file from its saved fragments, so the text is segmented only once.
+    Both passes run on a pool of `jobs` processes if `jobs` isn't 1.
+    Sentences are identified by `segmenter` for `language` (see `segmentation.get_segmenter`).
     """
     os.makedirs(output_dir, exist_ok=True)
 
     input_filenames = sorted(x for x in os.listdir(input_dir) if x.endswith('.txt'))
+    input_paths = [os.path.join(input_dir, filename) for filename in input_filenames]
+    output_paths = [
+        os.path.join(output_dir, f'{drop_extension(filename)}.xhtml') for filename in input_filenames
+    ]
+
+    # fail early on unknown segmenter
+    get_segmenter(segmenter, language)
+    get_paragraphs = functools.partial(
+        _get_paragraphs, fragment_type=fragment_type, segmenter=segmenter, language=language
+    )
+
+    with tempfile.TemporaryDirectory(prefix='syncabook-') as tmp_dir:
+        paragraphs_paths = [
+            os.path.join(tmp_dir, f'{drop_extension(filename)}.json') for filename in input_filenames
+        ]
+        fragments_nums = _map(
+            functools.partial(_segment_textfile, get_paragraphs), jobs, input_paths, paragraphs_paths
+        )
 
-    texts_contents = []
-    for filename in input_filenames:
-        with open(os.path.join(input_dir, filename), 'r') as f:
-            texts_contents.append(f.read())
+        # calculate total number of fragments to give fragments proper ids
+        n = get_number_of_digits_to_name(sum(fragments_nums))
+        first_fragment_ids = []
+        fragment_id = 1
+        for fragments_num in fragments_nums:
+            first_fragment_ids.append(fragment_id)
+            fragment_id += fragments_num
+
+        _map(
+            functools.partial(_textfile_to_xhtml_file, include_heading, n), jobs,
+            input_paths, paragraphs_paths, output_paths, first_fragment_ids,
+        )
 
-    xhtmls = _text_contents_to_xhtmls(texts_contents, fragment_type, include_heading)
+    print(f'\n✔ {len(input_filenames)} plain text files have been converted to XHTML.\n')
 
-    for filename, xhtml in zip(input_filenames, xhtmls):
-        file_path = os.path.join(output_dir, f'{drop_extension(filename)}.xhtml')
-        with open(file_path, 'w') as f:
-            f.write(xhtml)
 
-    print(f'\n✔ {len(texts_contents)} plain text files have been converted to XHTML.\n')
+def texts_to_xhtml_contexts(texts, fragment_type, include_heading=False, segmenter='simple', language='eng'):
+    """
+    Converts plain `texts` as `textfiles_to_xhtml_files` does but in memory.
+    Returns a list of contexts to render text.xhtml template with, one for each text.
+    """
+    get_segmenter(segmenter, language)
+    texts_paragraphs = [_get_paragraphs(text, fragment_type, segmenter, language) for text in texts]
+    n = get_number_of_digits_to_name(sum(len(p) for paragraphs in texts_paragraphs for p in paragraphs))
 
+    contexts = []
+    fragment_id = 1
+    for text_paragraphs in texts_paragraphs:
+        contexts.append(_text_paragraphs_to_xhtml_context(text_paragraphs, include_heading, fragment_id, n))
+        fragment_id += sum(len(p) for p in text_paragraphs)
+    return contexts
 
-def _text_contents_to_xhtmls(texts_contents, fragment_type, include_heading):
-    texts = [_get_paragraphs(texts_content, fragment_type) for texts_content in texts_contents]
 
-    # calculate total number of fragments to give fragments proper ids
-    fragments_num = sum(sum(len(p) for p in t) for t in texts)
-    n = get_number_of_digits_to_name(fragments_num)
+def write_xhtml_file(xhtml_path, context):
+    render_to_file('text.xhtml', xhtml_path, **context)
 
-    # render xhtmls
-    xhtmls = []
-    fragment_id = 1
-    for t in texts:
-        paragraphs = []
-        for p in t:
-            fragments = []
-            for f in p:
-                fragments.append({'id': f'f{fragment_id:0>{n}}', 'text': f})
-                fragment_id += 1
-            paragraphs.append(fragments)
-
-        heading = None
-        if include_heading:
-            heading = {
-                'id': paragraphs[0][0]['id'],
-                'text': ''. join(f['text'] for f in paragraphs[0])
-            }
-            paragraphs = paragraphs[1:]
-        
-        env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
-            autoescape=True
-        )
-        template = env.get_template('text.xhtml')
-        xhtml = template.render(heading=heading, paragraphs=paragraphs)
-        xhtmls.append(xhtml)
 
-    return xhtmls
+def _map(func, jobs, *iterables):
+    """
+    Returns results of `func` applied to `iterables` on a pool of `jobs` processes
+    or serially if `jobs` is 1.
+    """
+    if jobs == 1:
+        return list(map(func, *iterables))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [profiling.collect(x) for x in executor.map(profiling.traced(func), *iterables)]
+
+
+def _segment_textfile(get_paragraphs, text_path, paragraphs_path):
+    """
+    Saves paragraphs of the text in `text_path` to `paragraphs_path` and returns the number of fragments.
+    """
+    with open(text_path, 'r') as f:
+        text_paragraphs = get_paragraphs(f.read())
+    with open(paragraphs_path, 'w') as f:
+        json.dump(text_paragraphs, f)
+    return sum(len(p) for p in text_paragraphs)
+
+
+def _textfile_to_xhtml_file(include_heading, n, text_path, paragraphs_path, xhtml_path, first_fragment_id):
+    with profiling.stage('to_xhtml_file', text_file=os.path.basename(text_path)):
+        with open(paragraphs_path, 'r') as f:
+            text_paragraphs = json.load(f)
+        context = _text_paragraphs_to_xhtml_context(text_paragraphs, include_heading, first_fragment_id, n)
+        write_xhtml_file(xhtml_path, context)
+
+
+def _text_paragraphs_to_xhtml_context(text_paragraphs, include_heading, first_fragment_id, n):
+    """
+    Returns a context to render text.xhtml template with: a heading and a list of paragraphs.
+    Fragments are numbered from `first_fragment_id` and their ids are padded to `n` digits.
+    """
+    fragment_id = first_fragment_id
+    paragraphs = []
+    for p in text_paragraphs:
+        fragments = []
+        for f in p:
+            fragments.append({'id': f'f{fragment_id:0>{n}}', 'text': f})
+            fragment_id += 1
+        paragraphs.append(fragments)
+
+    heading = None
+    if include_heading:
+        heading = {
+            'id': paragraphs[0][0]['id'],
+            'text': ''. join(f['text'] for f in paragraphs[0])
+        }
+        paragraphs = paragraphs[1:]
+
+    return {'heading': heading, 'paragraphs': paragraphs}
 
 
-def _get_paragraphs(texts_content, fragment_type):
+def _get_paragraphs(texts_content, fragment_type, segmenter='simple', language='eng'):
     """
     Returns a list of paragraphs in a text where
     each paragraph is a list of fragments.
     """
     paragraphs = []
     for paragraphs_content in _get_paragraphs_contents(texts_content):
-        fragments = _get_fragments(paragraphs_content, fragment_type)
+        fragments = _get_fragments(paragraphs_content, fragment_type, segmenter, language)
         paragraphs.append(fragments)
     return paragraphs
 
@@ -85,31 +155,17 @@ def _get_paragraphs_contents(texts_content):
     return [p.strip().replace('\n', ' ') for p in texts_content.split('\n\n') if p.strip()]
 
 
-def _get_fragments(paragraphs_content, fragment_type):
+def _get_fragments(paragraphs_content, fragment_type, segmenter='simple', language='eng'):
     if fragment_type == 'sentence':
-        return _get_sentences(paragraphs_content)
+        return _get_sentences(paragraphs_content, segmenter, language)
     elif fragment_type == 'paragraph':
         return [paragraphs_content]
     else:
         raise ValueError(f'\n❌ Unknown fragment_type: {fragment_type}\n')
 
 
-def _get_sentences(text):
+def _get_sentences(text, segmenter='simple', language='eng'):
     """
-    Fragment by "{sentence_ending}{space}"
+    Fragment by "{sentence_ending}{space}" or by the rules of `segmenter`.
     """
-    sentence_endings = {'.', '!', '?'}
-    fragments = []
-    sentence_start_idx = 0
-    sentence_ended = False
-    for i, c in enumerate(text):
-        if i == len(text) - 1:
-            fragments.append(text[sentence_start_idx:i+1])
-        if c in sentence_endings:
-            sentence_ended = True
-            continue
-        if sentence_ended and c == ' ':
-            fragments.append(text[sentence_start_idx:i+1])
-            sentence_start_idx = i+1
-        sentence_ended = False
-    return fragments
\ No newline at end of file
+    return get_segmenter(segmenter, language)(text)
@@ -0,0 +1,116 @@
+import hashlib
+import os.path
+
+from lxml import etree
+
+from .templates import get_template
+
+
+HEADING_TAGS = ('h1', 'h2', 'h3')
+
+READ_SIZE = 16 * 1024
+
+# nav.xhtml rendered from the toc ends with this comment that holds the hash of the rest of the file,
+# so that a generated file can be told apart from the one edited by hand
+NAV_MARKER = '<!-- generated by syncabook {} -->\n'
+
+
+class HeadingExtractor():
+    """
+    Finds the first heading (h1, h2 or h3) of an XHTML document that is fed to it chunk by chunk.
+    Once the heading is found, `done` is True and the rest of the document may be skipped.
+    `heading` is a (level, text) tuple or None if there's no heading.
+    The document is parsed as HTML, so HTML entities like &nbsp; and markup errors are tolerated.
+    """
+    def __init__(self, tags=HEADING_TAGS):
+        self.tags = tags
+        self.heading = None
+        self.done = False
+        self._parser = etree.HTMLPullParser(events=('end',))
+
+    def feed(self, data):
+        """
+        Parses the next chunk of the document. Returns `done`.
+        """
+        if self.done:
+            return True
+        self._parser.feed(data)
+        for _, element in self._parser.read_events():
+            if element.tag in self.tags:
+                text = ' '.join(''.join(element.itertext()).split())
+                self.heading = (self.tags.index(element.tag) + 1, text)
+                self.done = True
+                break
+        return self.done
+
+
+def get_first_heading(path):
+    """
+    Returns (level, text) of the first heading of the XHTML file at `path` or None.
+    The file is read only up to the end of the heading.
+    """
+    extractor = HeadingExtractor()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            if extractor.feed(chunk):
+                break
+    return extractor.heading
+
+
+def get_toc(text_dir, filenames):
+    """
+    Returns the table of contents of the XHTML files `filenames` in `text_dir`:
+    a list of items {'name', 'toc_name', 'children'} nested according to
+    the levels of the files' first headings, so that h2 chapters following an h1 part go under it.
+    A file without a heading is named by its number and stays at the level of the previous one.
+    """
+    return build_toc(
+        (filename, get_first_heading(os.path.join(text_dir, filename))) for filename in filenames
+    )
+
+
+def build_toc(headings):
+    """
+    Returns the table of contents as `get_toc` does
+    given (filename, heading) pairs where the heading is (level, text) or None.
+    """
+    toc = []
+    # (level, item) of the last items at each depth
+    stack = []
+    level = 1
+    for i, (filename, heading) in enumerate(headings, start=1):
+        if heading is not None:
+            level, toc_name = heading
+        else:
+            toc_name = i
+        item = {'name': filename, 'toc_name': toc_name, 'children': []}
+
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        if stack:
+            stack[-1][1]['children'].append(item)
+        else:
+            toc.append(item)
+        stack.append((level, item))
+
+    return toc
+
+
+def render_nav(toc):
+    """
+    Returns the contents of nav.xhtml for `toc` marked as generated.
+    """
+    nav = get_template('nav.xhtml').render(content_files=toc).rstrip('\n') + '\n'
+    return nav + NAV_MARKER.format(_get_nav_hash(nav))
+
+
+def is_generated_nav(nav):
+    """
+    Returns True if `nav` has been returned by `render_nav` and hasn't been edited since.
+    """
+    content, _, marker = nav.rstrip('\n').rpartition('\n')
+    return f'{marker}\n' == NAV_MARKER.format(_get_nav_hash(f'{content}\n'))
+
+
+def _get_nav_hash(nav):
+    return hashlib.sha1(nav.encode()).hexdigest()
@@ -1,6 +1,15 @@
 import math
 
 
+class MissingDependencyError(Exception):
+    """
+    Raised when a library or a program that a command requires is not installed.
+    """
+    def __init__(self, dependency, purpose):
+        self.dependency = dependency
+        super().__init__(f'❌ {purpose} requires {dependency}. You should install it and try again.')
+
+
 def get_number_of_digits_to_name(num):
     if num <= 0:
         return 0
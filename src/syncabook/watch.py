@@ -0,0 +1,215 @@
+import os
+import time
+
+from . import profiling
+from .create import create_ebook
+from .defaults import WATCH_INTERVAL
+from .epub import listdir
+from .sync import get_text_fragments
+from .toc import build_toc, get_first_heading, is_generated_nav, render_nav
+
+
+# seconds between checks for changes when inotify reports them
+INOTIFY_RESCAN_INTERVAL = 5
+# seconds files must stay unchanged before a rebuild, so that an editor finishes saving
+DEBOUNCE_DELAY = 0.2
+
+WATCHED_DIRS = ('sync_text', 'no_sync_text', 'audio', 'images', 'smil')
+WATCHED_FILES = ('metadata.json',)
+# files written by create itself
+IGNORED_FILES = ('durations.json',)
+
+
+def watch(book_dir, interval=WATCH_INTERVAL, use_inotify=True, rebuilds=None, **kwargs):
+    """
+    Creates the ebook from `book_dir` and recreates it every time files of the book change
+    until interrupted or `rebuilds` rebuilds are done.
+    `kwargs` are passed to `create_ebook`.
+
+    The process stays alive between rebuilds, so compiled templates, headings and fragments
+    of unchanged XHTML files are not read again, and the ebook is rewritten incrementally,
+    so that only entries that have changed are compressed and written.
+    Changes are detected by polling every `interval` seconds or by inotify
+    if inotify_simple is installed and `use_inotify` is True.
+    """
+    builder = Builder(book_dir, **kwargs)
+    try:
+        builder.build()
+    except Exception as e:
+        print(f'❌ The ebook has not been built: {e}')
+    snapshot = scan(book_dir)
+    waiter = _get_waiter(book_dir, interval, use_inotify)
+    print(f'Watching {book_dir} for changes. Press Ctrl+C to stop.')
+
+    done = 0
+    try:
+        while rebuilds is None or done < rebuilds:
+            waiter.wait()
+            new_snapshot = scan(book_dir)
+            if new_snapshot == snapshot:
+                continue
+            # wait until the files stop changing
+            while True:
+                time.sleep(DEBOUNCE_DELAY)
+                latest_snapshot = scan(book_dir)
+                if latest_snapshot == new_snapshot:
+                    break
+                new_snapshot = latest_snapshot
+
+            changed = get_changed_files(snapshot, new_snapshot)
+            print(f'\n❗ Changed: {", ".join(changed)}. Rebuilding...')
+            try:
+                builder.build()
+            except Exception as e:
+                print(f'❌ The ebook has not been rebuilt: {e}')
+            # files written by the build are not changes
+            snapshot = scan(book_dir)
+            done += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        waiter.close()
+
+
+class Builder():
+    """
+    Creates the ebook from `book_dir` keeping what it has read from the book between builds.
+    """
+    def __init__(self, book_dir, **kwargs):
+        self.book_dir = book_dir
+        self.kwargs = kwargs
+        # filename -> (mtime_ns, size, heading, fragment ids) of XHTML files in sync_text/
+        self.text_files = {}
+
+    @property
+    def sync_text_dir(self):
+        return os.path.join(self.book_dir, 'sync_text')
+
+    @property
+    def nav_path(self):
+        return os.path.join(self.book_dir, 'no_sync_text', 'nav.xhtml')
+
+    def build(self):
+        """
+        Creates the ebook and returns its path.
+        """
+        start = time.perf_counter()
+        with profiling.stage('rebuild'):
+            toc = self._update_text_files()
+            self._update_nav(toc)
+            ebook_path = create_ebook(self.book_dir, interactive=False, toc=toc, **self.kwargs)
+        print(f'✔ {ebook_path} has been built in {time.perf_counter() - start:.2f} s.')
+        return ebook_path
+
+    def _update_text_files(self):
+        """
+        Reads headings and fragments of new and changed XHTML files and returns the toc.
+        Warns about files whose fragments have changed, since their SMIL files are stale.
+        """
+        text_files = {}
+        for filename in listdir(self.sync_text_dir, '.xhtml'):
+            path = os.path.join(self.sync_text_dir, filename)
+            stat = os.stat(path)
+            known = self.text_files.get(filename)
+            if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+                text_files[filename] = known
+                continue
+            fragment_ids = [fragment_id for fragment_id, _ in get_text_fragments(path)]
+            if known is not None and known[3] != fragment_ids:
+                print(
+                    f'❗ Fragments of {path} have changed, so its SMIL file is stale.'
+                    ' Run `syncabook sync --resume` to resynchronize it.'
+                )
+            text_files[filename] = (stat.st_mtime_ns, stat.st_size, get_first_heading(path), fragment_ids)
+        self.text_files = text_files
+        return build_toc((filename, heading) for filename, (_, _, heading, _) in text_files.items())
+
+    def _update_nav(self, toc):
+        """
+        Renders nav.xhtml with the current toc unless the file has been edited by hand.
+        A file generated by an earlier build or by `create` is marked as such, see `render_nav`.
+        """
+        nav = render_nav(toc)
+        if os.path.exists(self.nav_path):
+            with open(self.nav_path, 'r') as f:
+                current_nav = f.read()
+            if current_nav == nav or not is_generated_nav(current_nav):
+                return
+        else:
+            os.makedirs(os.path.dirname(self.nav_path), exist_ok=True)
+        with open(self.nav_path, 'w') as f:
+            f.write(nav)
+
+
+def scan(book_dir):
+    """
+    Returns a dict of relative path -> (mtime_ns, size) of the files the ebook is created from.
+    """
+    snapshot = {}
+    paths = [os.path.join(book_dir, filename) for filename in WATCHED_FILES]
+    for dirname in WATCHED_DIRS:
+        dir_path = os.path.join(book_dir, dirname)
+        paths.extend(os.path.join(dir_path, filename) for filename in listdir(dir_path))
+    for path in paths:
+        filename = os.path.basename(path)
+        if filename.startswith('.') or filename.endswith('.tmp') or filename in IGNORED_FILES:
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[os.path.relpath(path, book_dir)] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def get_changed_files(snapshot, new_snapshot):
+    """
+    Returns sorted relative paths of files that are added, removed or modified.
+    """
+    return sorted(
+        path for path in snapshot.keys() | new_snapshot.keys()
+        if snapshot.get(path) != new_snapshot.get(path)
+    )
+
+
+class _PollingWaiter():
+    def __init__(self, interval):
+        self.interval = interval
+
+    def wait(self):
+        time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class _InotifyWaiter():
+    """
+    Waits until inotify reports an event in the book's directories.
+    Directories created later are not watched, so the book is rescanned from time to time anyway.
+    """
+    def __init__(self, book_dir, inotify_simple):
+        self.inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+        for dirname in ('',) + WATCHED_DIRS:
+            dir_path = os.path.join(book_dir, dirname)
+            if os.path.isdir(dir_path):
+                self.inotify.add_watch(dir_path, mask)
+
+    def wait(self):
+        self.inotify.read(timeout=INOTIFY_RESCAN_INTERVAL * 1000)
+
+    def close(self):
+        self.inotify.close()
+
+
+def _get_waiter(book_dir, interval, use_inotify):
+    if use_inotify:
+        try:
+            import inotify_simple
+        except ImportError:
+            pass
+        else:
+            return _InotifyWaiter(book_dir, inotify_simple)
+    return _PollingWaiter(interval)
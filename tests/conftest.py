@@ -0,0 +1,124 @@
+import os.path
+import wave
+
+import pytest
+
+
+# pairs text and audio files writing the audio file's name to each SMIL file,
+# records the text files of each call on a line
+# and fails on text files that start with FAKE_AFALIGNER_FAIL
+FAKE_AFALIGNER = '''
+import os
+
+
+def align(text_dir, audio_dir, output_dir, **kwargs):
+    text_files = sorted(os.listdir(text_dir))
+    audio_files = sorted(os.listdir(audio_dir))
+    with open(os.environ['FAKE_AFALIGNER_CALLS'], 'a') as f:
+        f.write(' '.join(text_files) + '\\n')
+    sync_map = {}
+    for text_file, audio_file in zip(text_files, audio_files):
+        if text_file.startswith(os.environ.get('FAKE_AFALIGNER_FAIL', '-')):
+            raise RuntimeError('bad chapter')
+        with open(os.path.join(output_dir, text_file.replace('.xhtml', '.smil')), 'w') as f:
+            f.write(audio_file)
+        sync_map[text_file] = {'f1': {'audio_file': audio_file, 'begin_time': 0.5, 'end_time': 1.0}}
+    return sync_map
+'''
+
+
+def write_text(book_dir, name, text=None, plaintext=False):
+    """
+    Writes chapter `name` headed "Chapter {name}" with `text` to sync_text/ as XHTML
+    that has the text in a single fragment or to plaintext/ if `plaintext` is True.
+    """
+    if text is None:
+        text = f'The text of chapter {name}.'
+    if plaintext:
+        path = os.path.join(book_dir, 'plaintext', f'{name}.txt')
+        content = f'Chapter {name}\n\n{text}'
+    else:
+        path = os.path.join(book_dir, 'sync_text', f'{name}.xhtml')
+        content = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapter {name}</title></head>'
+            f'<body><h1>Chapter {name}</h1><p><span id="f1">{text}</span></p></body></html>'
+        )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def write_audio(book_dir, name, seconds=None):
+    """
+    Writes audio/{name}.mp3 that contains the name
+    or audio/{name}.wav with `seconds` of silence if `seconds` is given.
+    """
+    os.makedirs(os.path.join(book_dir, 'audio'), exist_ok=True)
+    if seconds is None:
+        with open(os.path.join(book_dir, 'audio', f'{name}.mp3'), 'wb') as f:
+            f.write(name.encode())
+        return
+    with wave.open(os.path.join(book_dir, 'audio', f'{name}.wav'), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(1)
+        f.setframerate(1000)
+        f.writeframes(b'\0' * 1000 * seconds)
+
+
+def write_smil(book_dir, name):
+    """
+    Writes smil/{name}.smil that syncs the first fragment with the first second of the audio.
+    """
+    os.makedirs(os.path.join(book_dir, 'smil'), exist_ok=True)
+    with open(os.path.join(book_dir, 'smil', f'{name}.smil'), 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<smil xmlns="http://www.w3.org/ns/SMIL" version="3.0"><body><seq>\n'
+            f'<par><text src="../text/{name}.xhtml#f1"/>'
+            f'<audio src="../audio/{name}.mp3" clipBegin="0s" clipEnd="1s"/></par>\n'
+            '</seq></body></smil>\n'
+        )
+
+
+def create_chapter(book_dir, name, text=None, plaintext=False, seconds=None):
+    write_text(book_dir, name, text, plaintext)
+    write_audio(book_dir, name, seconds)
+
+
+def get_calls(calls_path):
+    """
+    Returns sorted names of the files a fake tool has been called with and clears the calls.
+    """
+    if not os.path.exists(calls_path):
+        return []
+    with open(calls_path) as f:
+        calls = sorted(os.path.basename(x) for x in f.read().split())
+    os.remove(calls_path)
+    return calls
+
+
+@pytest.fixture
+def fake_afaligner(tmp_path, monkeypatch):
+    """
+    Installs FAKE_AFALIGNER for this process and its children
+    and returns the path of the file the calls are recorded to.
+    Chapters whose names start with 2 fail.
+    """
+    with open(os.path.join(tmp_path, 'afaligner.py'), 'w') as f:
+        f.write(FAKE_AFALIGNER)
+    calls_path = os.path.join(tmp_path, 'calls.txt')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path))
+    monkeypatch.setenv('SYNCABOOK_CACHE_DIR', os.path.join(tmp_path, 'cache'))
+    monkeypatch.setenv('FAKE_AFALIGNER_CALLS', calls_path)
+    monkeypatch.setenv('FAKE_AFALIGNER_FAIL', '2')
+    return calls_path
+
+
+@pytest.fixture
+def book_dir(tmp_path, fake_afaligner):
+    book_dir = os.path.join(tmp_path, 'book')
+    create_chapter(book_dir, '1')
+    create_chapter(book_dir, '3')
+    return book_dir
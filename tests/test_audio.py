@@ -0,0 +1,165 @@
+import importlib.util
+import json
+import os
+import stat
+import struct
+import wave
+
+import pytest
+
+from syncabook import audio, sync
+from .conftest import create_chapter, get_calls
+
+
+# copies the input file prefixed with the sample rate and records the call
+FAKE_FFMPEG = '''#!/bin/sh
+while [ $# -gt 1 ]; do
+    case "$1" in
+        -i) input="$2"; shift ;;
+        -ar) rate="$2"; shift ;;
+    esac
+    shift
+done
+case "$input" in
+    *bad*) echo "Invalid data found when processing input" >&2; exit 1 ;;
+esac
+echo "$input" >> "$FAKE_FFMPEG_CALLS"
+{ printf "%s:" "$rate"; cat "$input"; } > "$1"
+'''
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    bin_dir = os.path.join(tmp_path, 'bin')
+    os.makedirs(bin_dir)
+    ffmpeg_path = os.path.join(bin_dir, 'ffmpeg')
+    with open(ffmpeg_path, 'w') as f:
+        f.write(FAKE_FFMPEG)
+    os.chmod(ffmpeg_path, os.stat(ffmpeg_path).st_mode | stat.S_IEXEC)
+    calls_path = os.path.join(tmp_path, 'ffmpeg_calls.txt')
+    monkeypatch.setenv('PATH', bin_dir + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_FFMPEG_CALLS', calls_path)
+    return calls_path
+
+
+def test_prepare_audio(book_dir, ffmpeg):
+    prepared_dir = os.path.join(book_dir, audio.PREPARED_AUDIO_DIRNAME)
+
+    audio.prepare_audio(book_dir, jobs=2)
+    assert get_calls(ffmpeg) == ['1.mp3', '3.mp3']
+    with open(os.path.join(prepared_dir, '3.wav')) as f:
+        assert f.read() == '16000:3'
+    prepared = audio.get_prepared_audio(book_dir)
+    assert prepared == {
+        '1.mp3': (os.path.join(prepared_dir, '1.wav'), 16000),
+        '3.mp3': (os.path.join(prepared_dir, '3.wav'), 16000),
+    }
+
+    # only new and changed files are converted again
+    create_chapter(book_dir, '2')
+    with open(os.path.join(book_dir, 'audio', '3.mp3'), 'wb') as f:
+        f.write(b'new audio')
+    os.remove(os.path.join(book_dir, 'audio', '1.mp3'))
+    audio.prepare_audio(book_dir)
+    assert get_calls(ffmpeg) == ['2.mp3', '3.mp3']
+    assert sorted(os.listdir(prepared_dir)) == ['2.wav', '3.wav', audio.SOURCES_FILENAME]
+
+    audio.prepare_audio(book_dir)
+    assert get_calls(ffmpeg) == []
+
+    # a different sample rate requires conversion
+    audio.prepare_audio(book_dir, sample_rate=8000)
+    assert get_calls(ffmpeg) == ['2.mp3', '3.mp3']
+    with open(os.path.join(prepared_dir, audio.SOURCES_FILENAME)) as f:
+        assert json.load(f)['2.mp3']['sample_rate'] == 8000
+
+
+def test_prepare_audio_failure(book_dir, ffmpeg):
+    with open(os.path.join(book_dir, 'audio', 'bad.mp3'), 'wb') as f:
+        f.write(b'bad')
+
+    with pytest.raises(audio.PrepareAudioError) as e:
+        audio.prepare_audio(book_dir)
+    assert e.value.failures == {'bad.mp3': 'Invalid data found when processing input'}
+    assert sorted(audio.get_prepared_audio(book_dir)) == ['1.mp3', '3.mp3']
+
+
+def test_sync_uses_prepared_audio(book_dir, ffmpeg, monkeypatch):
+    aligned = []
+
+    def fake_align(text_dir, audio_dir, output_dir, align_kwargs):
+        for filename in sorted(os.listdir(audio_dir)):
+            with open(os.path.join(audio_dir, filename)) as f:
+                aligned.append((filename, f.read()))
+        sync_map = {}
+        for filename in sorted(os.listdir(text_dir)):
+            smil_filename = filename.replace('.xhtml', '.smil')
+            with open(os.path.join(output_dir, smil_filename), 'w') as f:
+                f.write('')
+            audio_file = f'../audio/{filename.replace(".xhtml", ".mp3")}'
+            sync_map[filename] = {'f1': {'audio_file': audio_file, 'begin_time': 0, 'end_time': 1}}
+        return sync_map
+
+    monkeypatch.setattr(sync, '_align', fake_align)
+
+    sync.sync(book_dir, None, None, 'eng', use_cache=True)
+    assert aligned == [('1.mp3', '1'), ('3.mp3', '3')]
+
+    # prepared audio is aligned under the original names and isn't taken from the cache
+    aligned.clear()
+    audio.prepare_audio(book_dir)
+    sync.sync(book_dir, None, None, 'eng', use_cache=True)
+    assert aligned == [('1.mp3', '16000:1'), ('3.mp3', '16000:3')]
+
+
+# MPEG-1 Layer III, 128 kbps, 44100 Hz, stereo
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_SIZE = 417
+
+
+def test_get_audio_duration(tmp_path):
+    id3 = b'ID3\x04\x00\x00\x00\x00\x01\x00' + b'\0' * 128
+    cbr_path = os.path.join(tmp_path, 'cbr.mp3')
+    frame = MP3_FRAME_HEADER + b'\0' * (MP3_FRAME_SIZE - 4)
+    with open(cbr_path, 'wb') as f:
+        # bytes that look like a frame header but aren't followed by a frame are skipped
+        f.write(id3 + b'\xff\xfb\x90\x00\0' + frame * 400 + b'TAG' + b'\0' * 125)
+    assert audio.get_audio_duration(cbr_path) == pytest.approx(400 * MP3_FRAME_SIZE * 8 / 128000)
+
+    vbr_path = os.path.join(tmp_path, 'vbr.mp3')
+    with open(vbr_path, 'wb') as f:
+        xing = b'Xing' + struct.pack('>II', 1, 441)
+        xing_frame = MP3_FRAME_HEADER + b'\0' * 32 + xing
+        f.write(id3 + xing_frame + b'\0' * (MP3_FRAME_SIZE - len(xing_frame)) + frame * 3)
+    assert audio.get_audio_duration(vbr_path) == pytest.approx(441 * 1152 / 44100)
+
+    wav_path = os.path.join(tmp_path, 'audio.wav')
+    with wave.open(wav_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b'\0' * 2 * 16000 * 3)
+    assert audio.get_audio_duration(wav_path) == pytest.approx(3)
+
+    other_path = os.path.join(tmp_path, 'audio.ogg')
+    with open(other_path, 'wb') as f:
+        f.write(b'OggS' + b'\0' * 100)
+    assert audio.get_audio_duration(other_path) is None
+
+    # a frame header that occurs by chance in another format
+    m4a_path = os.path.join(tmp_path, 'audio.m4a')
+    with open(m4a_path, 'wb') as f:
+        f.write(b'\0\0\0\x20ftypM4A ' + b'\0' * 100 + MP3_FRAME_HEADER + b'\x01' * 5000)
+    assert audio.get_audio_duration(m4a_path) is None
+
+
+def test_get_audio_duration_of_synthetic_audio(tmp_path):
+    synthetic_path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'synthetic.py')
+    spec = importlib.util.spec_from_file_location('synthetic', synthetic_path)
+    synthetic = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(synthetic)
+
+    path = os.path.join(tmp_path, 'audio.mp3')
+    with open(path, 'wb') as f:
+        f.write(synthetic.get_mp3_blob(60))
+    assert audio.get_audio_duration(path) == pytest.approx(60, abs=0.03)
@@ -0,0 +1,96 @@
+import functools
+import json
+import os.path
+import sys
+
+from syncabook import batch
+from .conftest import create_chapter, write_smil
+
+
+def _create_book(book_dir, chapters):
+    for name in chapters:
+        create_chapter(book_dir, name, plaintext=True)
+
+
+def test_batch(tmp_path, fake_afaligner):
+    _create_book(os.path.join(tmp_path, 'good'), ['1', '3'])
+    _create_book(os.path.join(tmp_path, 'bad'), ['2'])
+    manifest_path = os.path.join(tmp_path, 'batch.json')
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'defaults': {'sync': {'jobs': 2}, 'to_xhtml': {'include_heading': True}},
+            'books': [
+                {'book_dir': 'good', 'metadata': {'title': 'Good Book', 'author': 'A', 'description': '', 'narrator': ''}},
+                {'book_dir': 'bad', 'to_xhtml': {'fragment_type': 'paragraph'}},
+            ],
+        }, f)
+    summary_path = os.path.join(tmp_path, 'summary.json')
+
+    summary = batch.batch(manifest_path, summary_path=summary_path, sync_workers=2)
+
+    with open(summary_path) as f:
+        assert json.load(f) == summary
+    assert (summary['succeeded'], summary['failed']) == (1, 1)
+
+    good, bad = summary['books']
+    assert good['status'] == 'ok'
+    assert list(good['stages']) == ['to_xhtml', 'sync', 'create']
+    assert good['ebook'] == os.path.join(tmp_path, 'good', 'out', 'good_book.epub')
+    assert os.path.exists(good['ebook'])
+    with open(os.path.join(tmp_path, 'good', 'no_sync_text', 'nav.xhtml')) as f:
+        assert '<a href="3.xhtml">Chapter 3</a>' in f.read()
+
+    assert bad['status'] == 'failed'
+    assert bad['stages']['sync']['status'] == 'failed'
+    assert 'bad chapter' in bad['error']
+    assert 'create' not in bad['stages']
+
+
+def test_batch_without_afaligner(tmp_path, monkeypatch):
+    # importing afaligner fails in this process and in the workers
+    with open(os.path.join(tmp_path, 'afaligner.py'), 'w') as f:
+        f.write('raise ImportError')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'afaligner', raising=False)
+    synced_dir = os.path.join(tmp_path, 'synced')
+    _create_book(synced_dir, ['1'])
+    write_smil(synced_dir, '1')
+    _create_book(os.path.join(tmp_path, 'unsynced'), ['1'])
+    manifest_path = os.path.join(tmp_path, 'batch.json')
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'defaults': {'metadata': {'title': 'Book', 'author': 'A', 'description': '', 'narrator': ''}},
+            'books': [{'book_dir': 'synced'}, {'book_dir': 'unsynced'}],
+        }, f)
+
+    summary = batch.batch(manifest_path)
+
+    synced, unsynced = summary['books']
+    assert synced['status'] == 'ok'
+    assert unsynced['status'] == 'failed'
+    assert unsynced['stages']['sync']['status'] == 'failed'
+    assert 'requires afaligner' in unsynced['error']
+
+
+def test_create_merges_sync_and_create_options(monkeypatch):
+    calls = []
+
+    @functools.wraps(batch.create_ebook)
+    def create_ebook(book_dir, **kwargs):
+        calls.append(kwargs)
+        return os.path.join(book_dir, 'out', 'book.epub')
+
+    monkeypatch.setattr(batch, 'create_ebook', create_ebook)
+    records, ebook_path = batch._create({
+        'book_dir': 'book',
+        'language': 'eng',
+        'sync': {'language': 'deu', 'jobs': 4, 'resume': True, 'alignment_radius': 10},
+        'create': {'jobs': 2, 'compresslevel': 9},
+    })
+
+    assert records['create']['status'] == 'ok'
+    assert ebook_path == os.path.join('book', 'out', 'book.epub')
+    assert calls == [{
+        'language': 'deu', 'jobs': 2, 'alignment_radius': 10, 'compresslevel': 9, 'interactive': False,
+    }]
@@ -0,0 +1,61 @@
+import os
+import shutil
+
+from syncabook import create
+from syncabook.book import Book
+from syncabook.split_text import split_text
+from syncabook.to_xhtml import textfiles_to_xhtml_files
+
+
+TEXT = (
+    'A BOOK\n\n'
+    'CHAPTER 1\n\nThe first chapter. It has two sentences.\n\n'
+    'CHAPTER 2\n\nThe second  chapter.\n\nAnd its second paragraph!'
+)
+PATTERN = r'\n\nCHAPTER \d\n\n'
+
+
+def test_book_matches_file_pipeline(tmp_path):
+    text_file = os.path.join(tmp_path, 'text.txt')
+    with open(text_file, 'w') as f:
+        f.write(TEXT)
+
+    split_text(text_file, os.path.join(tmp_path, 'plaintext'), 'opening', PATTERN, None)
+    textfiles_to_xhtml_files(
+        os.path.join(tmp_path, 'plaintext'), os.path.join(tmp_path, 'expected'),
+        'sentence', include_heading=True
+    )
+
+    book = Book(str(tmp_path)).split(pattern=PATTERN).to_xhtml(include_heading=True)
+    assert [c.name for c in book.chapters] == ['1', '2']
+    assert [c.heading for c in book.chapters] == [(2, 'CHAPTER 1'), (2, 'CHAPTER 2')]
+    assert not os.path.exists(book.sync_text_dir)
+
+    book.save_xhtml()
+    for filename in ['1.xhtml', '2.xhtml']:
+        with open(os.path.join(tmp_path, 'expected', filename)) as f:
+            expected = f.read()
+        with open(os.path.join(book.sync_text_dir, filename)) as f:
+            assert f.read() == expected
+
+
+def test_book_passes_timings_and_toc_to_create(book_dir, monkeypatch):
+    monkeypatch.delenv('FAKE_AFALIGNER_FAIL')
+    shutil.rmtree(os.path.join(book_dir, 'sync_text'))
+    with open(os.path.join(book_dir, 'text.txt'), 'w') as f:
+        f.write(TEXT)
+
+    book = Book(book_dir, jobs=2).split(pattern=PATTERN).to_xhtml(include_heading=True).sync()
+    assert [c.timings['duration'] for c in book.chapters] == [500, 500]
+
+    def fail(*args, **kwargs):
+        raise AssertionError('files should not be parsed again')
+
+    monkeypatch.setattr(create, 'get_toc', fail)
+    monkeypatch.setattr(create, 'get_media_durations', lambda paths: [fail() for _ in paths])
+    book.metadata = {'title': 'A Book', 'author': 'Author', 'description': '', 'narrator': ''}
+    ebook_path = book.create(interactive=False)
+    assert os.path.basename(ebook_path) == 'a_book.epub'
+    with open(os.path.join(book_dir, 'no_sync_text', 'nav.xhtml')) as f:
+        nav = f.read()
+    assert 'CHAPTER 1' in nav and 'CHAPTER 2' in nav
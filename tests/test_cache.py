@@ -0,0 +1,22 @@
+import os
+import os.path
+
+from syncabook import cache
+
+
+def test_dir_cache_evicts_least_recently_used(tmp_path):
+    dir_cache = cache.DirCache(os.path.join(tmp_path, 'cache'), max_size=20)
+    for key in ('a', 'b', 'c'):
+        path = os.path.join(tmp_path, key)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        dir_cache.put(key, {'file': path})
+        os.utime(os.path.join(dir_cache.path, key), (0, {'a': 1, 'b': 2, 'c': 3}[key]))
+
+    assert dir_cache.get('a') is not None
+    dir_cache.evict()
+
+    assert dir_cache.get('b') is None
+    assert dir_cache.get('c') is not None
+    with open(os.path.join(dir_cache.get('a'), 'file'), 'rb') as f:
+        assert f.read() == b'x' * 10
@@ -0,0 +1,230 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os.path
+import threading
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import pytest
+
+from syncabook.cache import HTTPCache
+from syncabook.downloader import Download, Downloader, DownloadError, OfflineError
+
+
+FILES = {
+    f'/{i}.mp3': bytes(range(256)) * (100 + i) for i in range(6)
+}
+
+
+class UnseekableStream(io.RawIOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def _create_zip(f, compress_types):
+    with ZipFile(f, 'w') as z:
+        z.writestr('audio/', b'')
+        for (path, data), compress_type in zip(FILES.items(), compress_types):
+            z.writestr(f'audio{path}', data, compress_type=compress_type)
+
+
+# members' sizes are written in their local headers
+SEEKABLE_ZIP = io.BytesIO()
+_create_zip(SEEKABLE_ZIP, [ZIP_STORED, ZIP_DEFLATED] * 3)
+FILES['/book.zip'] = SEEKABLE_ZIP.getvalue()
+
+# deflated members are followed by data descriptors
+UNSEEKABLE_ZIP = UnseekableStream()
+_create_zip(UNSEEKABLE_ZIP, [ZIP_DEFLATED] * 6)
+FILES['/streamed.zip'] = bytes(UNSEEKABLE_ZIP.data)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range'), self.client_address))
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect'):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = FILES.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path in self.server.truncate:
+            # the connection breaks in the middle of the file
+            self.server.truncate.remove(self.path)
+            data = data[:len(data) // 2]
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data) * 2))
+            self.end_headers()
+            self.wfile.write(data)
+            self.close_connection = True
+            return
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.truncate = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server, path):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def _git_sha(data):
+    return hashlib.sha1(f'blob {len(data)}\0'.encode() + data).hexdigest()
+
+
+def test_download_concurrently_reusing_connections(server, tmp_path):
+    files = {path: data for path, data in FILES.items() if path.endswith('.mp3')}
+    downloads = [
+        Download(
+            _url(server, path), os.path.join(tmp_path, path[1:]),
+            size=len(data), checksum=('git', _git_sha(data))
+        )
+        for path, data in files.items()
+    ]
+    downloads.append(Download(_url(server, '/redirect/0.mp3'), os.path.join(tmp_path, 'redirected.mp3')))
+
+    with Downloader(jobs=2) as downloader:
+        downloader.download(downloads)
+
+    for path, data in files.items():
+        with open(os.path.join(tmp_path, path[1:]), 'rb') as f:
+            assert f.read() == data
+    with open(os.path.join(tmp_path, 'redirected.mp3'), 'rb') as f:
+        assert f.read() == FILES['/0.mp3']
+    # 8 requests over at most 2 kept-alive connections
+    assert len(server.requests) == 8
+    assert len({client_address for _, _, client_address in server.requests}) <= 2
+
+    # downloaded files are skipped
+    server.requests.clear()
+    with Downloader(jobs=2) as downloader:
+        downloader.download(downloads[:-1])
+    assert server.requests == []
+
+
+def test_resume_partial_download(server, tmp_path):
+    data = FILES['/1.mp3']
+    path = os.path.join(tmp_path, '1.mp3')
+    with open(path + '.part', 'wb') as f:
+        f.write(data[:1000])
+
+    with Downloader() as downloader:
+        downloader.download([
+            Download(_url(server, '/1.mp3'), path, checksum=('sha256', hashlib.sha256(data).hexdigest()))
+        ])
+
+    assert [r[1] for r in server.requests] == ['bytes=1000-']
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(path + '.part')
+
+
+def test_download_errors(server, tmp_path):
+    downloads = [
+        Download(_url(server, '/2.mp3'), os.path.join(tmp_path, '2.mp3'), checksum=('sha256', '0' * 64)),
+        Download(_url(server, '/missing.mp3'), os.path.join(tmp_path, 'missing.mp3')),
+    ]
+    with Downloader(retries=0) as downloader:
+        with pytest.raises(DownloadError) as e:
+            downloader.download(downloads)
+
+    assert sorted(e.value.failures) == sorted(d.url for d in downloads)
+    assert 'HTTP 404' in e.value.failures[downloads[1].url]
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('path', ['/book.zip', '/streamed.zip'])
+def test_extract_zip_while_downloading(server, tmp_path, path):
+    server.truncate.add(path)
+
+    with Downloader(retries=1) as downloader:
+        names = downloader.extract_zip(_url(server, path), tmp_path)
+
+    assert names == ['audio/'] + [f'audio/{i}.mp3' for i in range(6)]
+    for i in range(6):
+        with open(os.path.join(tmp_path, 'audio', f'{i}.mp3'), 'rb') as f:
+            assert f.read() == FILES[f'/{i}.mp3']
+    # the transfer is resumed from the member that has been interrupted
+    ranges = [r[1] for r in server.requests]
+    assert ranges[0] is None and ranges[1].startswith('bytes=')
+    assert sorted(os.listdir(tmp_path)) == ['audio']
+
+
+def test_extract_zip_once(server, tmp_path):
+    output_dir = os.path.join(tmp_path, 'book')
+    url = _url(server, '/book.zip')
+
+    with Downloader() as downloader:
+        names = downloader.extract_zip(url, output_dir)
+        assert downloader.extract_zip(url, output_dir) == names
+    assert len(server.requests) == 1
+
+    with Downloader(offline=True) as downloader:
+        assert downloader.extract_zip(url, output_dir) == names
+        os.remove(os.path.join(tmp_path, 'book.zip.json'))
+        # without the record the files that are already there are used
+        assert downloader.extract_zip(url, output_dir) == names[1:]
+        with pytest.raises(OfflineError):
+            downloader.extract_zip(url, os.path.join(tmp_path, 'empty'))
+    assert len(server.requests) == 1
+
+
+def test_get_with_http_cache(server, tmp_path):
+    http_cache = HTTPCache(os.path.join(tmp_path, 'http'))
+    url = _url(server, '/3.mp3')
+
+    with Downloader(http_cache=http_cache) as downloader:
+        assert downloader.get(url) == FILES['/3.mp3']
+        # revalidated
+        assert downloader.get(url, ttl=0) == FILES['/3.mp3']
+        # fresh
+        assert downloader.get(url, ttl=60) == FILES['/3.mp3']
+    assert [r[0] for r in server.requests] == ['/3.mp3', '/3.mp3']
+
+    with Downloader(http_cache=http_cache, offline=True) as downloader:
+        assert downloader.get(url, ttl=0) == FILES['/3.mp3']
+        with pytest.raises(OfflineError):
+            downloader.get(_url(server, '/4.mp3'))
+    assert len(server.requests) == 2
@@ -0,0 +1,95 @@
+import os.path
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from syncabook import epub
+
+
+def test_get_compress_type():
+    assert epub.get_compress_type('mimetype') == ZIP_STORED
+    assert epub.get_compress_type('epub/audio/01.mp3') == ZIP_STORED
+    assert epub.get_compress_type('epub/images/cover.JPG') == ZIP_STORED
+    assert epub.get_compress_type('epub/text/01.xhtml') == ZIP_DEFLATED
+    assert epub.get_compress_type('epub/smil/01.smil') == ZIP_DEFLATED
+    assert epub.get_compress_type('epub/content.opf') == ZIP_DEFLATED
+
+
+def test_write_epub(tmp_path):
+    audio_path = os.path.join(tmp_path, '1.mp3')
+    with open(audio_path, 'wb') as f:
+        f.write(os.urandom(1000))
+    text_path = os.path.join(tmp_path, '1.xhtml')
+    with open(text_path, 'w') as f:
+        f.write('<p>Some text.</p>' * 100)
+
+    ebook_path = os.path.join(tmp_path, 'book.epub')
+    epub.write_epub(ebook_path, [
+        epub.Entry('epub/content.opf', data='<package/>'),
+        epub.Entry('epub/audio/1.mp3', path=audio_path),
+        epub.Entry('epub/text/1.xhtml', path=text_path),
+    ], compresslevel=9)
+
+    with ZipFile(ebook_path) as z:
+        assert z.testzip() is None
+        infos = z.infolist()
+        assert [i.filename for i in infos] == [
+            'mimetype', 'epub/content.opf', 'epub/audio/1.mp3', 'epub/text/1.xhtml'
+        ]
+        assert [i.compress_type for i in infos] == [
+            ZIP_STORED, ZIP_DEFLATED, ZIP_STORED, ZIP_DEFLATED
+        ]
+        assert z.read('mimetype') == b'application/epub+zip'
+        assert z.read('epub/content.opf') == b'<package/>'
+        with open(text_path, 'rb') as f:
+            assert z.read('epub/text/1.xhtml') == f.read()
+
+
+def test_write_epub_reuses_unchanged_entries(tmp_path):
+    paths = {}
+    for name, content in (('1.mp3', b'audio' * 100), ('1.xhtml', b'one'), ('2.xhtml', b'two')):
+        paths[name] = os.path.join(tmp_path, name)
+        with open(paths[name], 'wb') as f:
+            f.write(content)
+
+    def get_entries():
+        return [
+            epub.Entry('epub/audio/1.mp3', path=paths['1.mp3']),
+            epub.Entry('epub/text/1.xhtml', path=paths['1.xhtml']),
+            epub.Entry('epub/text/2.xhtml', path=paths['2.xhtml']),
+        ]
+
+    ebook_path = os.path.join(tmp_path, 'book.epub')
+    hashes = epub.write_epub(ebook_path, get_entries())
+
+    with open(paths['1.xhtml'], 'wb') as f:
+        f.write(b'one changed')
+
+    entries = get_entries()
+    for entry in entries:
+        if entry.arcname != 'epub/text/1.xhtml':
+            entry.hash = hashes[entry.arcname]
+    with ZipFile(ebook_path) as z:
+        audio_offset = z.getinfo('epub/audio/1.mp3').header_offset
+
+    new_hashes = epub.write_epub(ebook_path, entries, previous=hashes)
+
+    assert new_hashes['epub/audio/1.mp3'] == hashes['epub/audio/1.mp3']
+    assert new_hashes['epub/text/1.xhtml'] != hashes['epub/text/1.xhtml']
+    with ZipFile(ebook_path) as z:
+        assert z.testzip() is None
+        assert z.namelist() == ['mimetype', 'epub/audio/1.mp3', 'epub/text/1.xhtml', 'epub/text/2.xhtml']
+        assert z.getinfo('epub/audio/1.mp3').header_offset == audio_offset
+        assert z.read('epub/text/1.xhtml') == b'one changed'
+        assert z.read('epub/text/2.xhtml') == b'two'
+
+
+def test_write_epub_with_old_files(tmp_path):
+    text_path = os.path.join(tmp_path, '1.xhtml')
+    with open(text_path, 'w') as f:
+        f.write('<p>Old text.</p>')
+    os.utime(text_path, (0, 0))
+
+    ebook_path = os.path.join(tmp_path, 'book.epub')
+    epub.write_epub(ebook_path, [epub.Entry('epub/text/1.xhtml', path=text_path)])
+
+    with ZipFile(ebook_path) as z:
+        assert z.getinfo('epub/text/1.xhtml').date_time == (1980, 1, 1, 0, 0, 0)
@@ -0,0 +1,67 @@
+import os
+
+from syncabook import preflight
+from .conftest import create_chapter
+
+
+def _create_chapter(book_dir, name, words, seconds):
+    create_chapter(book_dir, name, text=' '.join(['word'] * words), seconds=seconds)
+
+
+def test_check_book(tmp_path):
+    book_dir = str(tmp_path)
+    # 120 words per minute
+    _create_chapter(book_dir, '1', 238, 120)
+    _create_chapter(book_dir, '2', 118, 60)
+    _create_chapter(book_dir, '3', 358, 180)
+    _create_chapter(book_dir, '4', 118, 60)
+
+    report = preflight.check_book(book_dir)
+    assert report['problems'] == []
+    assert report['words_per_minute'] == 120
+    assert [p['words'] for p in report['pairs']] == [240, 120, 360, 120]
+    assert [p['duration'] for p in report['pairs']] == [120, 60, 180, 60]
+    assert report['split_command'] is None
+
+    # text of chapter 3 is missing, so the following chapters are paired with wrong audio
+    os.remove(os.path.join(book_dir, 'sync_text', '3.xhtml'))
+    with open(os.path.join(book_dir, 'text.txt'), 'w') as f:
+        f.write('text')
+    report = preflight.check_book(book_dir)
+    assert [(p['text'], p['audio'], p['outlier']) for p in report['pairs']] == [
+        ('1.xhtml', '1.wav', False),
+        ('2.xhtml', '2.wav', False),
+        ('4.xhtml', '3.wav', True),
+        (None, '4.wav', False),
+    ]
+    assert report['problems'] == [
+        'There are 3 text files and 4 audio files.',
+        '4.xhtml is expected to take 0:01:00 but 3.wav takes 0:03:00.',
+    ]
+    assert report['split_command'].endswith(' --mode equal --n 4')
+
+    report = preflight.check_book(book_dir, words_per_minute=60, max_deviation=1.8)
+    assert [p['outlier'] for p in report['pairs']] == [True, True, False, False]
+
+
+def test_count_words_with_html_entities(tmp_path):
+    path = os.path.join(tmp_path, '1.xhtml')
+    with open(path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Title words</title></head>'
+            '<body><h1>Chapter&nbsp;1</h1><p>Fish &amp; chips &mdash; again.</p></body></html>'
+        )
+    # a non-breaking space separates words too
+    assert preflight.count_words(path) == 7
+
+
+def test_check_book_reports_unreadable_text(tmp_path):
+    book_dir = str(tmp_path)
+    _create_chapter(book_dir, '1', 120, 60)
+    with open(os.path.join(book_dir, 'sync_text', '1.xhtml'), 'wb') as f:
+        f.write(b'')
+
+    report = preflight.check_book(book_dir)
+    assert report['pairs'][0]['words'] is None
+    assert report['problems'][0].startswith("Words of 1.xhtml can't be counted")
@@ -0,0 +1,56 @@
+import io
+import json
+import os
+
+import pytest
+
+from syncabook import profiling, to_xhtml
+
+
+@pytest.fixture
+def profiler():
+    profiling.enable()
+    yield
+    profiling.disable()
+
+
+def test_stages_are_noop_when_disabled():
+    assert not profiling.is_enabled()
+    assert profiling.stage('a') is profiling.stage('b', chapter='1.txt')
+    assert profiling.traced(len) is len
+    assert profiling.collect(42) == 42
+
+
+def test_stages_and_trace(tmp_path, profiler):
+    input_dir = tmp_path / 'text'
+    input_dir.mkdir()
+    for i in range(1, 4):
+        (input_dir / f'{i}.txt').write_text('One. Two.\n\nThree.')
+
+    with profiling.stage('to_xhtml'):
+        # files are converted in worker processes
+        to_xhtml.textfiles_to_xhtml_files(input_dir, tmp_path / 'xhtml', 'sentence', jobs=2)
+
+    with pytest.raises(ValueError):
+        with profiling.stage('failing', chapter='1.txt'):
+            raise ValueError
+
+    summary = {total['name']: total for total in profiling.get_summary()}
+    assert list(summary) == ['to_xhtml', 'to_xhtml_file', 'failing']
+    assert summary['to_xhtml_file']['calls'] == 3
+
+    trace_path = os.path.join(tmp_path, 'trace.json')
+    profiling.write_trace(trace_path)
+    with open(trace_path) as f:
+        events = json.load(f)['traceEvents']
+    assert {e['ph'] for e in events} == {'X'}
+    file_events = [e for e in events if e['name'] == 'to_xhtml_file']
+    assert sorted(e['args']['text_file'] for e in file_events) == ['1.txt', '2.txt', '3.txt']
+    assert all(e['pid'] != os.getpid() for e in file_events)
+    failing_event, = [e for e in events if e['name'] == 'failing']
+    assert failing_event['args']['failed'] is True
+    assert failing_event['args']['chapter'] == '1.txt'
+
+    output = io.StringIO()
+    profiling.print_summary(output)
+    assert output.getvalue().splitlines()[3].startswith('to_xhtml_file ')
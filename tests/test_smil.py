@@ -0,0 +1,38 @@
+import os.path
+
+import pytest
+
+from syncabook import smil
+
+
+def test_parse_clockvalue():
+    assert smil.parse_clockvalue('0:00:02.680') == 2680
+    assert smil.parse_clockvalue('12:01:02') == 43262000
+    assert smil.parse_clockvalue('01:02.5') == 62500
+    assert smil.parse_clockvalue('12.5s') == 12500
+    assert smil.parse_clockvalue('12.5') == 12500
+    assert smil.parse_clockvalue('2min') == 120000
+    assert smil.parse_clockvalue('1.5h') == 5400000
+    assert smil.parse_clockvalue('250ms') == 250
+    assert smil.parse_clockvalue('0.0005s') == 1
+
+
+def test_parse_invalid_clockvalue():
+    with pytest.raises(ValueError):
+        smil.parse_clockvalue('1:2:3')
+
+
+def test_get_media_duration(tmp_path):
+    smil_path = os.path.join(tmp_path, '1.smil')
+    with open(smil_path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<smil xmlns="http://www.w3.org/ns/SMIL" version="3.0"><body><seq>\n'
+            '<par><text src="../text/1.xhtml#f1"/>'
+            '<audio src="../audio/1.mp3" clipBegin="0:00:00.000" clipEnd="0:00:02.680"/></par>\n'
+            '<par><text src="../text/1.xhtml#f2"/>'
+            '<audio src="../audio/1.mp3" clipBegin="2.68s" clipEnd="00:05.5"/></par>\n'
+            '</seq></body></smil>\n'
+        )
+    assert smil.get_media_duration(smil_path) == 5500
+    assert smil.get_media_durations([smil_path, smil_path], jobs=2) == [5500, 5500]
@@ -1,3 +1,7 @@
+import io
+import os.path
+import re
+
 from syncabook import split_text
 
 
@@ -32,3 +36,47 @@ def test_split_text_by_delimeter():
         'Title by author\n\nChapter one weird name\n\nThis is CHAPTER 1.',
         'Even more weird name of chapter II\n\nThis is CHAPTER 2'
     ]
+
+
+def test_split_text_into_n_parts():
+    text = (
+        'One two three four.\n\n'
+        'Five six.\n\n'
+        'Seven eight nine ten.\n\n'
+        'Eleven twelve.'
+    )
+    texts = split_text._split_text_into_n_parts(2, text)
+    assert texts == [
+        'One two three four.\n\nFive six.\n\n',
+        'Seven eight nine ten.\n\nEleven twelve.'
+    ]
+    assert ''.join(split_text._split_text_into_n_parts(3, text)) == text
+    assert split_text._split_text_into_n_parts(10, 'No boundaries\n\n') == ['No boundaries\n\n']
+
+
+def test_iter_tokens_across_chunks():
+    text = 'Intro\n\nCHAPTER 1\n\nOne.\n\nCHAPTER 22\n\nTwo.'
+    regex = re.compile('\n\nCHAPTER \\d+\n\n')
+    tokens = list(split_text._iter_tokens(io.StringIO(text), regex, chunk_size=3, lookahead=16))
+    assert ''.join(s for _, s in tokens) == text
+    assert [s for kind, s in tokens if kind == 'match'] == ['\n\nCHAPTER 1\n\n', '\n\nCHAPTER 22\n\n']
+
+
+def test_iter_tokens_keeps_context_across_chunks():
+    text = 'A mind.\n\nRemind me.\n\nMinding. Mind it.'
+    for pattern in ['\\bmind\\w*', '(?<=\\.\\n\\n)\\w+', '^A', '(?<!Re)mind']:
+        regex = re.compile(pattern, re.IGNORECASE)
+        tokens = list(split_text._iter_tokens(io.StringIO(text), regex, chunk_size=3, lookahead=4))
+        assert ''.join(s for _, s in tokens) == text
+        assert [m.group() for m in regex.finditer(text)] == [s for kind, s in tokens if kind == 'match']
+
+
+def test_split_text(tmp_path):
+    text_file = os.path.join(tmp_path, 'text.txt')
+    with open(text_file, 'w') as f:
+        f.write('Title\n\nCHAPTER 1\n\nOne.\n\nCHAPTER 2\n\nTwo.')
+    output_dir = os.path.join(tmp_path, 'out')
+    split_text.split_text(text_file, output_dir, 'opening', '\n\nCHAPTER \\d+\n\n', None)
+    assert sorted(os.listdir(output_dir)) == ['1.txt', '2.txt']
+    with open(os.path.join(output_dir, '2.txt')) as f:
+        assert f.read() == '\n\nCHAPTER 2\n\nTwo.'
@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+import pytest
+
+
+COMMANDS = (
+    'download_files', 'split_text', 'to_xhtml', 'check', 'prepare_audio', 'sync', 'create', 'watch', 'batch',
+)
+
+# Modules that take longer to import than the whole startup should.
+HEAVY_MODULES = ('bs4', 'jinja2', 'lxml', 'progressbar', 'http.client', 'syncabook.sync')
+
+
+def _get_imports(command):
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'syncabook', command, '--help'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+    )
+    imports = set()
+    for line in completed.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        imports.add(line.rpartition('|')[2].strip())
+    return imports
+
+
+@pytest.mark.parametrize('command', COMMANDS)
+def test_help_imports_no_heavy_modules(command):
+    imports = _get_imports(command)
+    assert 'syncabook.defaults' in imports
+    assert [m for m in HEAVY_MODULES if m in imports] == []
@@ -0,0 +1,109 @@
+import os.path
+
+import pytest
+
+from syncabook import sync
+from .conftest import create_chapter, get_calls
+
+
+def test_get_chapters_timings():
+    sync_map = {
+        '1.xhtml': {
+            'f1': {'audio_file': '1.mp3', 'begin_time': '0:00:00.000', 'end_time': '0:00:02.680'},
+            'f2': {'audio_file': '1.mp3', 'begin_time': '0:00:02.680', 'end_time': '0:00:04.000'},
+        },
+    }
+    chapters = sync._get_chapters_timings(sync_map)
+    assert chapters == {
+        '1.smil': {
+            'text_file': '1.xhtml',
+            'fragments': [
+                {'id': 'f1', 'audio_file': '1.mp3', 'begin': 0, 'end': 2680},
+                {'id': 'f2', 'audio_file': '1.mp3', 'begin': 2680, 'end': 4000},
+            ],
+            'duration': 4000,
+        }
+    }
+
+
+def test_sync_chapters_in_parallel(book_dir):
+    calls_path = os.environ['FAKE_AFALIGNER_CALLS']
+
+    chapters = sync.sync(book_dir, None, None, 'eng', jobs=2)
+    assert list(chapters) == ['1.smil', '3.smil']
+    assert chapters['3.smil']['duration'] == 500
+    with open(os.path.join(book_dir, 'smil', '3.smil')) as f:
+        assert f.read() == '3.mp3'
+    assert get_calls(calls_path) == ['1.xhtml', '3.xhtml']
+
+    create_chapter(book_dir, '2')
+    os.remove(os.path.join(book_dir, 'smil', '3.smil'))
+
+    with pytest.raises(sync.SyncError) as e:
+        sync.sync(book_dir, None, None, 'eng', jobs=2)
+    assert e.value.failures == {'2.xhtml': 'RuntimeError: bad chapter'}
+    # chapters 1 and 3 are taken from the cache
+    assert get_calls(calls_path) == ['2.xhtml']
+    with open(os.path.join(book_dir, 'smil', '3.smil')) as f:
+        assert f.read() == '3.mp3'
+
+
+def test_sync_whole_book_by_default(book_dir):
+    calls_path = os.environ['FAKE_AFALIGNER_CALLS']
+
+    chapters = sync.sync(book_dir, None, None, 'eng', use_cache=False)
+    assert list(chapters) == ['1.smil', '3.smil']
+    with open(calls_path) as f:
+        assert f.read() == '1.xhtml 3.xhtml\n'
+
+
+def test_resume_sync(book_dir, monkeypatch):
+    calls_path = os.environ['FAKE_AFALIGNER_CALLS']
+    create_chapter(book_dir, '2')
+
+    with pytest.raises(sync.SyncError):
+        sync.sync(book_dir, None, None, 'eng', jobs=2, use_cache=False)
+    assert get_calls(calls_path) == ['1.xhtml', '2.xhtml', '3.xhtml']
+    assert not sync.is_sync_complete(book_dir)
+
+    monkeypatch.delenv('FAKE_AFALIGNER_FAIL')
+    chapters = sync.sync(book_dir, None, None, 'eng', use_cache=False, resume=True)
+    assert get_calls(calls_path) == ['2.xhtml']
+    assert list(chapters) == ['1.smil', '2.smil', '3.smil']
+    assert sync.is_sync_complete(book_dir)
+
+    # a changed chapter is stale
+    create_chapter(book_dir, '3')
+    with open(os.path.join(book_dir, 'audio', '3.mp3'), 'wb') as f:
+        f.write(b'new audio')
+    sync.sync(book_dir, None, None, 'eng', use_cache=False, resume=True)
+    assert get_calls(calls_path) == ['3.xhtml']
+
+
+def test_get_text_fragments_with_html_entities(tmp_path):
+    text_path = os.path.join(tmp_path, '1.xhtml')
+    with open(text_path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+            '<h2 id="f1">Chapter&nbsp;1</h2><p><span id="f2">Fish &amp; <i>chips</i>.</span></p>'
+            '</body></html>'
+        )
+    assert sync.get_text_fragments(text_path) == [('f1', 'Chapter\xa01'), ('f2', 'Fish & chips.')]
+
+
+def test_resume_after_failure_by_chapter(book_dir, monkeypatch):
+    calls_path = os.environ['FAKE_AFALIGNER_CALLS']
+    create_chapter(book_dir, '2')
+
+    with pytest.raises(sync.SyncError) as e:
+        sync.sync(book_dir, None, None, 'eng', use_cache=False, by_chapter=True)
+    assert list(e.value.failures) == ['2.xhtml']
+    assert get_calls(calls_path) == ['1.xhtml', '2.xhtml', '3.xhtml']
+    assert not sync.is_sync_complete(book_dir)
+
+    monkeypatch.delenv('FAKE_AFALIGNER_FAIL')
+    chapters = sync.sync(book_dir, None, None, 'eng', use_cache=False, resume=True)
+    assert get_calls(calls_path) == ['2.xhtml']
+    assert list(chapters) == ['1.smil', '2.smil', '3.smil']
+    assert sync.is_sync_complete(book_dir)
@@ -16,4 +16,68 @@ def test_get_paragraphs():
 def test_get_sentences():
     paragraphs_content = 'One. Two. Fourty two... Five, six'
     sentences = to_xhtml._get_sentences(paragraphs_content)
-    assert sentences == ['One. ', 'Two. ', 'Fourty two... ', 'Five, six']
\ No newline at end of file
+    assert sentences == ['One. ', 'Two. ', 'Fourty two... ', 'Five, six']
+
+
+def test_textfiles_to_xhtml_files_numbers_fragments_across_files(tmp_path):
+    input_dir = tmp_path / 'text'
+    input_dir.mkdir()
+    (input_dir / '1.txt').write_text('One. Two.\n\nThree.')
+    (input_dir / '2.txt').write_text('Four.\n\nFive. Six. Seven. Eight. Nine. Ten.')
+    output_dir = tmp_path / 'xhtml'
+
+    to_xhtml.textfiles_to_xhtml_files(input_dir, output_dir, fragment_type='sentence')
+
+    first = (output_dir / '1.xhtml').read_text()
+    second = (output_dir / '2.xhtml').read_text()
+    assert 'id="f01"' in first and 'id="f03"' in first
+    assert 'id="f04"' in second and 'id="f10"' in second
+    assert 'id="f04"' not in first
+
+
+def test_textfiles_to_xhtml_files_segments_text_once(tmp_path, monkeypatch):
+    input_dir = tmp_path / 'text'
+    input_dir.mkdir()
+    (input_dir / '1.txt').write_text('One. Two.\n\nThree.')
+    (input_dir / '2.txt').write_text('Four.')
+    segmented = []
+    get_sentences = to_xhtml._get_sentences
+
+    def _get_sentences(text, *args):
+        segmented.append(text)
+        return get_sentences(text, *args)
+
+    monkeypatch.setattr(to_xhtml, '_get_sentences', _get_sentences)
+
+    to_xhtml.textfiles_to_xhtml_files(input_dir, tmp_path / 'xhtml', fragment_type='sentence')
+
+    assert segmented == ['One. Two.', 'Three.', 'Four.']
+    assert 'id="f4"' in (tmp_path / 'xhtml' / '2.xhtml').read_text()
+
+
+def test_get_sentences_rules():
+    paragraphs_content = (
+        'Mr. Smith met Dr. J. Watson at 5 p.m. on Baker St. in London. '
+        '"Are you well?" he asked. "Quite!" Then they left (for good.) The end... or not.'
+    )
+    sentences = to_xhtml._get_sentences(paragraphs_content, segmenter='rules', language='eng')
+    assert sentences == [
+        'Mr. Smith met Dr. J. Watson at 5 p.m. on Baker St. in London. ',
+        '"Are you well?" he asked. ',
+        '"Quite!" ',
+        'Then they left (for good.) ',
+        'The end... or not.',
+    ]
+    assert ''.join(sentences) == paragraphs_content
+
+
+def test_get_sentences_rules_common_words():
+    paragraphs_content = 'Did you go? No. He stayed home. So am I. Then we left for No. 10 with J. Smith.'
+    sentences = to_xhtml._get_sentences(paragraphs_content, segmenter='rules', language='eng')
+    assert sentences == [
+        'Did you go? ',
+        'No. ',
+        'He stayed home. ',
+        'So am I. ',
+        'Then we left for No. 10 with J. Smith.',
+    ]
@@ -0,0 +1,47 @@
+from syncabook import toc
+
+
+XHTML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{title}</title></head>'
+    '<body>{body}</body></html>'
+)
+
+
+def test_heading_extractor_stops_after_first_heading():
+    extractor = toc.HeadingExtractor()
+    document = XHTML.format(title='T', body='<p>x</p><h2 id="f1">Chapter <span>One</span> </h2><h1>No</h1>')
+    head, tail = document.split('</h2>')
+    assert extractor.feed(head.encode()) is False
+    assert extractor.feed(b'</h2>') is True
+    # the rest of the document isn't parsed
+    assert extractor.feed(b'<<not xml') is True
+    assert extractor.heading == (2, 'Chapter One')
+
+
+def test_heading_with_html_entities(tmp_path):
+    path = tmp_path / '1.xhtml'
+    path.write_text(XHTML.format(title='T', body='<h2>Chapter&nbsp;I &mdash; Fish &amp; Chips</h2>'))
+    assert toc.get_first_heading(path) == (2, 'Chapter I — Fish & Chips')
+
+
+def test_get_toc_nests_by_heading_level(tmp_path):
+    bodies = {
+        '1.xhtml': '<h1>Part One</h1>',
+        '2.xhtml': '<h2>Chapter 1</h2>',
+        '3.xhtml': '<p>No heading</p>',
+        '4.xhtml': '<h1>Part Two</h1>',
+        '5.xhtml': '<h3>Section</h3>',
+    }
+    for name, body in bodies.items():
+        (tmp_path / name).write_text(XHTML.format(title=name, body=body))
+
+    items = toc.get_toc(tmp_path, sorted(bodies))
+
+    def outline(items):
+        return [(x['toc_name'], outline(x['children'])) for x in items]
+
+    assert outline(items) == [
+        ('Part One', [('Chapter 1', []), (3, [])]),
+        ('Part Two', [('Section', [])]),
+    ]
@@ -0,0 +1,126 @@
+import json
+import os.path
+import threading
+import time
+import zipfile
+
+from syncabook import watch
+from syncabook.create import create_ebook
+from syncabook.to_xhtml import textfiles_to_xhtml_files
+from .conftest import create_chapter, write_smil
+
+
+def _create_book(book_dir):
+    for name in ['1', '2']:
+        create_chapter(book_dir, name, text='The first sentence. The second one.', plaintext=True)
+        write_smil(book_dir, name)
+    textfiles_to_xhtml_files(
+        os.path.join(book_dir, 'plaintext'), os.path.join(book_dir, 'sync_text'), 'sentence',
+        include_heading=True
+    )
+    with open(os.path.join(book_dir, 'metadata.json'), 'w') as f:
+        json.dump({'title': 'A Book', 'author': 'Author', 'description': '', 'narrator': ''}, f)
+
+
+def _edit(path, old, new):
+    with open(path) as f:
+        content = f.read()
+    with open(path, 'w') as f:
+        f.write(content.replace(old, new))
+
+
+def test_scan_ignores_output(tmp_path):
+    book_dir = str(tmp_path)
+    _create_book(book_dir)
+    snapshot = watch.scan(book_dir)
+    assert 'sync_text/1.xhtml' in snapshot and 'metadata.json' in snapshot
+
+    os.makedirs(os.path.join(book_dir, 'out'))
+    with open(os.path.join(book_dir, 'out', 'a_book.epub'), 'w') as f:
+        f.write('')
+    with open(os.path.join(book_dir, 'smil', 'durations.json'), 'w') as f:
+        f.write('{}')
+    assert watch.scan(book_dir) == snapshot
+
+    os.remove(os.path.join(book_dir, 'audio', '2.mp3'))
+    _edit(os.path.join(book_dir, 'sync_text', '1.xhtml'), 'first', 'very first')
+    assert watch.get_changed_files(snapshot, watch.scan(book_dir)) == ['audio/2.mp3', 'sync_text/1.xhtml']
+
+
+def test_watch_rebuilds_on_change(tmp_path, capsys):
+    book_dir = str(tmp_path)
+    _create_book(book_dir)
+    text_path = os.path.join(book_dir, 'sync_text', '2.xhtml')
+
+    thread = threading.Thread(target=watch.watch, args=(book_dir,), kwargs={
+        'interval': 0.05, 'use_inotify': False, 'rebuilds': 1,
+    })
+    thread.start()
+    ebook_path = os.path.join(book_dir, 'out', 'a_book.epub')
+    deadline = time.time() + 10
+    while 'Watching' not in capsys.readouterr().out and time.time() < deadline:
+        time.sleep(0.01)
+    # mtime may have a coarse resolution, so the size changes too
+    _edit(text_path, 'Chapter 2', 'Chapter Two')
+    thread.join(10)
+    assert not thread.is_alive()
+
+    with zipfile.ZipFile(ebook_path) as ebook:
+        assert 'Chapter Two' in ebook.read('epub/text/2.xhtml').decode()
+        assert 'Chapter Two' in ebook.read('epub/text/nav.xhtml').decode()
+
+
+def test_builder_keeps_edited_nav_and_warns_about_fragments(tmp_path, capsys):
+    book_dir = str(tmp_path)
+    _create_book(book_dir)
+    builder = watch.Builder(book_dir)
+    builder.build()
+
+    nav_path = builder.nav_path
+    _edit(nav_path, 'Chapter 1', 'The Beginning')
+    text_path = os.path.join(book_dir, 'sync_text', '2.xhtml')
+    _edit(text_path, '<span id="f6">The second one.</span>', '')
+    capsys.readouterr()
+    builder.build()
+
+    assert 'Fragments of' in capsys.readouterr().out
+    with open(nav_path) as f:
+        assert 'The Beginning' in f.read()
+
+
+def test_builder_refreshes_nav_created_earlier(tmp_path):
+    book_dir = str(tmp_path)
+    _create_book(book_dir)
+    create_ebook(book_dir, interactive=False)
+    _edit(os.path.join(book_dir, 'sync_text', '1.xhtml'), 'Chapter 1', 'The Beginning')
+
+    builder = watch.Builder(book_dir)
+    builder.build()
+
+    with open(builder.nav_path) as f:
+        assert 'The Beginning' in f.read()
+
+
+def test_watch_survives_failed_first_build(tmp_path, capsys):
+    book_dir = str(tmp_path)
+    _create_book(book_dir)
+    metadata_path = os.path.join(book_dir, 'metadata.json')
+    with open(metadata_path, 'w') as f:
+        f.write('{')
+
+    thread = threading.Thread(target=watch.watch, args=(book_dir,), kwargs={
+        'interval': 0.05, 'use_inotify': False, 'rebuilds': 1,
+    })
+    thread.start()
+    deadline = time.time() + 10
+    output = ''
+    while 'Watching' not in output and time.time() < deadline:
+        output += capsys.readouterr().out
+        time.sleep(0.01)
+    with open(metadata_path, 'w') as f:
+        json.dump({'title': 'A Book', 'author': 'Author', 'description': '', 'narrator': ''}, f)
+    thread.join(10)
+    assert not thread.is_alive()
+
+    assert 'The ebook has not been built' in output
+    assert os.path.exists(os.path.join(book_dir, 'out', 'a_book.epub'))